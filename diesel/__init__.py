@@ -3,7 +3,7 @@ from logmod import log, levels as loglevels, set_log_level
 import events
 from core import sleep, Loop, wait, fire, thread, until, Connection, UDPSocket, ConnectionClosed, ClientConnectionClosed, signal
 from core import until_eol, send, receive, call, first, fork, fork_child, label, fork_from_thread
-from core import ParentDiedException, ClientConnectionError, TerminateLoop, datagram
+from core import ParentDiedException, ClientConnectionError, TerminateLoop, datagram, ConnectionTimeout
 from app import Application, Service, UDPService, quickstart, quickstop, Thunk
 from client import Client, UDPClient
 from resolver import resolve_dns_name, DNSResolutionError
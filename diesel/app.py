@@ -4,7 +4,6 @@
 import os
 import gc
 import cProfile
-from OpenSSL import SSL
 import socket
 import traceback
 import errno
@@ -12,7 +11,10 @@ from greenlet import greenlet
 
 from diesel.hub import EventHub
 from diesel import log, Connection, UDPSocket, Loop
-from diesel.security import ssl_async_handshake
+from diesel.core import UDPDispatchSocket, Deadlines
+from diesel.security import ssl_async_handshake, get_backend
+from diesel.sockopts import get_profile
+from diesel import unix
 from diesel import runtime
 from diesel.events import WaitPool
 
@@ -146,7 +148,7 @@ class Application(object):
         will return.
         '''
         for s in self._services:
-            s.sock.close()
+            s.close()
         raise ApplicationEnd()
 
     def setup(self):
@@ -161,19 +163,42 @@ class Service(object):
     implemented by a passed connection handler.
     '''
     LQUEUE_SIZ = 500
-    def __init__(self, connection_handler, port, iface='', ssl_ctx=None, track=False):
+    def __init__(self, connection_handler, port=None, iface='', ssl_ctx=None, track=False, sockopts=None, path=None,
+            idle_timeout=None, read_timeout=None, write_timeout=None, rate_limit=None):
         '''Given a protocol-implementing callable `connection_handler`,
         handle connections on port `port`.
 
         Interface defaults to all interfaces, but overridable with `iface`.
+
+        Pass `path` instead of `port` to listen on a Unix domain socket
+        (prefix it with '@' for the abstract namespace).  Handlers then get
+        a diesel.unix.UnixPeer, with the peer's credentials, as `addr`.
+
+        `sockopts` is a diesel.sockopts.SocketProfile (or the name of a
+        stock one) applied to the listening and accepted sockets.
+
+        `idle_timeout`, `read_timeout` and `write_timeout` (seconds) have
+        the hub close accepted connections that stall; see
+        diesel.core.Deadlines.
+
+        `rate_limit` (a diesel.util.ratelimit limiter) caps how fast new
+        connections are accepted.  Over the limit, the service stops
+        polling its socket until a token is due, so the backlog waits in
+        the kernel.
         '''
+        assert (port is None) != (path is None), "Service needs one of port or path"
         self.port = port
+        self.path = path
         self.iface = iface
         self.sock = None
         self.connection_handler = connection_handler
         self.application = None
         self.ssl_ctx = ssl_ctx
         self.track = track
+        self.sockopts = get_profile(sockopts)
+        self.deadlines = Deadlines.create(idle_timeout, read_timeout, write_timeout)
+        self.rate_limit = rate_limit
+        self._identity = None
         # Call this last so the connection_handler has a fully-instantiated
         # Service instance at its disposal.
         if hasattr(connection_handler, 'on_service_init'):
@@ -181,8 +206,11 @@ class Service(object):
                 connection_handler.on_service_init(self)
 
     def handle_cannot_bind(self, reason):
-        log.critical("service at {0}:{1} cannot bind: {2}",
-            self.iface or '*', self.port, reason)
+        if self.path:
+            log.critical("service at {0} cannot bind: {1}", self.path, reason)
+        else:
+            log.critical("service at {0}:{1} cannot bind: {2}",
+                self.iface or '*', self.port, reason)
         raise
 
     def register(self, app):
@@ -194,24 +222,60 @@ class Service(object):
         )
 
     def bind_and_listen(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.path:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = unix.socket_address(self.path)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            address = (self.iface, self.port)
         sock.setblocking(0)
 
         try:
-            sock.bind((self.iface, self.port))
+            if self.path:
+                unix.remove_stale_socket(self.path)
+            sock.bind(address)
         except socket.error, e:
             self.handle_cannot_bind(str(e))
 
+        if self.path:
+            self._identity = unix.socket_identity(self.path)
+        if self.sockopts and not self.path:
+            self.sockopts.apply_listening(sock)
         sock.listen(self.LQUEUE_SIZ)
         self.sock = sock
-        self.port = sock.getsockname()[1] # in case of 0 binds
+        if not self.path:
+            self.port = sock.getsockname()[1] # in case of 0 binds
+
+    def _resume_accepting(self):
+        try:
+            self.sock.fileno()
+        except socket.error:
+            return # closed in the meantime
+        self.register(self.application)
 
     @property
     def listening(self):
         return self.sock is not None
 
+    def close(self):
+        '''Stop listening.  A Unix socket's file is removed, unless
+        another server has since taken the path over.
+        '''
+        if self.sock is None:
+            return
+        if self.application:
+            self.application.hub.unregister(self.sock)
+        self.sock.close()
+        if self.path:
+            unix.remove_socket(self.path, self._identity)
+
     def accept_new_connection(self):
+        if self.rate_limit and not self.rate_limit.try_acquire():
+            hub = self.application.hub
+            hub.unregister(self.sock)
+            hub.call_later(self.rate_limit.delay(), self._resume_accepting)
+            return
         try:
             sock, addr = self.sock.accept()
         except socket.error, e:
@@ -220,16 +284,24 @@ class Service(object):
                 return
             raise
         sock.setblocking(0)
-        def make_connection():
-            c = Connection(sock, addr)
+        if self.path:
+            addr = unix.UnixPeer(self.path, *unix.peer_credentials(sock))
+        elif self.sockopts:
+            self.sockopts.apply_accepted(sock)
+        tls = None
+        def make_connection(e=None):
+            if e is not None:
+                # Failed handshake; nothing to hand to the handler.
+                sock.close()
+                return
+            c = Connection(sock, addr, self.deadlines, tls)
             l = Loop(self.connection_handler, addr)
             l.connection_stack.append(c)
             runtime.current_app.add_loop(l, track=self.track)
         if self.ssl_ctx:
-            sock = SSL.Connection(self.ssl_ctx, sock)
-            sock.set_accept_state()
-            sock.setblocking(0)
-            ssl_async_handshake(sock, self.application.hub, make_connection)
+            tls = get_backend(self.ssl_ctx)
+            sock = tls.wrap_server(self.ssl_ctx, sock)
+            ssl_async_handshake(sock, self.application.hub, make_connection, tls)
         else:
             make_connection()
 
@@ -243,15 +315,22 @@ class UDPService(Service):
     '''A UDP service listening on a certain port, with a protocol
     implemented by a passed connection handler.
     '''
-    def __init__(self, connection_handler, port, iface=''):
-        Service.__init__(self, connection_handler, port, iface)
+    def __init__(self, connection_handler, port, iface='', sockopts=None, workers=None):
+        '''`workers` runs that many copies of `connection_handler`, each in
+        its own loop; datagrams are routed to a worker by peer address, so
+        every peer always talks to the same loop.
+        '''
+        Service.__init__(self, connection_handler, port, iface, sockopts=sockopts)
         self.remote_addr = (None, None)
+        self.workers = workers
 
     def bind_and_listen(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # unsure if the following two lines are necessary for UDP
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.setblocking(0)
+        if self.sockopts:
+            self.sockopts.apply_datagram(sock)
 
         try:
             sock.bind((self.iface, self.port))
@@ -259,10 +338,14 @@ class UDPService(Service):
             self.handle_cannot_bind(str(e))
 
         self.sock = sock
-        c = UDPSocket(self, sock)
-        l = Loop(self.connection_handler)
-        l.connection_stack.append(c)
-        runtime.current_app.add_loop(l)
+        if self.workers:
+            conns = UDPDispatchSocket(self, sock, self.workers).channels
+        else:
+            conns = [UDPSocket(self, sock)]
+        for c in conns:
+            l = Loop(self.connection_handler)
+            l.connection_stack.append(c)
+            runtime.current_app.add_loop(l)
 
     def register(self, app):
         pass
@@ -1,42 +1,121 @@
 # vim:ts=4:sw=4:expandtab
 import errno
+import random
 import socket
+import time
+
+from diesel.events import Waiter
+from diesel.sockopts import get_profile
+from diesel.unix import socket_address
+
+# Seconds between starting connects to successive addresses of a host.
+CONNECT_DELAY = 0.25
+# How long an address that failed to connect is tried after the others.
+FAILED_TTL = 60
+
+# (ip, port) -> when connecting to it last failed.
+_failed = {}
 
 class Client(object):
     '''An agent that connects to an external host and provides an API to
     return data based on a protocol across that host.
+
+    Pass `path` instead of `addr` and `port` to connect to a Unix domain
+    socket (prefix it with '@' for the abstract namespace).
+
+    `timeout` bounds connecting; `idle_timeout`, `read_timeout` and
+    `write_timeout` have the hub close the connection when it stalls
+    afterwards (see diesel.core.Deadlines).
+
+    With `ssl_ctx`, passing a diesel.security.SessionCache as
+    `ssl_session_cache` lets reconnects resume earlier TLS sessions.
+
+    When `addr` has several addresses (of `family`; set it to AF_UNSPEC
+    to use IPv6 too), connects to them are started CONNECT_DELAY apart
+    without waiting for earlier ones to fail, and the first to succeed is
+    kept.  Addresses that failed in the last FAILED_TTL seconds are tried
+    last.
     '''
-    def __init__(self, addr, port, ssl_ctx=None, timeout=None, source_ip=None): 
+    deadlines = None
+    ssl_session_cache = None
+    family = socket.AF_INET
+
+    def __init__(self, addr=None, port=None, ssl_ctx=None, timeout=None, source_ip=None, sockopts=None, path=None,
+            idle_timeout=None, read_timeout=None, write_timeout=None, ssl_session_cache=None):
+        from core import Deadlines
         self.ssl_ctx = ssl_ctx
+        self.ssl_session_cache = ssl_session_cache
+        self.sockopts = get_profile(sockopts)
+        self.deadlines = Deadlines.create(idle_timeout, read_timeout, write_timeout)
         self.connected = False
         self.conn = None
-        self.addr = addr
-        self.port = port
-
-        ip = self._resolve(self.addr)
-        self._setup_socket(ip, timeout, source_ip)
+        self.path = path
+        if path:
+            self.addr = path
+            self.port = None
+            self._setup_unix_socket(timeout)
+        else:
+            self.addr = addr
+            self.port = port
+            ips = self._resolve_all(self.addr)
+            if len(ips) == 1:
+                self._setup_socket(ips[0], timeout, source_ip)
+            else:
+                self._race(ips, timeout, source_ip)
 
-    def _resolve(self, addr):
-        from resolver import resolve_dns_name
-        return resolve_dns_name(addr)
+    def _resolve_all(self, addr):
+        from resolver import resolve_all
+        return resolve_all(addr, self.family)
 
-    def _setup_socket(self, ip, timeout, source_ip=None):
-    
-        from core import _private_connect
-        remote_addr = (ip, self.port)
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def _socket(self, ip, source_ip=None):
+        family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
         sock.setblocking(0)
+        if self.sockopts:
+            self.sockopts.apply_outbound(sock, source_ip)
 
         if source_ip:
             sock.bind((source_ip, 0))
-    
+        return sock
+
+    def _setup_socket(self, ip, timeout, source_ip=None):
+        sock = self._socket(ip, source_ip)
+        self._connect(sock, (ip, self.port), ip, timeout)
+
+    def _race(self, ips, timeout, source_ip=None):
+        '''Connect to whichever of `ips` answers first, then set up the
+        connection on that socket as _connect() would.
+        '''
+        from core import _private_connect, ClientConnectionError, ClientConnectionTimeout
+        start = time.time()
+        race = _Race(_order(ips, self.port))
+        try:
+            ip, sock = race.run(self, source_ip, timeout)
+        except ClientConnectionTimeout:
+            raise ClientConnectionTimeout("connection timeout (%s:%s)" % (self.addr, self.port))
+        except ClientConnectionError:
+            raise ClientConnectionError("Could not connect to remote host (%s:%s)"
+                    % (self.addr, self.port))
+        if timeout is not None:
+            timeout = max(timeout - (time.time() - start), 0.001)
+        # Already connected: the hub finds it writable straight away.
+        _private_connect(self, ip, sock, self.addr, self.port, timeout=timeout)
+
+    def _setup_unix_socket(self, timeout):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        self._connect(sock, socket_address(self.path), self.path, timeout)
+
+    def _connect(self, sock, remote_addr, ip, timeout):
+        from core import _private_connect
         try:
             sock.connect(remote_addr)
         except socket.error, e:
-            if e.args[0] == errno.EINPROGRESS:
-                _private_connect(self, ip, sock, self.addr, self.port, timeout=timeout)
-            else:
+            if e.args[0] != errno.EINPROGRESS:
                 raise
+        # Unix sockets usually connect immediately; the hub still sees the
+        # socket writable and finishes setup (and any TLS handshake).
+        _private_connect(self, ip, sock, self.addr, self.port, timeout=timeout)
 
     def on_connect(self):
         pass
@@ -51,6 +130,11 @@ class Client(object):
         '''Close the socket to the remote host.
         '''
         if not self.is_closed:
+            if self.ssl_ctx and self.ssl_session_cache is not None:
+                # TLS 1.3 tickets arrive after the handshake; keep the
+                # latest session.
+                self.ssl_session_cache.put((self.addr, self.port),
+                        self.conn.tls.get_session(self.conn.sock))
             self.conn.close()
             self.conn = None
             self.connected = True
@@ -59,14 +143,120 @@ class Client(object):
     def is_closed(self):
         return not self.conn or self.conn.closed
 
+def _order(ips, port):
+    '''`ips` shuffled, IPv6 and IPv4 alternating (starting with the family
+    of the first), recently failed ones last.
+    '''
+    now = time.time()
+    by_family = [[ip for ip in ips if ':' in ip], [ip for ip in ips if ':' not in ip]]
+    if by_family[1] and ':' not in ips[0]:
+        by_family.reverse()
+    ordered = []
+    for group in by_family:
+        random.shuffle(group)
+    while by_family[0] or by_family[1]:
+        for group in by_family:
+            if group:
+                ordered.append(group.pop())
+    if len(_failed) > 1000:
+        for key, when in _failed.items():
+            if now - when >= FAILED_TTL:
+                del _failed[key]
+    recent = lambda ip: now - _failed.get((ip, port), -FAILED_TTL) < FAILED_TTL
+    return sorted(ordered, key=recent)
+
+class _Race(Waiter):
+    '''Staggered connects to several addresses; run() returns the first
+    to connect.
+    '''
+    def __init__(self, ips):
+        self.ips = ips
+        self.attempts = {}
+        self.finished = []
+
+    def run(self, client, source_ip, timeout):
+        from core import first, ClientConnectionError, ClientConnectionTimeout
+        from runtime import current_app
+        self.hub = hub = current_app.hub
+        port = client.port
+        deadline = None if timeout is None else time.time() + timeout
+        next_start = 0
+        won = None
+        try:
+            while True:
+                now = time.time()
+                if self.ips and (now >= next_start or not self.attempts):
+                    self._start(client, self.ips.pop(0), source_ip)
+                    next_start = now + CONNECT_DELAY
+                    continue
+                for sock, ok in self.finished:
+                    ip = self.attempts.pop(sock)
+                    hub.unregister(sock)
+                    if ok:
+                        _failed.pop((ip, port), None)
+                        won = ip, sock
+                        return won
+                    _failed[(ip, port)] = now
+                    sock.close()
+                    # No point waiting out the delay for the next one.
+                    next_start = 0
+                del self.finished[:]
+                if not self.attempts and not self.ips:
+                    raise ClientConnectionError("no address connected")
+                if deadline is not None and now >= deadline:
+                    for ip in self.attempts.itervalues():
+                        _failed[(ip, port)] = now
+                    raise ClientConnectionTimeout("connection timeout")
+                wake = [t for t in (next_start if self.ips else None, deadline) if t is not None]
+                if wake:
+                    first(waits=[self], sleep=max(min(wake) - now, 0))
+                else:
+                    first(waits=[self])
+        finally:
+            for sock in self.attempts:
+                if won is None or sock is not won[1]:
+                    hub.unregister(sock)
+                    sock.close()
+
+    def _start(self, client, ip, source_ip):
+        try:
+            sock = client._socket(ip, source_ip)
+        except socket.error:
+            _failed[(ip, client.port)] = time.time()
+            return
+        self.attempts[sock] = ip
+        try:
+            sock.connect((ip, client.port))
+        except socket.error, e:
+            if e.args[0] != errno.EINPROGRESS:
+                self._done(sock, False)
+                return
+        def connected():
+            try:
+                sock.getpeername()
+            except socket.error:
+                self._done(sock, False)
+            else:
+                self._done(sock, True)
+        self.hub.register(sock, connected, connected, lambda: self._done(sock, False))
+        self.hub.enable_write(sock)
+
+    def _done(self, sock, ok):
+        from runtime import current_app
+        if not any(s is sock for s, _ in self.finished):
+            self.finished.append((sock, ok))
+            current_app.waits.fire(self, None)
+
 class UDPClient(Client):
-    def __init__(self, addr, port, source_ip=None):
-        super(UDPClient, self).__init__(addr, port, source_ip = source_ip)
+    def __init__(self, addr, port, source_ip=None, sockopts=None):
+        super(UDPClient, self).__init__(addr, port, source_ip = source_ip, sockopts=sockopts)
 
     def _setup_socket(self, ip, timeout, source_ip=None):
         from core import UDPSocket
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setblocking(0)
+        if self.sockopts:
+            self.sockopts.apply_datagram(sock)
 
         if source_ip:
             sock.bind((source_ip, 0))
@@ -74,8 +264,8 @@ class UDPClient(Client):
         self.conn = UDPSocket(self, sock, ip, self.port)
         self.connected = True
 
-    def _resolve(self, addr):
-        return addr
+    def _resolve_all(self, addr):
+        return [addr]
 
     class remote_addr(object):
         def __get__(self, inst, other):
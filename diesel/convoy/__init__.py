@@ -2,12 +2,11 @@ from collections import defaultdict
 from uuid import uuid4
 from time import time
 from random import choice
-import operator as op
 from palm.palm import ProtoBase
 from functools import partial
 
 from diesel import quickstart, Thunk, sleep, log, fork
-from diesel.util.queue import Queue, first
+from diesel.util.queue import Queue, DelayQueue, first
 from diesel.logmod import LOGLVL_DEBUG
 
 from .convoy_env_palm import MessageResponse, MessageEnvelope
@@ -58,6 +57,7 @@ class Convoy(object):
         self.role_clocks = {}
         self.role_by_name = {}
         self.incoming = Queue()
+        self.deferred = DelayQueue()
         self.pending = {}
         self.rpc_waits = {}
         self.table_changes = Queue()
@@ -259,16 +259,15 @@ class Convoy(object):
             self.incoming.put(next)
 
     def deliver(self):
-        deferred = []
         srg = self.routes.get
         empty = set()
-        sorter = op.attrgetter("reschedule_at")
         while True:
-            wait = (1.0 if not deferred else 
-                    deferred[-1].remaining)
-            r, next = first(waits=[self.incoming, 
-                self.table_changes], sleep=wait)
-            if r == self.incoming:
+            r, next = first(waits=[self.incoming,
+                self.table_changes, self.deferred])
+            if r == self.deferred:
+                if not next.expired(time()):
+                    self.incoming.put(next)
+            elif r == self.incoming:
                 if next.rqueue:
                     self.rpc_waits[next.id] = next.rqueue
 
@@ -276,7 +275,7 @@ class Convoy(object):
                 potentials = hosts - next.hosts_tried
                 if not potentials:
                     next.reschedule()
-                    deferred.append(next)
+                    self.deferred.put(next, when=next.reschedule_at)
                 else:
                     host = choice(list(potentials))
                     next.hosts_tried.add(host)
@@ -285,13 +284,6 @@ class Convoy(object):
                             MESSAGE_OUT, 
                             partial(self.retry, next.id))
 
-            deferred.sort(key=sorter, reverse=True)
-            t = time()
-            while deferred and deferred[-1].due(t):
-                i = deferred.pop()
-                if not i.expired(t):
-                    self.incoming.put(i)
-
 class Delivery(object):
     def __init__(self, m, timeout, rqueue=None, broadcast=False):
         self.id = str(uuid4())
@@ -8,13 +8,14 @@ import traceback
 import errno
 import sys
 import itertools
+import __builtin__
+from time import time
 from collections import deque
-from OpenSSL import SSL
 from greenlet import greenlet
 
 from diesel import pipeline
 from diesel import buffer
-from diesel.security import ssl_async_handshake
+from diesel.security import ssl_async_handshake, get_backend
 from diesel import runtime
 from diesel import log
 from diesel.events import EarlyValue
@@ -42,6 +43,11 @@ class ClientConnectionClosed(socket.error):
             s += ' (addr=%s, port=%s)' % (self.addr, self.port)
         return s
 
+class ConnectionTimeout(ConnectionClosed):
+    '''Raised in the loop waiting on a connection that the hub closed
+    because one of its idle, read or write deadlines passed.
+    '''
+
 class ClientConnectionError(socket.error):
     '''Raised if a client cannot connect.
     '''
@@ -66,6 +72,7 @@ class TerminateLoop(Exception):
 
 CRLF = '\r\n'
 BUFSIZ = 2 ** 14
+UDP_BATCH = 64 # max datagrams read per readiness event
 
 def until(sentinel):
     """Returns data from the underlying connection, terminated by sentinel.
@@ -381,26 +388,35 @@ class Loop(object):
             except socket.error:
                 return
 
+            sessions = client.ssl_session_cache
+
             def finish(e=None):
                 if e:
                     assert isinstance(e, Exception)
+                    if sessions is not None:
+                        sessions.discard((host, port))
                     self.hub.schedule(
                     lambda: self.wake(e)
                     )
                 else:
-                    client.conn = Connection(fsock, ip)
+                    if sessions is not None:
+                        sessions.put((host, port), tls.get_session(fsock))
+                    client.conn = Connection(fsock, ip, client.deadlines, tls)
                     client.connected = True
                     self.hub.schedule(
                     lambda: self.wake()
                     )
 
             if client.ssl_ctx:
-                fsock = SSL.Connection(client.ssl_ctx, sock)
-                fsock.setblocking(0)
-                fsock.set_connect_state()
-                ssl_async_handshake(fsock, self.hub, finish)
+                tls = get_backend(client.ssl_ctx)
+                session = None
+                if sessions is not None:
+                    session = sessions.get((host, port))
+                fsock = tls.wrap_client(client.ssl_ctx, sock, host, session)
+                ssl_async_handshake(fsock, self.hub, finish, tls)
             else:
                 fsock = sock
+                tls = None
                 finish()
 
         def error_callback():
@@ -602,8 +618,40 @@ class Loop(object):
     def _signal(self, sig, cb):
         self.hub.add_signal_handler(sig, cb)
 
+class Deadlines(object):
+    '''Idle, read and write timeouts (in seconds) for a Connection.
+
+    `idle` -- no bytes sent or received for this long
+    `read` -- a loop has waited this long on input without receiving
+        anything
+    `write` -- queued output has made no progress for this long
+
+    When one passes, the hub closes the connection; a loop waiting on it
+    gets ConnectionTimeout.
+    '''
+    def __init__(self, idle=None, read=None, write=None):
+        self.idle = idle
+        self.read = read
+        self.write = write
+
+    @classmethod
+    def create(cls, idle=None, read=None, write=None):
+        '''A Deadlines, or None if no timeout is set.
+        '''
+        if idle is None and read is None and write is None:
+            return None
+        return cls(idle, read, write)
+
 class Connection(object):
-    def __init__(self, sock, addr):
+    deadlines = None
+    tls = None
+    # Run once the outgoing pipeline empties (or the connection closes).
+    drained_callback = None
+    # Set from the TLS backend; catching () catches nothing.
+    tls_want_errors = ()
+    tls_closed_errors = ()
+
+    def __init__(self, sock, addr, deadlines=None, tls=None):
         self.hub = runtime.current_app.hub
         self.pipeline = pipeline.Pipeline()
         self.buffer = buffer.Buffer()
@@ -613,13 +661,62 @@ class Connection(object):
         self._writable = False
         self.closed = False
         self.waiting_callback = None
+        if tls:
+            self.tls = tls
+            self.tls_want_errors = tls.want_errors
+            self.tls_closed_errors = tls.closed_errors
+        if deadlines:
+            self.deadlines = deadlines
+            self.last_io = time()
+            self.read_since = self.write_since = None
+            self.hub.timeout_wheel.add(self, self.next_deadline(self.last_io))
+
+    def next_deadline(self, now):
+        '''When the TimeoutWheel should next check this connection.
+        '''
+        d = self.deadlines
+        when = []
+        if d.idle is not None:
+            when.append(self.last_io + d.idle)
+        if d.read is not None:
+            when.append((self.read_since or now) + d.read)
+        if d.write is not None:
+            when.append((self.write_since or now) + d.write)
+        return min(when)
+
+    def check_deadlines(self, now):
+        '''Called by the hub's TimeoutWheel.  Closes the connection if a
+        deadline has passed; otherwise returns when to check again.
+        '''
+        if self.closed:
+            return None
+        d = self.deadlines
+        if d.idle is not None and now - self.last_io >= d.idle:
+            self.expire('idle timeout')
+        elif (d.read is not None and self.read_since is not None
+                and now - self.read_since >= d.read):
+            self.expire('read timeout')
+        elif (d.write is not None and self.write_since is not None
+                and now - self.write_since >= d.write):
+            self.expire('write timeout')
+        else:
+            return self.next_deadline(now)
+        return None
+
+    def expire(self, reason):
+        self.shutdown(True, ConnectionTimeout(
+            'Connection closed: %s (addr=%s)' % (reason, self.addr),
+            self.buffer.pop()))
 
     def queue_outgoing(self, msg, priority=5):
         self.pipeline.add(msg, priority)
 
     def check_incoming(self, condition, callback):
         self.buffer.set_term(condition)
-        return self.buffer.check()
+        res = self.buffer.check()
+        if not res and self.deadlines:
+            self.read_since = time()
+        return res
 
     def set_writable(self, val):
         '''Set the associated socket writable.  Called when there is
@@ -631,29 +728,41 @@ class Connection(object):
         if val and not self._writable:
             self.hub.enable_write(self.sock)
             self._writable = True
+            if self.deadlines:
+                self.write_since = time()
             return
         if not val and self._writable:
             self.hub.disable_write(self.sock)
             self._writable = False
+            if self.deadlines:
+                self.write_since = None
 
     def cleanup(self):
         self.buffer.clear_term()
         self.waiting_callback = None
+        if self.deadlines:
+            self.read_since = None
 
     def close(self):
         self.set_writable(True)
         self.pipeline.close_request()
 
-    def shutdown(self, remote_closed=False):
+    def shutdown(self, remote_closed=False, error=None):
         '''Clean up after a client disconnects or after
         the connection_handler ends (and we disconnect).
+
+        A loop waiting on the connection gets `error`, or ConnectionClosed.
         '''
         self.hub.unregister(self.sock)
         self.closed = True
+        if self.tls:
+            self.tls.shutdown(self.sock)
         self.sock.close()
+        if self.drained_callback:
+            self._drained()
 
         if remote_closed and self.waiting_callback:
-            self.waiting_callback(
+            self.waiting_callback(error or
             ConnectionClosed('Connection closed by remote host',
             self.buffer.pop()))
 
@@ -669,25 +778,25 @@ class Connection(object):
             else:
                 try:
                     bsent = self.sock.send(data)
+                except self.tls_want_errors:
+                    self.pipeline.backup(data)
+                    return
+                except self.tls_closed_errors:
+                    self.shutdown(True)
                 except socket.error, e:
                     code, s = e
                     if code in (errno.EAGAIN, errno.EINTR):
                         self.pipeline.backup(data)
                         return
                     self.shutdown(True)
-                except (SSL.WantReadError, SSL.WantWriteError, SSL.WantX509LookupError):
-                    self.pipeline.backup(data)
-                    return
-                except SSL.ZeroReturnError:
-                    self.shutdown(True)
-                except SSL.SysCallError:
-                    self.shutdown(True)
                 except:
                     sys.stderr.write("Unknown Error on send():\n%s"
                     % traceback.format_exc())
                     self.shutdown(True)
 
                 else:
+                    if self.deadlines:
+                        self.last_io = self.write_since = time()
                     if bsent != len(data):
                         self.pipeline.backup(data[bsent:])
 
@@ -695,6 +804,12 @@ class Connection(object):
                         return
                     else:
                         self.set_writable(False)
+                        if self.drained_callback:
+                            self._drained()
+
+    def _drained(self):
+        cb, self.drained_callback = self.drained_callback, None
+        cb()
 
     def handle_read(self):
         '''The low-level handler called by the event hub
@@ -704,17 +819,21 @@ class Connection(object):
             return
         try:
             data = self.sock.recv(BUFSIZ)
+            if self.tls:
+                # Decrypted bytes already pulled off the socket won't
+                # trigger another read event.
+                pending = self.tls.pending(self.sock)
+                if pending:
+                    data += self.sock.recv(pending)
+        except self.tls_want_errors:
+            return
+        except self.tls_closed_errors:
+            data = ''
         except socket.error, e:
             code, s = e
             if code in (errno.EAGAIN, errno.EINTR):
                 return
             data = ''
-        except (SSL.WantReadError, SSL.WantWriteError, SSL.WantX509LookupError):
-            return
-        except SSL.ZeroReturnError:
-            data = ''
-        except SSL.SysCallError:
-            data = ''
         except:
             sys.stderr.write("Unknown Error on recv():\n%s"
             % traceback.format_exc())
@@ -723,6 +842,10 @@ class Connection(object):
         if not data:
             self.shutdown(True)
         else:
+            if self.deadlines:
+                self.last_io = now = time()
+                if self.read_since is not None:
+                    self.read_since = now
             res = self.buffer.feed(data)
             # Require a result that satisfies current term
             if res:
@@ -746,11 +869,27 @@ class UDPSocket(Connection):
         del self.pipeline
         self.outgoing = deque([])
         self.incoming = deque([])
+        self._rbuf = bytearray(BUFSIZ)
 
     def queue_outgoing(self, msg, priority=5):
-        dgram = Datagram(msg, self.parent.remote_addr)
+        self.send_datagram(Datagram(msg, self.parent.remote_addr))
+
+    def send_datagram(self, dgram):
+        # Try the socket right away; only queue (and poll for
+        # writability) when it pushes back.
+        if not self.outgoing and not self.closed:
+            try:
+                self.sock.sendto(dgram, dgram.addr)
+                return
+            except socket.error:
+                pass
         self.outgoing.append(dgram)
 
+    def set_writable(self, val):
+        if val and not self.outgoing:
+            return
+        super(UDPSocket, self).set_writable(val)
+
     def check_incoming(self, condition, callback):
         assert condition is datagram, "UDP supports datagram sentinels only"
         if self.incoming:
@@ -777,17 +916,12 @@ class UDPSocket(Connection):
                     self.outgoing.appendleft(dgram)
                     return
                 self.shutdown(True)
-            except (SSL.WantReadError, SSL.WantWriteError, SSL.WantX509LookupError):
-                self.outgoing.appendleft(dgram)
                 return
-            except SSL.ZeroReturnError:
-                self.shutdown(True)
-            except SSL.SysCallError:
-                self.shutdown(True)
             except:
                 sys.stderr.write("Unknown Error on send():\n%s"
                 % traceback.format_exc())
                 self.shutdown(True)
+                return
             else:
                 assert bsent == len(dgram), "complete datagram not sent!"
         self.set_writable(False)
@@ -795,31 +929,32 @@ class UDPSocket(Connection):
     def handle_read(self):
         '''The low-level handler called by the event hub
         when the socket is ready for reading.
+
+        Drains up to UDP_BATCH datagrams per wakeup into a reused
+        receive buffer.
         '''
-        if self.closed:
-            return
-        try:
-            data, addr = self.sock.recvfrom(BUFSIZ)
-            dgram = Datagram(data, addr)
-        except socket.error, e:
-            code, s = e
-            if code in (errno.EAGAIN, errno.EINTR):
+        rbuf = self._rbuf
+        for _ in xrange(UDP_BATCH):
+            if self.closed:
                 return
-            dgram = Datagram('', (None, None))
-        except (SSL.WantReadError, SSL.WantWriteError, SSL.WantX509LookupError):
-            return
-        except SSL.ZeroReturnError:
-            dgram = Datagram('', (None, None))
-        except SSL.SysCallError:
-            dgram = Datagram('', (None, None))
-        except:
-            sys.stderr.write("Unknown Error on recv():\n%s"
-            % traceback.format_exc())
-            dgram = Datagram('', (None, None))
+            try:
+                size, addr = self.sock.recvfrom_into(rbuf)
+            except socket.error, e:
+                code, s = e
+                if code in (errno.EAGAIN, errno.EINTR):
+                    return
+                self.shutdown(True)
+                return
+            except:
+                sys.stderr.write("Unknown Error on recv():\n%s"
+                % traceback.format_exc())
+                self.shutdown(True)
+                return
+            if size:
+                self.deliver(Datagram(__builtin__.buffer(rbuf, 0, size), addr))
 
-        if not dgram:
-            self.shutdown(True)
-        elif self.waiting_callback:
+    def deliver(self, dgram):
+        if self.waiting_callback:
             self.waiting_callback(dgram)
         else:
             self.incoming.append(dgram)
@@ -840,3 +975,54 @@ class UDPSocket(Connection):
             self.waiting_callback(
                 ConnectionClosed('Connection closed by remote host')
             )
+
+class UDPDispatchSocket(UDPSocket):
+    '''A UDPSocket shared by several worker loops.
+
+    Incoming datagrams are routed to one of `workers` UDPChannels by
+    peer address, so all traffic from a given peer is handled by the same
+    loop and per-peer protocol state can live in that loop.
+    '''
+    def __init__(self, parent, sock, workers):
+        super(UDPDispatchSocket, self).__init__(parent, sock)
+        self.channels = [UDPChannel(self) for _ in xrange(workers)]
+
+    def deliver(self, dgram):
+        self.channels[hash(dgram.addr) % len(self.channels)].deliver(dgram)
+
+    def shutdown(self, remote_closed=False):
+        super(UDPDispatchSocket, self).shutdown(remote_closed)
+        for c in self.channels:
+            c.shutdown(remote_closed)
+
+class UDPChannel(UDPSocket):
+    '''One worker loop's view of a UDPDispatchSocket.
+
+    Keeps its own incoming queue and remote address; sends go out
+    through the shared socket.
+    '''
+    def __init__(self, dispatcher):
+        self.hub = dispatcher.hub
+        self.dispatcher = dispatcher
+        self.sock = dispatcher.sock
+        self.addr = self.port = None
+        self.parent = self
+        self.remote_addr = (None, None)
+        self.incoming = deque([])
+        self.waiting_callback = None
+
+    @property
+    def closed(self):
+        return self.dispatcher.closed
+
+    def queue_outgoing(self, msg, priority=5):
+        self.dispatcher.send_datagram(Datagram(msg, self.remote_addr))
+
+    def set_writable(self, val):
+        self.dispatcher.set_writable(val)
+
+    def shutdown(self, remote_closed=False):
+        if remote_closed and self.waiting_callback:
+            self.waiting_callback(
+                ConnectionClosed('Connection closed by remote host')
+            )
@@ -1,4 +1,5 @@
-from collections import defaultdict
+from collections import deque
+from itertools import count
 
 class StopWaitDispatch(Exception): pass
 class StaticValue(object):
@@ -9,10 +10,79 @@ class EarlyValue(object):
     def __init__(self, val):
         self.val = val
 
+class WaitQueue(object):
+    '''Loops parked on a waiter, in arrival order.
+
+    Removal is lazy: discard() forgets the loop and its stale entry is
+    skipped when it reaches the head (or dropped when stale entries start
+    to outnumber live ones).  Each add() gets a fresh ticket, so a loop
+    that leaves and comes back queues at the back.
+    '''
+    tickets = count()
+
+    def __init__(self):
+        self.order = deque()
+        self.members = {}
+
+    def add(self, who):
+        if who not in self.members:
+            ticket = next(self.tickets)
+            self.members[who] = ticket
+            self.order.append((who, ticket))
+
+    def discard(self, who):
+        if self.members.pop(who, None) is not None:
+            if len(self.order) > 2 * len(self.members) + 32:
+                self.compact()
+
+    def compact(self):
+        members = self.members
+        self.order = deque(e for e in self.order if members.get(e[0]) == e[1])
+
+    def peek(self):
+        order = self.order
+        members = self.members
+        while order:
+            who, ticket = order[0]
+            if members.get(who) == ticket:
+                return who
+            order.popleft()
+        return None
+
+    def popleft(self):
+        who = self.peek()
+        if who is not None:
+            self.order.popleft()
+            del self.members[who]
+        return who
+
+    def drain(self):
+        '''Remove and return every parked loop, oldest first.
+        '''
+        members = self.members
+        out = [who for who, ticket in self.order if members.get(who) == ticket]
+        self.order.clear()
+        members.clear()
+        return out
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        members = self.members
+        return (who for who, ticket in list(self.order)
+                if members.get(who) == ticket)
+
 class Waiter(object):
-    @property
-    def wait_id(self):
-        return str(hash(self))
+    # The loops parked on this waiter.  WaitPool keeps them here, on the
+    # waiter itself, so firing never has to look anything up.
+    _waiters = None
+
+    # Park loops in a FIFO WaitQueue and hand fired values to the oldest
+    # waiter first.  process_fire is called once per loop woken; raising
+    # StopWaitDispatch leaves the rest parked, and returning a StaticValue
+    # wakes every parked loop with that value in one pass.
+    fifo = False
 
     def process_fire(self, given):
         return StaticValue(given)
@@ -20,37 +90,55 @@ class Waiter(object):
     def ready_early(self):
         return False
 
-class StringWaiter(str, Waiter):
-    @property
-    def wait_id(self):
-        return str(self)
-
 
 class WaitPool(object):
     '''A structure that manages all `wait`ers, makes sure fired events
     get to the right places.
+
+    Waiters are keyed by identity: each one carries its own set of parked
+    loops.  Plain string events live in `waits`, keyed by the string.
     '''
     def __init__(self):
-        self.waits = defaultdict(set)
-        self.loop_refs = defaultdict(set)
+        self.waits = {}
+        self.loop_refs = {}
 
     def wait(self, who, what):
         if isinstance(what, basestring):
-            what = StringWaiter(what)
-
-        if what.ready_early():
-            return EarlyValue(what.process_fire(None))
+            try:
+                self.waits[what].add(who)
+            except KeyError:
+                self.waits[what] = set([who])
+        else:
+            if what.ready_early():
+                return EarlyValue(what.process_fire(None))
+            if what._waiters is None:
+                what._waiters = WaitQueue() if what.fifo else set()
+            what._waiters.add(who)
 
-        self.waits[what.wait_id].add(who)
-        self.loop_refs[who].add(what)
-        return what.wait_id
+        try:
+            self.loop_refs[who].append(what)
+        except KeyError:
+            self.loop_refs[who] = [what]
+        return what
 
     def fire(self, what, value):
         if isinstance(what, basestring):
-            what = StringWaiter(what)
+            handlers = self.waits.get(what)
+            if not handlers:
+                return
+            for handler in handlers:
+                if not handler.fire_due:
+                    handler.fire_in(what, value)
+            return
 
+        handlers = what._waiters
+        if not handlers:
+            return
+        if what.fifo:
+            self.handoff(what, handlers, value)
+            return
         static = False
-        for handler in self.waits[what.wait_id]:
+        for handler in handlers:
             if handler.fire_due:
                 continue
             if not static:
@@ -61,11 +149,36 @@ class WaitPool(object):
                 if type(value) == StaticValue:
                     static = True
                     value = value.value
-            handler.fire_in(what.wait_id, value)
+            handler.fire_in(what, value)
+
+    def handoff(self, what, handlers, value):
+        while handlers:
+            handler = handlers.peek()
+            if handler.fire_due:
+                # Already woken by something else; it unparks on wake.
+                handlers.popleft()
+                continue
+            try:
+                given = what.process_fire(value)
+            except StopWaitDispatch:
+                return
+            if type(given) == StaticValue:
+                for handler in handlers.drain():
+                    if not handler.fire_due:
+                        handler.fire_in(what, given.value)
+                return
+            handlers.popleft()
+            handler.fire_in(what, given)
 
     def clear(self, who):
-        for what in self.loop_refs[who]:
-            self.waits[what.wait_id].remove(who)
-            if not self.waits[what.wait_id]:
-                del self.waits[what.wait_id]
-        del self.loop_refs[who]
+        refs = self.loop_refs.pop(who, None)
+        if refs is None:
+            return
+        for what in refs:
+            if isinstance(what, basestring):
+                handlers = self.waits[what]
+                handlers.discard(who)
+                if not handlers:
+                    del self.waits[what]
+            else:
+                what._waiters.discard(who)
@@ -21,6 +21,7 @@ import signal
 import thread
 
 from collections import deque, defaultdict
+from heapq import heappush, heappop
 from operator import attrgetter
 from time import time
 from Queue import Queue, Empty
@@ -70,6 +71,59 @@ class Timer(object):
         '''
         return (self.trigger_time - time()) < self.ALLOWANCE
 
+class TimeoutWheel(object):
+    '''Tracks connection deadlines (idle, read, write timeouts) with one
+    hub timer for the whole wheel.
+
+    Deadlines are bucketed into RESOLUTION-wide slots.  A connection is
+    only touched when its slot comes due: it checks its own timestamps,
+    expires itself or tells the wheel when to look again.  So I/O only
+    has to refresh a timestamp on the connection--no timer is allocated
+    or moved per read or write.
+    '''
+    RESOLUTION = 0.1
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.slots = {}
+        self.heap = []
+        self.timer = None
+        self.timer_slot = None
+
+    def add(self, conn, when):
+        '''Check `conn` (via conn.check_deadlines()) at or after `when`.
+        '''
+        slot = int(when / self.RESOLUTION) + 1
+        conns = self.slots.get(slot)
+        if conns is None:
+            conns = self.slots[slot] = []
+            heappush(self.heap, slot)
+        conns.append(conn)
+        if self.timer_slot is None or slot < self.timer_slot:
+            self._arm(slot)
+
+    def _arm(self, slot):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer_slot = slot
+        self.timer = self.hub.call_later(
+                max(0, slot * self.RESOLUTION - time()), self._tick)
+
+    def _tick(self):
+        self.timer = self.timer_slot = None
+        now = time()
+        current = int(now / self.RESOLUTION)
+        while self.heap and self.heap[0] <= current:
+            for conn in self.slots.pop(heappop(self.heap)):
+                when = conn.check_deadlines(now)
+                if when is not None:
+                    self.add(conn, when)
+        if self.heap and self.timer is None:
+            self._arm(self.heap[0])
+
+    def __len__(self):
+        return sum(len(c) for c in self.slots.itervalues())
+
 class _PipeWrap(object):
     def __init__(self, p):
         self.p = p
@@ -90,6 +144,7 @@ class AbstractEventHub(object):
         self.fd_ids = defaultdict(int)
         self._setup_threading()
         self.reschedule = deque()
+        self.timeout_wheel = TimeoutWheel(self)
 
     def _setup_threading(self):
         self._t_recv, self._t_wakeup = os.pipe()
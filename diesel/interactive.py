@@ -9,11 +9,12 @@ installed).
 
 """
 import code
+import os
 import sys
 sys.path.insert(0, '.')
 
 import diesel
-from diesel.util.streams import create_line_input_stream
+from diesel.util.streams import open_fd
 
 try:
     from IPython.Shell import IPShell
@@ -39,14 +40,24 @@ def interact_python():
         '__name__':globals_['__name__'],
         'diesel':diesel,
     }
-    inp = create_line_input_stream(sys.stdin)
+    try:
+        inp = open_fd(os.dup(sys.stdin.fileno()), 'stdin')
+    except ValueError:
+        inp = None # a regular file; reading it won't block the hub
 
     def diesel_input(prompt):
         sys.stdout.write(prompt)
         sys.stdout.flush()
-        return inp.get().rstrip('\n')
+        line = inp.readline() if inp else sys.stdin.readline()
+        if not line:
+            raise EOFError()
+        return line.rstrip('\n')
 
-    code.interact(None, diesel_input, env)
+    try:
+        code.interact(None, diesel_input, env)
+    finally:
+        if inp:
+            inp.close()
     diesel.quickstop()
 
 def interact_ipython():
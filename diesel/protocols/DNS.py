@@ -1,48 +1,71 @@
 from __future__ import absolute_import
 
+import errno
+import random
+import socket
+import struct
 import time
 from collections import deque
 
-from diesel import UDPClient, call, send, first, datagram
+from diesel import UDPClient, call, send, first, datagram, runtime
+from diesel.events import Waiter
 
+from dns import rcode
 from dns.message import make_query, from_wire
-from dns.rdatatype import A
+from dns.rdatatype import A, SOA
 from dns.resolver import Resolver as ResolvConf
 
 
 class NotFound(Exception):
-    pass
+    """The name (or that record type for it) doesn't exist.
+
+    `ttl` is how long that may be cached, from the zone's SOA, if given.
+
+    """
+    def __init__(self, name=None, ttl=None):
+        Exception.__init__(self, name)
+        self.ttl = ttl
 
 class Timeout(Exception):
     pass
 
-_resolv_conf = ResolvConf()
-_local_nameservers = _resolv_conf.nameservers
-_search_domains = []
-if _resolv_conf.domain:
-    _search_domains.append(str(_resolv_conf.domain)[:-1])
-_search_domains.extend(map(lambda n: str(n)[:-1], _resolv_conf.search))
+_local_nameservers = None
+_search_domains = None
 
-del _resolv_conf
+def _read_resolv_conf():
+    '''Nameservers and search domains from /etc/resolv.conf, read the
+    first time they're needed.
+    '''
+    global _local_nameservers, _search_domains
+    if _local_nameservers is None:
+        conf = ResolvConf()
+        search = []
+        if conf.domain:
+            search.append(str(conf.domain)[:-1])
+        search.extend(map(lambda n: str(n)[:-1], conf.search))
+        _local_nameservers, _search_domains = conf.nameservers, search
+    return _local_nameservers, _search_domains
 
 class DNSClient(UDPClient):
-    """A DNS client.
+    """A DNS client that asks one nameserver at a time, one query at a
+    time; MultiplexedDNSClient doesn't wait on either.
 
     Uses nameservers from /etc/resolv.conf if none are supplied.
 
     """
     def __init__(self, servers=None, port=53):
         if servers is None:
-            self.nameservers = servers = _local_nameservers
+            self.nameservers = servers = _read_resolv_conf()[0]
             self.primary = self.nameservers[0]
         super(DNSClient, self).__init__(servers[0], port)
 
     @call
-    def resolve(self, name, orig_timeout=5):
+    def resolve(self, name, orig_timeout=5, rdtype=A):
         """Try to resolve name.
 
         Returns:
-            A list of IP addresses for name.
+            A list of IP addresses for name (of `rdtype` records; A by
+            default).
 
         Raises:
             * Timeout if the request to all servers times out.
@@ -50,8 +73,19 @@ class DNSClient(UDPClient):
               was not resolved.
 
         """
+        return self._search(name, orig_timeout, rdtype)[0]
+
+    @call
+    def query(self, name, timeout=5, rdtype=A):
+        """Like resolve(), but returns (addresses, ttl), the ttl being the
+        lowest along any CNAME chain.
+
+        """
+        return self._search(name, timeout, rdtype)
+
+    def _search(self, name, orig_timeout, rdtype):
         names = deque([name])
-        for n in _search_domains:
+        for n in _read_resolv_conf()[1]:
             names.append(('%s.%s' % (name, n)))
         start = time.time()
         timeout = orig_timeout
@@ -59,7 +93,7 @@ class DNSClient(UDPClient):
         while names:
             n = names.popleft()
             try:
-                r = self._actually_resolve(n, timeout)
+                r = self._actually_resolve(n, timeout, rdtype)
             except:
                 timeout = orig_timeout - (time.time() - start)
                 if timeout <= 0 or not names:
@@ -69,13 +103,13 @@ class DNSClient(UDPClient):
         assert r is not None
         return r
 
-    def _actually_resolve(self, name, timeout):
+    def _actually_resolve(self, name, timeout, rdtype):
         timeout = timeout / float(len(self.nameservers))
         try:
             for server in self.nameservers:
                 # Try each nameserver in succession.
                 self.addr = server
-                query = make_query(name, A)
+                query = make_query(name, rdtype)
                 send(query.to_wire())
                 start = time.time()
                 remaining = timeout
@@ -87,10 +121,7 @@ class DNSClient(UDPClient):
                     if item == 'datagram':
                         response = from_wire(data)
                         if query.is_response(response):
-                            if response.answer:
-                                a_records = [r for r in response.answer if r.rdtype == A]
-                                return [item.address for item in a_records[0].items]
-                            raise NotFound
+                            return _parse(name, rdtype, response)
                         else:
                             # Not a response to our query - continue waiting for
                             # one that is.
@@ -102,3 +133,213 @@ class DNSClient(UDPClient):
         finally:
             self.addr = self.primary
 
+
+def _negative_ttl(response):
+    for r in response.authority:
+        if r.rdtype == SOA:
+            return min(r.ttl, r[0].minimum)
+    return None
+
+class _Query(Waiter):
+    '''One candidate name, sent to every nameserver under one message id.
+    `result` is (addresses, ttl) or the exception, once `done`.
+    '''
+    def __init__(self, batch, name, rdtype):
+        self.batch = batch
+        self.name = name
+        self.rdtype = rdtype
+        self.message = make_query(name, rdtype)
+        self.done = False
+        self.result = None
+        self.failures = 0
+
+    def finish(self, result):
+        self.done = True
+        self.result = result
+        self.batch.changed()
+
+class _Batch(Waiter):
+    '''Woken whenever one of a query_many() call's candidates finishes.'''
+    def __init__(self):
+        self.pending = False
+
+    def changed(self):
+        if not self.pending:
+            self.pending = True
+            runtime.current_app.waits.fire(self, None)
+
+class MultiplexedDNSClient(object):
+    """A DNS client that carries any number of outstanding queries, from
+    any number of loops, on one UDP socket per address family, matching
+    responses to queries by message id.
+
+    Each name and its search-domain variants are asked of every
+    nameserver at once; the first usable response for a variant wins,
+    and the variants are still preferred in search order.  Unanswered
+    queries are sent again halfway through the timeout.
+
+    Uses nameservers from /etc/resolv.conf if none are supplied.
+
+    """
+    def __init__(self, servers=None, port=53, search=None):
+        nameservers, search_domains = _read_resolv_conf()
+        self.nameservers = list(servers or nameservers)
+        self.port = port
+        self.search = search_domains if search is None else list(search)
+        self.servers = [(s, port) for s in self.nameservers]
+        self.pending = {}
+        self.socks = {}
+        self.hub = None
+
+    def resolve(self, name, orig_timeout=5, rdtype=A):
+        """Like DNSClient.resolve()."""
+        return self.query(name, orig_timeout, rdtype)[0]
+
+    def query(self, name, timeout=5, rdtype=A):
+        """Like DNSClient.query()."""
+        result = self.query_many([name], timeout, rdtype)[name]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def query_many(self, names, timeout=5, rdtype=A):
+        """Look up all of `names` at once.
+
+        Returns a dict of name -> (addresses, ttl), or -> the NotFound or
+        Timeout that name ended in.
+
+        """
+        batch = _Batch()
+        candidates = {}
+        for name in names:
+            if name not in candidates:
+                candidates[name] = [self._send(_Query(batch, n, rdtype))
+                        for n in self._search_names(name)]
+        results = {}
+        deadline = time.time() + timeout
+        resend = time.time() + timeout / 2.0
+        try:
+            while True:
+                for name, queries in candidates.items():
+                    result = _decide(queries)
+                    if result is not None:
+                        results[name] = result
+                        del candidates[name]
+                        for q in queries:
+                            self._forget(q)
+                if not candidates:
+                    return results
+                now = time.time()
+                if now >= deadline:
+                    break
+                if resend and now >= resend:
+                    resend = None
+                    for queries in candidates.itervalues():
+                        for q in queries:
+                            if not q.done:
+                                self._send(q)
+                batch.pending = False
+                first(waits=[batch], sleep=(resend or deadline) - now)
+        finally:
+            for queries in candidates.itervalues():
+                for q in queries:
+                    self._forget(q)
+        for name in candidates:
+            results[name] = Timeout(name)
+        return results
+
+    def close(self):
+        for sock in self.socks.itervalues():
+            self.hub.unregister(sock)
+            sock.close()
+        self.socks = {}
+
+    def _search_names(self, name):
+        yield name
+        for n in self.search:
+            yield '%s.%s' % (name, n)
+
+    def _socket(self, family):
+        hub = runtime.current_app.hub
+        if hub is not self.hub:
+            if self.hub is not None:
+                self.close()
+            self.hub = hub
+        sock = self.socks.get(family)
+        if sock is None:
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.setblocking(0)
+            read = lambda: self._handle_read(sock)
+            hub.register(sock, read, None, read)
+            self.socks[family] = sock
+        return sock
+
+    def _send(self, q):
+        if self.pending.get(q.message.id) is not q:
+            while q.message.id in self.pending:
+                q.message.id = random.randint(0, 0xffff)
+            self.pending[q.message.id] = q
+        wire = q.message.to_wire()
+        for addr in self.servers:
+            family = socket.AF_INET6 if ':' in addr[0] else socket.AF_INET
+            try:
+                self._socket(family).sendto(wire, addr)
+            except socket.error:
+                # Counts as lost; the resend or the timeout deals with it.
+                pass
+        return q
+
+    def _forget(self, q):
+        if self.pending.get(q.message.id) is q:
+            del self.pending[q.message.id]
+
+    def _handle_read(self, sock):
+        while True:
+            try:
+                data, addr = sock.recvfrom(65535)
+            except socket.error, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                # An ICMP error from some nameserver; try the next datagram.
+                continue
+            if len(data) < 2:
+                continue
+            q = self.pending.get(struct.unpack('!H', data[:2])[0])
+            if q is None or q.done or addr[:2] not in self.servers:
+                continue
+            try:
+                response = from_wire(data)
+            except Exception:
+                continue
+            if not q.message.is_response(response):
+                continue
+            if response.rcode() not in (rcode.NOERROR, rcode.NXDOMAIN):
+                # Another server may do better; give up once none can.
+                q.failures += 1
+                if q.failures >= len(self.servers):
+                    q.finish(Timeout(q.name))
+                continue
+            try:
+                q.finish(_parse(q.name, q.rdtype, response))
+            except NotFound, e:
+                q.finish(e)
+
+def _decide(queries):
+    '''The outcome for a name, given its candidates in search order, or
+    None while an earlier candidate could still answer.
+    '''
+    last = None
+    for q in queries:
+        if not q.done:
+            return None
+        if not isinstance(q.result, NotFound):
+            return q.result
+        last = q.result
+    return last
+
+def _parse(name, rdtype, response):
+    records = [r for r in response.answer if r.rdtype == rdtype]
+    if records:
+        ttl = min(r.ttl for r in response.answer)
+        return [item.address for item in records[0].items], ttl
+    raise NotFound(name, _negative_ttl(response))
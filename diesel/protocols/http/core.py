@@ -1,5 +1,8 @@
 # vim:ts=4:sw=4:expandtab
 '''HTTP/1.1 implementation of client and server.
+
+Requests and responses are flask's Request and Response, imported the
+first time one is needed; Request() and Response() here build them.
 '''
 
 import cStringIO
@@ -8,8 +11,6 @@ import urllib
 import time
 from datetime import datetime
 from urlparse import urlparse
-from flask import Request, Response
-from OpenSSL import SSL
 
 utcnow = datetime.utcnow
 
@@ -19,6 +20,7 @@ except ImportError:
     from http_parser.pyparser import HttpParser
 
 from diesel import receive, ConnectionClosed, send, log, Client, call, first
+from diesel.security import default_client_context
 
 SERVER_TAG = 'diesel-http-server'
 
@@ -26,6 +28,16 @@ hlog = log.name("http-error")
 
 HOSTNAME = os.uname()[1] # win32?
 
+def Request(*args, **kw):
+    '''A flask Request.'''
+    from flask import Request
+    return Request(*args, **kw)
+
+def Response(*args, **kw):
+    '''A flask Response.'''
+    from flask import Response
+    return Response(*args, **kw)
+
 def parse_request_line(line):
     '''Given a request line, split it into
     (method, url, protocol).
@@ -77,6 +89,7 @@ class HttpServer(object):
         initialization), this __call__ method is what's actually
         invoked by diesel.
         '''
+        from flask import Request
         data = None
         while True:
             try:
@@ -149,7 +162,8 @@ class HttpServer(object):
         send(str(resp.headers))
 
         if sendfile:
-            send(open(sendfile, 'rb')) # diesel can stream fds
+            from diesel.util.fileio import stream_to_connection
+            stream_to_connection(sendfile)
         else:
             for i in resp.iter_encoded():
                 send(i)
@@ -196,6 +210,7 @@ class HttpClient(Client):
         for example.  It will set Content-Length,
         however.
         '''
+        from flask import Request, Response
         headers = headers or {}
         url_info = urlparse(url)
         fake_wsgi = dict(
@@ -256,7 +271,13 @@ class HttpClient(Client):
         return resp
 
 class HttpsClient(HttpClient):
+    '''An HttpClient over TLS.
+
+    Uses the shared diesel.security.default_client_context() unless an
+    `ssl_ctx` is given.
+    '''
     url_scheme = "http"
     def __init__(self, *args, **kw):
-        kw['ssl_ctx'] = SSL.Context(SSL.SSLv23_METHOD)
+        if kw.get('ssl_ctx') is None:
+            kw['ssl_ctx'] = default_client_context()
         HttpClient.__init__(self, *args, **kw)
@@ -4,12 +4,17 @@ import urlparse
 import diesel
 import diesel.protocols.http.core as http
 import diesel.util.pool as pool
+from diesel.security import SessionCache
 
 
 # XXX This dictionary can currently grow without bounds. A pool entry gets
 # created for every (host, port) key. Don't use this for a web crawler.
 _pools = {}
 
+# TLS sessions for https pools, keyed by (host, port), so replacing a dead
+# pooled connection resumes instead of doing a full handshake.
+_tls_sessions = SessionCache()
+
 VERSION = '3.0'
 USER_AGENT = 'diesel.protocols.http.pool v%s' % VERSION
 POOL_SIZE = 10
@@ -17,7 +22,7 @@ POOL_SIZE = 10
 class InvalidUrlScheme(Exception):
     pass
 
-def request(url, method='GET', timeout=60, body=None, headers=None):
+def request(url, method='GET', timeout=60, body=None, headers=None, sockopts=None, rate_limit=None):
     if body and (not isinstance(body, basestring)):
         body_bytes = urllib.urlencode(body)
     else:
@@ -29,7 +34,10 @@ def request(url, method='GET', timeout=60, body=None, headers=None):
         'Connection': 'keep-alive',
     })
     if 'Host' not in headers:
-        host = req_url.netloc.split(':')[0]
+        if req_url.scheme == 'http+unix':
+            host = 'localhost'
+        else:
+            host = req_url.netloc.split(':')[0]
         headers['Host'] = host
     if 'User-Agent' not in headers:
         headers['User-Agent'] = USER_AGENT
@@ -41,7 +49,7 @@ def request(url, method='GET', timeout=60, body=None, headers=None):
     # Loop to retry if the connection was closed.
     for i in xrange(POOL_SIZE):
         try:
-            with http_pool_for_url(req_url).connection as conn:
+            with http_pool_for_url(req_url, sockopts, rate_limit).connection as conn:
                 resp = conn.request(method, encoded_path, headers, timeout=timeout, body=body_bytes)
             break
         except diesel.ClientConnectionClosed, e:
@@ -51,16 +59,31 @@ def request(url, method='GET', timeout=60, body=None, headers=None):
         raise e
     return resp
 
-def http_pool_for_url(req_url):
+def http_pool_for_url(req_url, sockopts=None, rate_limit=None):
+    '''Return the pool for `req_url`'s host and port, creating it if needed.
+
+    `sockopts` is the socket profile for the pool's connections and
+    `rate_limit` a diesel.util.ratelimit limiter capping requests to that
+    host and port; both only take effect when the pool is created.
+    '''
     host, port = host_and_port_from_url(req_url)
     if (host, port) not in _pools:
-        make_client = ClientFactory(req_url.scheme, host, port)
+        make_client = ClientFactory(req_url.scheme, host, port, sockopts)
         close_client = lambda c: c.close()
-        conn_pool = pool.ConnectionPool(make_client, close_client, POOL_SIZE)
+        conn_pool = pool.ConnectionPool(make_client, close_client, POOL_SIZE,
+                rate_limit=rate_limit)
         _pools[(host, port)] = conn_pool
     return _pools[(host, port)]
 
 def host_and_port_from_url(req_url):
+    '''Return (host, port) for an http, https or http+unix URL.
+
+    For http+unix the netloc is the percent-encoded socket path
+    (http+unix://%2Frun%2Fapp.sock/status) and is returned as the host,
+    with a port of None.
+    '''
+    if req_url.scheme == 'http+unix':
+        return urllib.unquote(req_url.netloc), None
     if req_url.scheme == 'http':
         default_port = 80
     elif req_url.scheme == 'https':
@@ -76,16 +99,26 @@ def host_and_port_from_url(req_url):
     return host, port
 
 class ClientFactory(object):
-    def __init__(self, scheme, host, port):
+    def __init__(self, scheme, host, port, sockopts=None):
+        self.path = None
         if scheme == 'http':
             self.ClientClass = http.HttpClient
+        elif scheme == 'http+unix':
+            self.ClientClass = http.HttpClient
+            self.path = host
         elif scheme == 'https':
             self.ClientClass = http.HttpsClient
         else:
             raise InvalidUrlScheme(scheme)
         self.host = host
         self.port = port
+        self.sockopts = sockopts
 
     def __call__(self):
-        return self.ClientClass(self.host, self.port)
+        if self.path:
+            return self.ClientClass(path=self.path)
+        if self.ClientClass is http.HttpsClient:
+            return self.ClientClass(self.host, self.port, sockopts=self.sockopts,
+                    ssl_session_cache=_tls_sessions)
+        return self.ClientClass(self.host, self.port, sockopts=self.sockopts)
 
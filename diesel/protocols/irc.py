@@ -1,7 +1,7 @@
 '''Experimental support for Internet Relay Chat'''
 
 from diesel import Client, call, sleep, send, until_eol, receive, first, Loop, Application, ConnectionClosed, quickstop
-from OpenSSL import SSL
+from diesel.security import default_client_context
 import os, pwd
 from types import GeneratorType
 
@@ -113,7 +113,7 @@ class IrcClient(Client):
 
 class SSLIrcClient(IrcClient):
     def __init__(self, *args, **kw):
-        kw['ssl_ctx'] = SSL.Context(SSL.SSLv23_METHOD)
+        kw['ssl_ctx'] = default_client_context()
         IrcClient.__init__(self, *args, **kw)
 
 
@@ -170,5 +170,5 @@ class IrcBot(IrcClient):
 
 class SSLIrcBot(IrcBot):
     def __init__(self, *args, **kw):
-        kw['ssl_ctx'] = SSL.Context(SSL.SSLv23_METHOD)
+        kw['ssl_ctx'] = default_client_context()
         IrcBot.__init__(self, *args, **kw)
@@ -1,26 +1,73 @@
-'''Fetches the A record for a given name in a green thread, keeps
-a cache.
+'''Fetches the A and AAAA records for a given name in a green thread,
+keeps a cache.
+
+Answers are cached for their record TTL, clamped to MIN_TTL..MAX_TTL,
+and names that don't exist for their negative TTL (NEGATIVE_TTL if the
+server gives none).  An expired answer is still served for up to
+STALE_TTL while one loop refreshes it in the background, and a name
+used again in the last PREFETCH of its TTL is refreshed before it
+expires, so busy names never block on the network.  At most CACHE_SIZE
+answers are kept, the least recently used going first.
+
+Lookups share one MultiplexedDNSClient, so any number can be in flight
+at once; resolve_many() does a batch of names concurrently.  The client
+(and dnspython with it) and /etc/hosts are only loaded on first use.
 '''
 
 import os
 import random
 import time
 import socket
-from diesel.protocols.DNS import DNSClient, NotFound, Timeout
-from diesel.util.pool import ConnectionPool
+from collections import OrderedDict
+
+from diesel import fork, first
+from diesel.util.event import Countdown, Event
 from diesel.util.lock import synchronized
 
-DNS_CACHE_TIME = 60 * 5 # five minutes
+# dns.rdatatype.A and AAAA; spelled out so importing this module doesn't
+# load dnspython.
+A = 1
+AAAA = 28
 
-cache = {}
+MIN_TTL = 0
+MAX_TTL = 60 * 60
+NEGATIVE_TTL = 60
+MAX_NEGATIVE_TTL = 60 * 5
+STALE_TTL = 60 * 5
+PREFETCH = 0.1
+PREFETCH_HITS = 2
+CACHE_SIZE = 10000
+# For AF_UNSPEC, how long to keep waiting for the other family once one
+# has answered.
+RESOLUTION_DELAY = 0.05
 
 class DNSResolutionError(Exception): pass
 
-_pool = ConnectionPool(lambda: DNSClient(), lambda c: c.close())
+class _Entry(object):
+    '''A cached answer; `addresses` is None for a name that doesn't
+    exist.
+    '''
+    __slots__ = ('addresses', 'ttl', 'expires', 'hits', 'refreshing')
+
+    def __init__(self, addresses, ttl):
+        self.addresses = addresses
+        self.ttl = ttl
+        self.expires = time.time() + ttl
+        self.hits = 0
+        self.refreshing = False
+
+# (name, rdtype) -> _Entry, least recently used first.
+cache = OrderedDict()
+
+_client = None
 
 hosts = {}
+hosts6 = {}
+_hosts_loaded = False
 
 def load_hosts():
+    global _hosts_loaded
+    _hosts_loaded = True
     if os.path.isfile("/etc/hosts"):
         for line in open("/etc/hosts"):
             parts = line.split()
@@ -29,42 +76,189 @@ def load_hosts():
                 if p.startswith("#"):
                     break
                 if not ip:
-                    if ':' in p:
-                        break
                     ip = p
+                elif ':' in ip:
+                    hosts6[p] = ip
                 else:
                     hosts[p] = ip
 
-load_hosts()
-
-def resolve_dns_name(name):
-    '''Uses a pool of DNSClients to resolve name to an IP address.
+_rdtypes = {
+    socket.AF_INET: (A,),
+    socket.AF_INET6: (AAAA,),
+    socket.AF_UNSPEC: (AAAA, A),
+}
 
-    Keep a cache.
+def resolve_dns_name(name, family=socket.AF_INET):
+    '''Resolve name to an IP address, through the cache.
     '''
+    return random.choice(resolve_all(name, family))
 
+def resolve_all(name, family=socket.AF_UNSPEC):
+    '''Every address for `name` in `family`: IPv6 ones first, then IPv4,
+    for AF_UNSPEC.
+
+    Both families are asked for at once.  Once one has answered, the
+    other gets RESOLUTION_DELAY more; if it's still out after that, the
+    addresses so far are returned and its answer goes to the cache.
+    '''
+    rdtypes = _rdtypes[family]
     # Is name an IP address?
-    try:
-        socket.inet_pton(socket.AF_INET, name)
-        return name
-    except socket.error:
-        # Not a valid IP address resolve it
-        pass
+    for rdtype, af in ((A, socket.AF_INET), (AAAA, socket.AF_INET6)):
+        try:
+            socket.inet_pton(af, name)
+        except socket.error:
+            continue
+        if rdtype in rdtypes:
+            return [name]
+        raise DNSResolutionError("%s is not an address of the requested family" % name)
+
+    if not _hosts_loaded:
+        load_hosts()
+    found = []
+    if AAAA in rdtypes and name in hosts6:
+        found.append(hosts6[name])
+    if A in rdtypes and name in hosts:
+        found.append(hosts[name])
+    if found:
+        return found
+
+    results = _lookup_all(name, rdtypes)
+    error = None
+    for rdtype in rdtypes:
+        result = results.get(rdtype)
+        if isinstance(result, DNSResolutionError):
+            error = result
+        elif result is not None:
+            found.extend(result)
+    if not found:
+        raise error
+    return found
+
+def _lookup_all(name, rdtypes):
+    '''{rdtype: addresses or DNSResolutionError} for those of `rdtypes`
+    that answered in time.
+    '''
+    results = {}
+    def one(rdtype):
+        try:
+            results[rdtype] = _lookup(name, rdtype)
+        except DNSResolutionError, e:
+            results[rdtype] = e
+    # Cached answers need no network; only fork when two must wait on it.
+    uncached = [rdtype for rdtype in rdtypes if not _cached((name, rdtype))]
+    if len(uncached) < 2:
+        for rdtype in rdtypes:
+            one(rdtype)
+        return results
+
+    done = Countdown(len(rdtypes))
+    answered = Event()
+    def lookup(rdtype):
+        try:
+            one(rdtype)
+            if not isinstance(results[rdtype], DNSResolutionError):
+                answered.set()
+        finally:
+            done.tick()
+    for rdtype in rdtypes:
+        fork(lookup, rdtype)
+    first(waits=[done, answered])
+    if not done.is_set:
+        first(waits=[done], sleep=RESOLUTION_DELAY)
+    return dict(results)
+
+def resolve_many(names, family=socket.AF_UNSPEC):
+    '''Resolve all of `names` concurrently.
+
+    Returns a dict of name -> every address, as resolve_all() gives them,
+    or -> the DNSResolutionError for a name that couldn't be resolved.
+    '''
+    results = {}
+    names = set(names)
+    done = Countdown(len(names))
+    def one(name):
+        try:
+            results[name] = resolve_all(name, family)
+        except DNSResolutionError, e:
+            results[name] = e
+        finally:
+            done.tick()
+    for name in names:
+        fork(one, name)
+    if names:
+        done.wait()
+    return results
 
-    if name in hosts:
-        return hosts[name]
+def _cached(key):
+    '''Can _lookup(*key) answer without waiting on the network?'''
+    entry = cache.get(key)
+    if entry is None:
+        return False
+    now = time.time()
+    return now < entry.expires or (
+            entry.addresses is not None and now < entry.expires + STALE_TTL)
+
+def _lookup(name, rdtype):
+    key = (name, rdtype)
+    entry = cache.pop(key, None)
+    if entry is not None:
+        cache[key] = entry
+        now = time.time()
+        if now < entry.expires:
+            entry.hits += 1
+            if (entry.hits >= PREFETCH_HITS and not entry.refreshing
+                    and now >= entry.expires - entry.ttl * PREFETCH):
+                _refresh_later(key, entry)
+            return _answer(key, entry)
+        if entry.addresses is not None and now < entry.expires + STALE_TTL:
+            if not entry.refreshing:
+                _refresh_later(key, entry)
+            return entry.addresses
+
+    with synchronized('__diesel__.dns.%s.%s' % key):
+        entry = cache.get(key)
+        if entry is None or time.time() >= entry.expires:
+            entry = _fetch(key)
+    return _answer(key, entry)
+
+def _answer(key, entry):
+    if entry.addresses is None:
+        raise DNSResolutionError("could not resolve %s record for %s"
+                % ('A' if key[1] == A else 'AAAA', key[0]))
+    return entry.addresses
+
+def _query(name, rdtype):
+    global _client
+    if _client is None:
+        from diesel.protocols.DNS import MultiplexedDNSClient
+        _client = MultiplexedDNSClient()
+    return _client.query(name, rdtype=rdtype)
+
+def _fetch(key):
+    '''Ask the network and cache the answer; a Timeout leaves the cache
+    as it was.
+    '''
+    from diesel.protocols.DNS import NotFound, Timeout
+    try:
+        addresses, ttl = _query(*key)
+        ttl = min(max(ttl, MIN_TTL), MAX_TTL)
+    except NotFound, e:
+        addresses = None
+        ttl = min(e.ttl if e.ttl is not None else NEGATIVE_TTL, MAX_NEGATIVE_TTL)
+    except Timeout:
+        raise DNSResolutionError("timed out resolving %s" % key[0])
+    entry = cache[key] = _Entry(addresses, ttl)
+    while len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+    return entry
 
-    with synchronized('__diesel__.dns.' + name):
+def _refresh_later(key, entry):
+    entry.refreshing = True
+    def refresh():
         try:
-            ips, tm = cache[name]
-            if time.time() - tm > DNS_CACHE_TIME:
-                del cache[name]
-                cache[name]
-        except KeyError:
-            try:
-                with _pool.connection as conn:
-                    ips = conn.resolve(name)
-            except (NotFound, Timeout):
-                raise DNSResolutionError("could not resolve A record for %s" % name)
-            cache[name] = ips, time.time()
-    return random.choice(ips)
+            _fetch(key)
+        except DNSResolutionError:
+            pass
+        finally:
+            entry.refreshing = False
+    fork(refresh)
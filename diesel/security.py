@@ -1,16 +1,43 @@
-from OpenSSL import SSL
+'''TLS plumbing: backends, async handshakes, shared contexts and session
+caches.
+
+Building a context is expensive and a fresh one can't resume anything, so
+services and clients should share contexts:
+
+    ctx = server_context('cert.pem', 'key.pem')
+    Service(handler, 443, ssl_ctx=ctx)
+
+    sessions = SessionCache()
+    Client('host', 443, ssl_ctx=default_client_context(),
+           ssl_session_cache=sessions)
+
+Two backends are available, pyOpenSSL (the default) and the stdlib `ssl`
+module.  The backend follows the type of the context handed to a Service
+or Client, so `server_context(..., backend='stdlib')` is all it takes to
+switch one over.
+
+Neither pyOpenSSL nor `ssl` is imported until a backend is first used.
+'''
+from collections import OrderedDict
+import socket
 import traceback
 import sys
 
-def ssl_async_handshake(sock, hub, next):
+SESSION_TIMEOUT = 60 * 60 # one hour
+SESSION_CACHE_SIZE = 1024
+
+def ssl_async_handshake(sock, hub, next, backend=None):
+    backend = backend or PYOPENSSL
+    want_read, want_write = backend.want_read_write
+    want_other = backend.want_errors
     def shake():
         try:
             sock.do_handshake()
-        except SSL.WantReadError:
+        except want_read:
             hub.disable_write(sock)
-        except SSL.WantWriteError:
+        except want_write:
             hub.enable_write(sock)
-        except SSL.WantX509LookupError:
+        except want_other:
             pass
         except Exception, e:
             hub.unregister(sock)
@@ -20,3 +47,228 @@ def ssl_async_handshake(sock, hub, next):
             next()
     hub.register(sock, shake, shake, shake)
     shake()
+
+def _pyopenssl():
+    from OpenSSL import SSL
+    return SSL
+
+def _stdlib():
+    import ssl
+    return ssl
+
+class PyOpenSSLBackend(object):
+    '''TLS through pyOpenSSL's SSL.Connection.
+    '''
+    name = 'pyopenssl'
+    module = 'OpenSSL.SSL'
+
+    @property
+    def context_type(self):
+        return _pyopenssl().Context
+
+    @property
+    def want_read_write(self):
+        SSL = _pyopenssl()
+        return (SSL.WantReadError, SSL.WantWriteError)
+
+    # Errors Connection.handle_read/handle_write treat as "try again later"
+    # and as "the peer went away".
+    @property
+    def want_errors(self):
+        SSL = _pyopenssl()
+        return (SSL.WantReadError, SSL.WantWriteError,
+                SSL.WantX509LookupError)
+
+    @property
+    def closed_errors(self):
+        SSL = _pyopenssl()
+        return (SSL.ZeroReturnError, SSL.SysCallError)
+
+    def wrap_server(self, ctx, sock):
+        SSL = _pyopenssl()
+        sock = SSL.Connection(ctx, sock)
+        sock.set_accept_state()
+        sock.setblocking(0)
+        return sock
+
+    def wrap_client(self, ctx, sock, host=None, session=None):
+        SSL = _pyopenssl()
+        sock = SSL.Connection(ctx, sock)
+        sock.setblocking(0)
+        sock.set_connect_state()
+        if session is not None:
+            sock.set_session(session)
+        return sock
+
+    def get_session(self, sock):
+        return sock.get_session()
+
+    def pending(self, sock):
+        return sock.pending()
+
+    def shutdown(self, sock):
+        # Send close_notify; OpenSSL won't resume sessions from
+        # connections that weren't shut down cleanly.
+        try:
+            sock.shutdown()
+        except _pyopenssl().Error:
+            pass
+
+class StdlibBackend(object):
+    '''TLS through the stdlib `ssl` module.
+
+    Sockets are wrapped with do_handshake_on_connect=False and driven by
+    the same hub callbacks as pyOpenSSL connections.  Python 2 has no
+    SSLObject/MemoryBIO, so this wraps the socket itself.  Client-side
+    session resumption needs SSLSocket.session (Python 3.6+); without it
+    sessions just aren't cached.
+    '''
+    name = 'stdlib'
+    module = 'ssl'
+
+    @property
+    def context_type(self):
+        return _stdlib().SSLContext
+
+    @property
+    def want_read_write(self):
+        ssl = _stdlib()
+        return (ssl.SSLWantReadError, ssl.SSLWantWriteError)
+
+    want_errors = want_read_write
+
+    # ssl.SSLError subclasses socket.error, so it has to be caught here
+    # rather than falling through to the errno checks.
+    @property
+    def closed_errors(self):
+        return (_stdlib().SSLError,)
+
+    def wrap_server(self, ctx, sock):
+        return ctx.wrap_socket(sock, server_side=True,
+                do_handshake_on_connect=False)
+
+    def wrap_client(self, ctx, sock, host=None, session=None):
+        ssl = _stdlib()
+        kw = {}
+        if ssl.HAS_SNI and host:
+            kw['server_hostname'] = host
+        sock = ctx.wrap_socket(sock, do_handshake_on_connect=False, **kw)
+        if session is not None and hasattr(sock, 'session'):
+            sock.session = session
+        return sock
+
+    def get_session(self, sock):
+        return getattr(sock, 'session', None)
+
+    def pending(self, sock):
+        return sock.pending()
+
+    def shutdown(self, sock):
+        try:
+            sock.unwrap()
+        except (_stdlib().SSLError, socket.error):
+            pass
+
+PYOPENSSL = PyOpenSSLBackend()
+STDLIB = StdlibBackend()
+BACKENDS = dict((b.name, b) for b in (PYOPENSSL, STDLIB))
+
+def get_backend(ctx):
+    '''The backend that handles contexts like `ctx`.
+    '''
+    for backend in BACKENDS.itervalues():
+        # A context can only come from a library that's been imported.
+        if backend.module in sys.modules and isinstance(ctx, backend.context_type):
+            return backend
+    raise TypeError("no TLS backend for %r" % (ctx,))
+
+def server_context(certificate, private_key, session_id='diesel',
+        session_timeout=SESSION_TIMEOUT, tickets=True,
+        method=None, backend='pyopenssl'):
+    '''A context for a Service, with resumption turned on.
+
+    Sessions are kept in OpenSSL's server-side cache for `session_timeout`
+    seconds under `session_id` (use a distinct id per service if several
+    share a process).  With `tickets` on, clients that support RFC 5077
+    session tickets resume without any server-side state.
+
+    With backend='stdlib' this returns an ssl.SSLContext instead; `method`
+    and `session_id` only apply to pyOpenSSL.
+    '''
+    if backend == 'stdlib':
+        ssl = _stdlib()
+        ctx = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        ctx.load_cert_chain(certificate, private_key)
+        if not tickets:
+            ctx.options |= ssl.OP_NO_TICKET
+        return ctx
+    SSL = _pyopenssl()
+    ctx = SSL.Context(SSL.SSLv23_METHOD if method is None else method)
+    ctx.use_certificate_file(certificate)
+    ctx.use_privatekey_file(private_key)
+    ctx.set_session_id(session_id)
+    ctx.set_session_cache_mode(SSL.SESS_CACHE_SERVER)
+    ctx.set_timeout(session_timeout)
+    if not tickets:
+        ctx.set_options(SSL.OP_NO_TICKET)
+    return ctx
+
+def client_context(method=None, backend='pyopenssl'):
+    '''A context for Clients that can resume sessions.
+
+    Like the pyOpenSSL one, the backend='stdlib' context doesn't verify
+    certificates; load CAs and set verify_mode on it to do so.
+    '''
+    if backend == 'stdlib':
+        ssl = _stdlib()
+        ctx = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+        return ctx
+    SSL = _pyopenssl()
+    ctx = SSL.Context(SSL.SSLv23_METHOD if method is None else method)
+    ctx.set_session_cache_mode(SSL.SESS_CACHE_CLIENT)
+    return ctx
+
+_default_client_context = None
+
+def default_client_context():
+    '''The process-wide client context used when none is given.
+    '''
+    global _default_client_context
+    if _default_client_context is None:
+        _default_client_context = client_context()
+    return _default_client_context
+
+class SessionCache(object):
+    '''Client-side TLS sessions, keyed by (host, port).
+
+    Bounded to `size` entries, least recently used first out.  Pass one
+    to Client as `ssl_session_cache` and reconnects to a host will try to
+    resume the last session instead of doing a full handshake.
+    '''
+    def __init__(self, size=SESSION_CACHE_SIZE):
+        self.size = size
+        self.sessions = OrderedDict()
+
+    def get(self, key):
+        try:
+            session = self.sessions.pop(key)
+        except KeyError:
+            return None
+        self.sessions[key] = session
+        return session
+
+    def put(self, key, session):
+        if session is None:
+            return
+        self.sessions.pop(key, None)
+        self.sessions[key] = session
+        if len(self.sessions) > self.size:
+            self.sessions.popitem(last=False)
+
+    def discard(self, key):
+        self.sessions.pop(key, None)
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,180 @@
+# vim:ts=4:sw=4:expandtab
+'''Declarative socket option profiles.
+
+A SocketProfile describes the options diesel should set on the sockets
+owned by a Service, UDPService or Client.  Pass one as `sockopts`:
+
+    Service(handler, 6379, sockopts=LATENCY)
+    RedisClient('cache1', sockopts=LATENCY.derive(keepidle=30))
+
+Options the running kernel doesn't support are skipped.
+'''
+import sys
+import socket
+
+from diesel import log
+
+_linux = sys.platform.startswith('linux')
+
+def _opt(name, linux_value):
+    '''Look up a socket option constant, falling back to the Linux value
+    when this Python build doesn't expose it.
+    '''
+    value = getattr(socket, name, None)
+    if value is None and _linux:
+        value = linux_value
+    return value
+
+TCP_KEEPIDLE = _opt('TCP_KEEPIDLE', 4)
+TCP_KEEPINTVL = _opt('TCP_KEEPINTVL', 5)
+TCP_KEEPCNT = _opt('TCP_KEEPCNT', 6)
+TCP_DEFER_ACCEPT = _opt('TCP_DEFER_ACCEPT', 9)
+TCP_FASTOPEN = _opt('TCP_FASTOPEN', 23)
+TCP_FASTOPEN_CONNECT = _opt('TCP_FASTOPEN_CONNECT', 30)
+IP_BIND_ADDRESS_NO_PORT = _opt('IP_BIND_ADDRESS_NO_PORT', 24)
+
+class SocketProfile(object):
+    '''A set of socket options, applied at the right point in a socket's
+    life (listening, accepted, or outbound before connect()).
+
+    Any option left as None is not touched.
+
+    `nodelay` -- TCP_NODELAY; disable Nagle for small request/response writes
+    `keepalive`, `keepidle`, `keepintvl`, `keepcnt` -- TCP keepalive probing
+    `sndbuf`, `rcvbuf` -- SO_SNDBUF/SO_RCVBUF, in bytes
+    `defer_accept` -- TCP_DEFER_ACCEPT seconds; only wake accept() once the
+        client has sent data.  Don't use with server-speaks-first protocols.
+    `fastopen` -- TCP Fast Open for services; the listen queue length, or
+        True for 256
+    `fastopen_connect` -- TCP_FASTOPEN_CONNECT for clients.  Off in every
+        stock profile: once a cookie is cached, connect() returns at once
+        without a handshake, so the connect timeout and address racing
+        can't see a dead host, and server-speaks-first protocols hang
+        until the client writes
+    `bind_no_port` -- IP_BIND_ADDRESS_NO_PORT; when a client binds a
+        `source_ip`, defer port selection to connect() so huge outbound
+        fan-out isn't limited to one ephemeral port range per source ip
+    '''
+    FIELDS = ('nodelay', 'keepalive', 'keepidle', 'keepintvl', 'keepcnt',
+              'sndbuf', 'rcvbuf', 'defer_accept', 'fastopen', 'fastopen_connect',
+              'bind_no_port')
+
+    def __init__(self, name='custom', **kw):
+        self.name = name
+        for f in self.FIELDS:
+            setattr(self, f, kw.pop(f, None))
+        if kw:
+            raise TypeError("unknown socket options: %s" % ', '.join(kw))
+
+    def derive(self, name=None, **kw):
+        '''Return a copy of this profile with some options overridden.
+        '''
+        opts = dict((f, getattr(self, f)) for f in self.FIELDS)
+        opts.update(kw)
+        return SocketProfile(name or self.name, **opts)
+
+    def __repr__(self):
+        set_ = ', '.join('%s=%r' % (f, getattr(self, f))
+                for f in self.FIELDS if getattr(self, f) is not None)
+        return '<SocketProfile %s: %s>' % (self.name, set_)
+
+    def _set(self, sock, level, opt, value):
+        if opt is None:
+            return
+        try:
+            sock.setsockopt(level, opt, int(value))
+        except socket.error, e:
+            log.debug("socket profile {0}: cannot set option {1}: {2}",
+                    self.name, opt, e)
+
+    def _buffers(self, sock):
+        if self.sndbuf is not None:
+            self._set(sock, socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        if self.rcvbuf is not None:
+            self._set(sock, socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+
+    def _stream(self, sock):
+        if self.nodelay is not None:
+            self._set(sock, socket.IPPROTO_TCP, socket.TCP_NODELAY, self.nodelay)
+        if self.keepalive is not None:
+            self._set(sock, socket.SOL_SOCKET, socket.SO_KEEPALIVE, self.keepalive)
+        if self.keepalive:
+            if self.keepidle is not None:
+                self._set(sock, socket.IPPROTO_TCP, TCP_KEEPIDLE, self.keepidle)
+            if self.keepintvl is not None:
+                self._set(sock, socket.IPPROTO_TCP, TCP_KEEPINTVL, self.keepintvl)
+            if self.keepcnt is not None:
+                self._set(sock, socket.IPPROTO_TCP, TCP_KEEPCNT, self.keepcnt)
+
+    def apply_listening(self, sock):
+        '''Options for a bound TCP socket, before listen().
+
+        Buffer sizes are set here so accepted sockets inherit them (and
+        the window scale is negotiated accordingly).
+        '''
+        self._buffers(sock)
+        if self.defer_accept:
+            self._set(sock, socket.IPPROTO_TCP, TCP_DEFER_ACCEPT, self.defer_accept)
+        if self.fastopen:
+            qlen = self.fastopen if self.fastopen is not True else 256
+            self._set(sock, socket.IPPROTO_TCP, TCP_FASTOPEN, qlen)
+
+    def apply_accepted(self, sock):
+        '''Options for a freshly accepted TCP socket.
+        '''
+        self._stream(sock)
+
+    def apply_outbound(self, sock, source_ip=None):
+        '''Options for a client TCP socket, before bind() and connect().
+        '''
+        self._buffers(sock)
+        self._stream(sock)
+        if self.fastopen_connect:
+            self._set(sock, socket.IPPROTO_TCP, TCP_FASTOPEN_CONNECT, 1)
+        if self.bind_no_port and source_ip:
+            self._set(sock, socket.IPPROTO_IP, IP_BIND_ADDRESS_NO_PORT, 1)
+
+    def apply_datagram(self, sock):
+        '''Options for a UDP socket.
+        '''
+        self._buffers(sock)
+
+# Small request/response traffic: Redis, RPC, chatty HTTP APIs.
+LATENCY = SocketProfile('latency',
+    nodelay=True,
+    keepalive=True, keepidle=60, keepintvl=10, keepcnt=5,
+    fastopen=True,
+    bind_no_port=True,
+)
+
+# Many busy connections moving moderate payloads.
+THROUGHPUT = SocketProfile('throughput',
+    nodelay=True,
+    keepalive=True, keepidle=120, keepintvl=30, keepcnt=4,
+    sndbuf=2 ** 20, rcvbuf=2 ** 20,
+    bind_no_port=True,
+)
+
+# Few long-lived connections streaming large transfers.
+BULK = SocketProfile('bulk',
+    nodelay=False,
+    keepalive=True, keepidle=300, keepintvl=60, keepcnt=4,
+    sndbuf=4 * 2 ** 20, rcvbuf=4 * 2 ** 20,
+)
+
+PROFILES = {
+    'latency' : LATENCY,
+    'throughput' : THROUGHPUT,
+    'bulk' : BULK,
+}
+
+def get_profile(sockopts):
+    '''Normalize a `sockopts` argument: None, a SocketProfile, or the name
+    of one of the stock profiles.
+    '''
+    if sockopts is None or isinstance(sockopts, SocketProfile):
+        return sockopts
+    try:
+        return PROFILES[sockopts]
+    except KeyError:
+        raise ValueError("unknown socket profile: %r" % (sockopts,))
@@ -0,0 +1,107 @@
+# vim:ts=4:sw=4:expandtab
+'''Helpers for Unix domain socket Services and Clients.
+
+Paths beginning with '@' (or a NUL byte) name sockets in Linux's abstract
+namespace; they have no filesystem entry and vanish with their last
+reference.
+'''
+import errno
+import os
+import socket
+import stat
+import struct
+import sys
+
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED',
+        17 if sys.platform.startswith('linux') else None)
+_ucred = struct.Struct('3i')
+
+def socket_address(path):
+    '''Translate a user-facing path into the address bind()/connect() want.
+    '''
+    if path.startswith('@'):
+        return '\0' + path[1:]
+    return path
+
+def is_abstract(path):
+    return path.startswith('@') or path.startswith('\0')
+
+def remove_stale_socket(path):
+    '''Unlink a leftover socket file at `path` so bind() can reuse it.
+
+    Only a socket nobody is listening on is stale: if a server still
+    answers there, socket.error(EADDRINUSE) is raised instead of taking
+    the path from it.  Anything other than a socket is left alone (and
+    bind() will fail).
+    '''
+    if is_abstract(path):
+        return
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except OSError:
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    probe.setblocking(0)
+    try:
+        code = probe.connect_ex(path)
+    finally:
+        probe.close()
+    if code == errno.ECONNREFUSED:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    elif code in (0, errno.EAGAIN):
+        # EAGAIN: listening, with a full backlog.
+        raise socket.error(errno.EADDRINUSE,
+                "a server is already listening on %s" % path)
+
+def socket_identity(path):
+    '''(st_dev, st_ino) of the socket file at `path`, or None.'''
+    if is_abstract(path):
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+def remove_socket(path, identity):
+    '''Unlink the socket file at `path` if it's still the one
+    socket_identity() described, and not a later server's.
+    '''
+    if identity is not None and socket_identity(path) == identity:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def peer_credentials(sock):
+    '''Return (pid, uid, gid) of the process on the other end of `sock`,
+    or (None, None, None) when SO_PEERCRED isn't available.
+    '''
+    if SO_PEERCRED is None:
+        return None, None, None
+    try:
+        return _ucred.unpack(
+                sock.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, _ucred.size))
+    except socket.error:
+        return None, None, None
+
+class UnixPeer(tuple):
+    '''The `addr` handed to connection handlers of a Unix socket Service.
+
+    Behaves like the (host, port) tuple of a TCP Service--`addr[0]` is the
+    Service's path--and carries the peer's SO_PEERCRED credentials.
+    '''
+    def __new__(cls, path, pid=None, uid=None, gid=None):
+        return tuple.__new__(cls, (path, pid, uid, gid))
+
+    path = property(lambda self: self[0])
+    pid = property(lambda self: self[1])
+    uid = property(lambda self: self[2])
+    gid = property(lambda self: self[3])
+
+    def __repr__(self):
+        return '<UnixPeer %s pid=%s uid=%s gid=%s>' % self
@@ -1,9 +1,11 @@
 from diesel import fire, first, signal
-from diesel.events import Waiter, StopWaitDispatch
+from diesel.events import Waiter, StopWaitDispatch, StaticValue
 
 class EventTimeout(Exception): pass
 
 class Event(Waiter):
+    fifo = True
+
     def __init__(self):
         self.is_set = False
 
@@ -21,7 +23,7 @@ class Event(Waiter):
     def process_fire(self, value):
         if not self.is_set:
             raise StopWaitDispatch()
-        return value
+        return StaticValue(value)
 
     def wait(self, timeout=None):
         kw = dict(waits=[self])
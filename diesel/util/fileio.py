@@ -0,0 +1,225 @@
+'''Regular-file I/O that doesn't stall the hub.
+
+Reads and writes run as pread()/pwrite() on a small pool of threads
+(THREADS of them, started on first use), while the calling loop waits
+and every other loop runs.
+
+    data = read_file('/etc/motd')
+    for chunk in iter_file('big.log'):   # next chunk read while you work
+        ...
+    stream_to_connection('video.mp4')    # to the current connection
+    write_file('out.bin', chunks)        # str or iterable of str
+'''
+import errno
+import os
+import thread
+from Queue import Queue as _ThreadQueue
+
+from diesel import core, runtime, wait
+from diesel.events import Waiter
+
+THREADS = 4
+CHUNK_SIZE = 2 ** 16
+
+_c_pread = _c_pwrite = None
+
+def _libc():
+    '''pread and pwrite through ctypes, loaded on first use.'''
+    global _c_pread, _c_pwrite
+    if _c_pread is None:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        pwrite = getattr(libc, 'pwrite64', libc.pwrite)
+        pwrite.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_longlong]
+        pwrite.restype = ctypes.c_ssize_t
+        pread = getattr(libc, 'pread64', libc.pread)
+        pread.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_longlong]
+        pread.restype = ctypes.c_ssize_t
+        _c_pwrite, _c_pread = pwrite, pread
+    return _c_pread, _c_pwrite
+
+def _check(n):
+    if n < 0:
+        import ctypes
+        e = ctypes.get_errno()
+        if e != errno.EINTR:
+            raise OSError(e, os.strerror(e))
+    return n
+
+def pread(fd, n, offset):
+    '''Up to `n` bytes at `offset`, short only at the end of the file.
+    Blocking; run through the pool.
+    '''
+    import ctypes
+    c_pread = _libc()[0]
+    buf = ctypes.create_string_buffer(n)
+    got = 0
+    while got < n:
+        r = _check(c_pread(fd, ctypes.addressof(buf) + got, n - got, offset + got))
+        if r == 0:
+            break
+        got += max(r, 0)
+    return buf.raw if got == n else buf.raw[:got]
+
+def pwrite(fd, data, offset):
+    '''All of `data` at `offset`.  Blocking; run through the pool.'''
+    c_pwrite = _libc()[1]
+    done = 0
+    while done < len(data):
+        done += max(_check(c_pwrite(fd, data[done:] if done else data,
+                len(data) - done, offset + done)), 0)
+    return done
+
+class _Op(Waiter):
+    '''A call running on the pool; result() waits for it.  `finished`,
+    if set, is called once it's done, whether or not anyone waits.
+    '''
+    pending = True
+    value = None
+    finished = None
+
+    def done(self, value):
+        self.pending = False
+        self.value = value
+        if self.finished is not None:
+            self.finished()
+        runtime.current_app.waits.fire(self, value)
+
+    def result(self):
+        if self.pending:
+            wait(self)
+        if isinstance(self.value, Exception):
+            raise self.value
+        return self.value
+
+_jobs = _ThreadQueue()
+_started = 0
+
+def _worker():
+    while True:
+        hub, op, f, args = _jobs.get()
+        try:
+            res = f(*args)
+        except Exception, e:
+            res = e
+        hub.thread_comp_in.put((op.done, res))
+        hub.wake_from_other_thread()
+
+def submit(f, *args):
+    '''Run f(*args) on the pool; returns an op whose result() waits.
+    '''
+    global _started
+    while _started < THREADS:
+        thread.start_new_thread(_worker, ())
+        _started += 1
+    op = _Op()
+    _jobs.put((runtime.current_app.hub, op, f, args))
+    return op
+
+def _open(path, flags, mode=0666):
+    fd = os.open(path, flags, mode)
+    return fd, os.fstat(fd).st_size
+
+def _read_all(path, offset, length):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if length is None:
+            length = max(os.fstat(fd).st_size - offset, 0)
+        return pread(fd, length, offset)
+    finally:
+        os.close(fd)
+
+def read_file(path, offset=0, length=None):
+    '''The contents of `path` (`length` bytes from `offset`).'''
+    return submit(_read_all, path, offset, length).result()
+
+def iter_file(f, chunk_size=CHUNK_SIZE, offset=0, length=None):
+    '''Yield `f` (a path or an open file or fd) in chunks, reading the
+    next one while the caller deals with the current one.
+    '''
+    if isinstance(f, basestring):
+        fd, size = submit(_open, f, os.O_RDONLY).result()
+        owned = True
+    else:
+        fd = f if isinstance(f, (int, long)) else f.fileno()
+        size = os.fstat(fd).st_size
+        owned = False
+    end = size if length is None else min(size, offset + length)
+    pos = offset
+    op = None
+    try:
+        if pos < end:
+            op = submit(pread, fd, min(chunk_size, end - pos), pos)
+        while op:
+            data = op.result()
+            op = None
+            pos += len(data)
+            if data and pos < end:
+                op = submit(pread, fd, min(chunk_size, end - pos), pos)
+            if data:
+                yield data
+    finally:
+        # This may run from close() or garbage collection, outside any
+        # loop, so never wait here.  A read-ahead still running is
+        # abandoned, and closes the fd itself once done rather than have
+        # it closed under it.
+        if owned:
+            if op is not None and op.pending:
+                op.finished = lambda: os.close(fd)
+            else:
+                os.close(fd)
+
+def _wait_drained(conn):
+    if conn.pipeline.empty or conn.closed:
+        return
+    op = _Op()
+    conn.drained_callback = lambda: op.done(None)
+    op.result()
+
+def stream_to_connection(f, chunk_size=CHUNK_SIZE, offset=0, length=None):
+    '''Send `f` (a path or an open file or fd) on the current loop's
+    connection, reading ahead from disk while the last chunk goes out.
+    Only about a chunk is ever buffered.  Returns the bytes sent.
+    '''
+    conn = core.current_loop.check_connection()
+    sent = 0
+    for chunk in iter_file(f, chunk_size, offset, length):
+        _wait_drained(conn)
+        if conn.closed:
+            raise core.ConnectionClosed("connection closed while streaming a file")
+        conn.queue_outgoing(chunk)
+        conn.set_writable(True)
+        sent += len(chunk)
+    return sent
+
+def write_file(path, data, append=False, sync=False):
+    '''Write `data` (a str, or an iterable of them) to `path`, replacing
+    it unless `append`.  With an iterable, the next chunk is produced
+    while the last is written.  `sync` fsync()s before returning.
+    Returns the bytes written.
+    '''
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC)
+    fd, size = submit(_open, path, flags).result()
+    pos = size if append else 0
+    start = pos
+    op = None
+    try:
+        chunks = [data] if isinstance(data, str) else data
+        for chunk in chunks:
+            if op is not None:
+                op.result()
+            op = submit(pwrite, fd, chunk, pos)
+            pos += len(chunk)
+        if op is not None:
+            op.result()
+            op = None
+        if sync:
+            submit(os.fsync, fd).result()
+    finally:
+        if op is not None:
+            try:
+                op.result()
+            except OSError:
+                pass
+        os.close(fd)
+    return pos - start
@@ -1,9 +1,10 @@
-from uuid import uuid4
+from contextlib import contextmanager
 from diesel import wait, fire
-from collections import defaultdict
 from diesel.events import Waiter, StopWaitDispatch
 
 class Lock(Waiter):
+    fifo = True
+
     def __init__(self, count=1):
         self.count = count
 
@@ -37,9 +38,158 @@ class Lock(Waiter):
         self.count -= 1
         return value
 
+class _ReadGate(Waiter):
+    fifo = True
+
+    def __init__(self, rw):
+        self.rw = rw
+
+    def ready_early(self):
+        rw = self.rw
+        return not (rw.writer or rw.writers_waiting)
+
+    def process_fire(self, value):
+        if not self.ready_early():
+            raise StopWaitDispatch()
+        self.rw.readers += 1
+        return value
+
+class _WriteGate(Waiter):
+    fifo = True
+
+    def __init__(self, rw):
+        self.rw = rw
+
+    def ready_early(self):
+        rw = self.rw
+        return not (rw.writer or rw.readers)
+
+    def process_fire(self, value):
+        if not self.ready_early():
+            raise StopWaitDispatch()
+        self.rw.writer = True
+        self.rw.writers_waiting -= 1
+        return value
+
+class RWLock(object):
+    '''Many readers or one writer.
+
+    Writers are preferred: once a writer is waiting, new readers queue
+    behind it, so a steady stream of readers can't starve writes.  When
+    the last writer is done, every queued reader is let in at once.
+
+        with rw.read():
+            ...
+        with rw.write():
+            ...
+    '''
+    def __init__(self):
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+        self._read_gate = _ReadGate(self)
+        self._write_gate = _WriteGate(self)
+
+    def acquire_read(self):
+        if self.writer or self.writers_waiting:
+            wait(self._read_gate)
+        else:
+            self.readers += 1
+
+    def release_read(self):
+        self.readers -= 1
+        if not self.readers and self.writers_waiting:
+            fire(self._write_gate)
+
+    def acquire_write(self):
+        if self.writer or self.readers:
+            self.writers_waiting += 1
+            try:
+                wait(self._write_gate)
+            except:
+                # Killed while queued; readers held back for us may go.
+                self.writers_waiting -= 1
+                if not self.writers_waiting and not self.writer:
+                    fire(self._read_gate)
+                raise
+        else:
+            self.writer = True
+
+    def release_write(self):
+        self.writer = False
+        if self.writers_waiting:
+            fire(self._write_gate)
+        else:
+            fire(self._read_gate)
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
 class SynchronizeDefault(object): pass
 
-_sync_locks = defaultdict(Lock)
+class _KeyedLock(Lock):
+    def __init__(self):
+        Lock.__init__(self)
+        self.refs = 0
+
+# key -> _KeyedLock, for as long as some loop holds or waits on it.
+_sync_locks = {}
+
+class _Synchronized(object):
+    '''The lock for one synchronized() key.
+
+    The underlying Lock is created on the first acquire() and dropped
+    when the last holder or waiter lets go, so keys don't pile up.
+    '''
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def acquire(self):
+        lock = _sync_locks.get(self.key)
+        if lock is None:
+            lock = _sync_locks[self.key] = _KeyedLock()
+        lock.refs += 1
+        try:
+            lock.acquire()
+        except:
+            self._unref(lock)
+            raise
+
+    def release(self):
+        lock = _sync_locks[self.key]
+        lock.release()
+        self._unref(lock)
+
+    def _unref(self, lock):
+        lock.refs -= 1
+        if not lock.refs:
+            del _sync_locks[self.key]
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *args, **kw):
+        self.release()
+
+    @property
+    def is_locked(self):
+        lock = _sync_locks.get(self.key)
+        return lock is not None and lock.is_locked
 
 def synchronized(key=SynchronizeDefault):
-    return _sync_locks[key]
+    return _Synchronized(key)
@@ -7,7 +7,7 @@ import httplib
 
 import diesel
 from diesel.resolver import DNSResolutionError
-from OpenSSL import SSL
+from diesel.security import default_client_context
 
 try:
     from requests.packages.urllib3 import connectionpool
@@ -119,7 +119,7 @@ class HTTPConnection(httplib.HTTPConnection):
 class HTTPSConnection(httplib.HTTPSConnection):
     def connect(self):
         try:
-            kw = {'ssl_ctx': SSL.Context(SSL.SSLv23_METHOD)}
+            kw = {'ssl_ctx': default_client_context()}
             self.sock = SocketLike(self.host, self.port, **kw)
         except DNSResolutionError:
             raise requests.ConnectionError
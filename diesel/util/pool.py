@@ -1,6 +1,9 @@
 '''Simple connection pool for asynchronous code.
 '''
+import socket
+import time
 from collections import deque
+from itertools import count
 from diesel import *
 from diesel.util.queue import Queue, QueueTimeout
 from diesel.util.event import Event
@@ -15,49 +18,294 @@ class InfiniteQueue(object):
     def put(self):
         pass
 
+class PoolStats(object):
+    '''Counters kept by a ConnectionPool.
+
+    `hits` are checkouts served by an idle connection, `misses` those
+    that had to connect.  Wait time runs from get() until a slot (and
+    rate limit token) is had; checkout time from get() returning until
+    release().  Times are in seconds.
+    '''
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.releases = 0
+        self.checkout_time = 0.0
+        self.max_checkout_time = 0.0
+        self.evicted_idle = 0
+        self.evicted_lifetime = 0
+        self.evicted_invalid = 0
+        self.evicted_closed = 0
+        self.evicted_stale = 0
+
+    def as_dict(self):
+        d = dict(self.__dict__)
+        d['mean_wait_time'] = self.wait_time / (self.checkouts or 1)
+        d['mean_checkout_time'] = self.checkout_time / (self.releases or 1)
+        return d
+
 class ConnectionPool(object):
     '''A connection pool that holds `pool_size` connected instances,
     calls init_callable() when it needs more, and passes
     to close_callable() connections that will not fit on the pool.
+
+    With a diesel.util.ratelimit limiter as `rate_limit`, get() takes one
+    token per checkout once it has a slot, waiting up to
+    `poll_max_timeout` for it.
+
+    Keeping connections healthy:
+
+      * `min_idle` connections are opened ahead of need, by warm() or
+        in the background once the pool is first used.
+      * Idle connections are closed after `idle_timeout` seconds, down to
+        `min_idle`, and any connection after `max_lifetime` seconds.
+      * `validate(conn)` is called on an idle connection before handing
+        it out; if it returns false or raises socket.error the
+        connection is closed and the next one tried.
+      * With `validate`, when a connection comes back closed the idle
+        connections opened before it are checked in the background,
+        newest first, until one passes; those that fail are closed
+        (counted as `evicted_stale`).  After a backend restart that
+        clears out the dead ones before checkouts have to.
+
+    Checkout is `lifo` by default, which keeps a small hot set busy and
+    lets the rest age out; fifo spreads use across every connection.
+    Counters are kept in `stats` (a PoolStats).
     '''
 
-    def __init__(self, init_callable, close_callable, pool_size=5, pool_max=None, poll_max_timeout=5):
+    def __init__(self, init_callable, close_callable, pool_size=5, pool_max=None, poll_max_timeout=5,
+            rate_limit=None, min_idle=0, idle_timeout=None, max_lifetime=None, validate=None,
+            lifo=True):
         self.init_callable = init_callable
         self.close_callable = close_callable
         self.pool_size = pool_size
+        self.pool_max = pool_max
         self.poll_max_timeout = poll_max_timeout
+        self.rate_limit = rate_limit
+        self.min_idle = min(min_idle, pool_size)
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.validate = validate
+        self.lifo = lifo
         if pool_max:
             self.remaining_conns = Queue()
             for _ in xrange(pool_max):
                 self.remaining_conns.inp.append(None)
         else:
             self.remaining_conns = InfiniteQueue()
+        # (idle since, conn); the right end is the most recently released.
         self.connections = deque()
+        self.stats = PoolStats()
+        # conn -> (opened at, serial), for connections the pool opened.
+        self._born = {}
+        self._serial = count()
+        self._out = {}
+        self._maintainer = None
+        self._closed = False
+        timeouts = [t for t in (idle_timeout, max_lifetime) if t]
+        self.maintenance_interval = max(0.05, min(timeouts + [4.0]) / 4)
+
+    @property
+    def idle(self):
+        return len(self.connections)
+
+    @property
+    def in_use(self):
+        return len(self._out)
 
     def get(self):
+        start = time.time()
         try:
             self.remaining_conns.get(timeout=self.poll_max_timeout)
         except QueueTimeout:
             raise ConnectionPoolFull()
+        if self.rate_limit:
+            # Only now, so a get() that never gets a slot costs no token.
+            try:
+                self.rate_limit.acquire(timeout=self.poll_max_timeout)
+            except:
+                self.remaining_conns.put()
+                raise
+        now = time.time()
+        waited = now - start
+        stats = self.stats
+        stats.checkouts += 1
+        stats.wait_time += waited
+        stats.max_wait_time = max(stats.max_wait_time, waited)
+
+        try:
+            conn = self._checkout(now)
+        except:
+            self.remaining_conns.put()
+            raise
+        self._out[conn] = time.time()
+        self._start_maintenance()
+        return conn
 
-        if not self.connections:
-            self.connections.append(self.init_callable())
-        conn = self.connections.pop()
+    def _checkout(self, now):
+        # validate() may yield, and other loops check out and release
+        # meanwhile; the connection is off the deque before it's called.
+        while self.connections:
+            if self.lifo:
+                idle_since, conn = self.connections.pop()
+            else:
+                idle_since, conn = self.connections.popleft()
+            if conn.is_closed:
+                self._discard(conn, 'closed')
+            elif self._too_old(conn, now):
+                self._discard(conn, 'lifetime')
+            elif self.validate and not self._valid(conn):
+                self._discard(conn, 'invalid')
+            else:
+                self.stats.hits += 1
+                return conn
+        self.stats.misses += 1
+        return self._open()
+
+    def _open(self):
+        conn = self.init_callable()
+        self._born[conn] = (time.time(), next(self._serial))
+        return conn
+
+    def _valid(self, conn):
+        try:
+            return self.validate(conn)
+        except socket.error:
+            return False
 
+    def _too_old(self, conn, now):
+        if not self.max_lifetime:
+            return False
+        born = self._born.get(conn)
+        return born is not None and now - born[0] >= self.max_lifetime
+
+    def _discard(self, conn, reason):
+        setattr(self.stats, 'evicted_' + reason,
+                getattr(self.stats, 'evicted_' + reason) + 1)
+        self._born.pop(conn, None)
         if not conn.is_closed:
-            return conn
-        else:
-            self.remaining_conns.put()
-            return self.get()
+            self.close_callable(conn)
 
     def release(self, conn, error=False):
         self.remaining_conns.put()
-        if not conn.is_closed:
-            if not error and len(self.connections) < self.pool_size:
-                self.connections.append(conn)
+        now = time.time()
+        started = self._out.pop(conn, None)
+        if started is not None:
+            held = now - started
+            stats = self.stats
+            stats.releases += 1
+            stats.checkout_time += held
+            stats.max_checkout_time = max(stats.max_checkout_time, held)
+
+        if conn.is_closed:
+            born = self._born.get(conn)
+            self._discard(conn, 'closed')
+            if born is not None and self.validate:
+                fork(self._check_older_than, born)
+        elif error or self._closed or len(self.connections) >= self.pool_size:
+            self._born.pop(conn, None)
+            self.close_callable(conn)
+        elif self._too_old(conn, now):
+            self._discard(conn, 'lifetime')
+        else:
+            self.connections.append((now, conn))
+
+    def _check_older_than(self, born):
+        label("connection-pool-check")
+        older = [e for e in reversed(self.connections)
+                if self._born.get(e[1], born) <= born]
+        for entry in older:
+            if not any(e is entry for e in self.connections):
+                continue # checked out or evicted meanwhile
+            # Off the deque while validate() runs, so no checkout gets it.
+            self._remove([entry])
+            idle_since, conn = entry
+            if not self._valid(conn):
+                self._discard(conn, 'stale')
+            elif self._closed:
+                self._born.pop(conn, None)
+                self.close_callable(conn)
             else:
+                self.connections.appendleft(entry)
+                return
+
+    def _remove(self, entries):
+        '''Take `entries` off the idle deque, in place: a checkout
+        suspended in validate() must keep seeing the live deque.
+        '''
+        if entries:
+            gone = set(id(e) for e in entries)
+            keep = [e for e in self.connections if id(e) not in gone]
+            self.connections.clear()
+            self.connections.extend(keep)
+
+    def warm(self):
+        '''Open connections until `min_idle` are waiting, and keep them
+        topped up from then on.
+        '''
+        self._fill()
+        self._start_maintenance()
+
+    def close(self):
+        '''Close the idle connections and stop maintenance; connections
+        checked out now are closed as they come back.
+        '''
+        self._closed = True
+        while self.connections:
+            idle_since, conn = self.connections.popleft()
+            self._born.pop(conn, None)
+            if not conn.is_closed:
                 self.close_callable(conn)
 
+    def _start_maintenance(self):
+        if self._maintainer is None and not self._closed and (
+                self.min_idle or self.idle_timeout or self.max_lifetime):
+            self._maintainer = fork(self._maintain)
+
+    def _maintain(self):
+        label("connection-pool-maintenance")
+        try:
+            while not self._closed:
+                self._evict(time.time())
+                try:
+                    self._fill()
+                except socket.error, e:
+                    log.warning("connection pool could not pre-connect: {0}", e)
+                sleep(self.maintenance_interval)
+        finally:
+            # The next checkout starts it again if it died.
+            self._maintainer = None
+
+    def _evict(self, now):
+        # The left end has been idle longest.
+        evicted = []
+        surplus = len(self.connections) - self.min_idle
+        for entry in self.connections:
+            idle_since, conn = entry
+            if conn.is_closed:
+                reason = 'closed'
+            elif self._too_old(conn, now):
+                reason = 'lifetime'
+            elif (self.idle_timeout and surplus > 0
+                    and now - idle_since >= self.idle_timeout):
+                reason = 'idle'
+            else:
+                continue
+            evicted.append((entry, reason))
+            surplus -= 1
+        self._remove([e for e, reason in evicted])
+        for (idle_since, conn), reason in evicted:
+            self._discard(conn, reason)
+
+    def _fill(self):
+        while not self._closed and len(self.connections) < self.min_idle:
+            if self.pool_max and len(self.connections) + len(self._out) >= self.pool_max:
+                break
+            self.connections.appendleft((time.time(), self._open()))
+
     @property
     def connection(self):
         return ConnContextWrapper(self, self.get())
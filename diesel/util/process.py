@@ -4,12 +4,21 @@ Let's you run CPU intensive work in subprocesses and not block the event hub
 while doing so.
 
 """
+import cPickle as pickle
+import errno
 import multiprocessing as mp
+import socket
+import struct
 import traceback
+from collections import deque
+from itertools import count, islice
+from operator import attrgetter
 
 from diesel import runtime
 from diesel import core
-from diesel.util.queue import Queue
+from diesel import first, wait, log
+from diesel.events import Waiter
+from diesel.util.shm import Arena
 
 
 def spawn(func):
@@ -147,41 +156,350 @@ class Process(object):
 class NoSubProcesses(Exception):
     pass
 
+class ProcessTimeout(Exception):
+    pass
+
+class WorkerDied(Exception):
+    pass
+
+_frame = struct.Struct('!I')
+
+def _serve(sock, func, arena=None):
+    """The body of a pool worker: answer requests on `sock` in order.
+
+    A request is (request id, [(args, params), ...], arena position); the
+    reply is (request id, [(ok, result or exception), ...], arena
+    position).  The positions are None without a shared memory arena.
+
+    """
+    rfile = sock.makefile('rb', 65536)
+    while True:
+        try:
+            header = rfile.read(_frame.size)
+            if len(header) < _frame.size:
+                break
+            rid, calls, down_end = pickle.loads(rfile.read(_frame.unpack(header)[0]))
+            if arena:
+                calls = arena.decode_calls(calls)
+            results = []
+            for args, params in calls:
+                try:
+                    results.append((True, func(*args, **params)))
+                except Exception, e:
+                    e.original_traceback = traceback.format_exc()
+                    results.append((False, e))
+            up_end = None
+            if arena:
+                calls = None
+                results = arena.encode_results(results)
+                arena.down.release(down_end)
+                up_end = arena.up.head
+            try:
+                data = pickle.dumps((rid, results, up_end), pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                data = pickle.dumps((rid, map(_picklable, results), up_end),
+                        pickle.HIGHEST_PROTOCOL)
+            sock.sendall(_frame.pack(len(data)) + data)
+        except (SystemExit, KeyboardInterrupt):
+            break
+    sock.close()
+
+def _picklable(result):
+    try:
+        pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        e = Exception("unpicklable %s: %r" % (
+            "result" if result[0] else "exception", result[1]))
+        e.original_traceback = traceback.format_exc()
+        return (False, e)
+    return result
+
+class _Worker(object):
+    """One subprocess of a ProcessPool, with any number of requests in
+    flight over a non-blocking socket.
+
+    Outgoing requests are written once per hub pass, however many loops
+    made calls in it.
+
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.inflight = {}
+        self.load = 0
+        self.rids = count()
+        self.outbuf = bytearray()
+        self.inbuf = bytearray()
+        self.flush_scheduled = False
+        self.writing = False
+        self.dead = False
+        self.arena = None
+        if pool.shm_threshold:
+            self.arena = Arena(pool.shm_size, pool.shm_threshold)
+
+        self.sock, remote = socket.socketpair()
+        def wrapper(sock, remote):
+            sock.close()
+            _serve(remote, pool.handler, self.arena)
+        self.proc = mp.Process(target=wrapper, args=(self.sock, remote))
+        self.proc.daemon = True
+        self.proc.start()
+        remote.close()
+        self.sock.setblocking(0)
+        runtime.current_app.hub.register(
+            self.sock, self.handle_read, self.handle_write, self.died)
+
+    def submit(self, calls, callback):
+        """Queue `calls` for the worker; callback(results) is run from the
+        hub when they're done, or have failed.
+
+        """
+        rid = next(self.rids)
+        self.inflight[rid] = (len(calls), callback)
+        self.load += len(calls)
+        down_end = None
+        if self.arena:
+            calls = self.arena.encode_calls(calls)
+            down_end = self.arena.down.head
+        data = pickle.dumps((rid, calls, down_end), pickle.HIGHEST_PROTOCOL)
+        self.outbuf += _frame.pack(len(data))
+        self.outbuf += data
+        if not self.flush_scheduled and not self.writing:
+            self.flush_scheduled = True
+            runtime.current_app.hub.schedule(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        if self.dead:
+            return
+        self.handle_write()
+        if self.outbuf and not self.writing:
+            self.writing = True
+            runtime.current_app.hub.enable_write(self.sock)
+
+    def handle_write(self):
+        try:
+            sent = self.sock.send(self.outbuf)
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            # Reading will find the worker gone.
+            sent = len(self.outbuf)
+        del self.outbuf[:sent]
+        if not self.outbuf and self.writing:
+            self.writing = False
+            runtime.current_app.hub.disable_write(self.sock)
+
+    def handle_read(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except socket.error, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                return self.died()
+            if not data:
+                return self.died()
+            self.inbuf += data
+            if len(data) < 65536:
+                break
+
+        inbuf = self.inbuf
+        pos = 0
+        while len(inbuf) - pos >= _frame.size:
+            size, = _frame.unpack_from(inbuf, pos)
+            end = pos + _frame.size + size
+            if len(inbuf) < end:
+                break
+            rid, results, up_end = pickle.loads(str(inbuf[pos + _frame.size:end]))
+            pos = end
+            if self.arena:
+                results = self.arena.decode_results(results)
+                self.arena.up.release(up_end)
+            n, callback = self.inflight.pop(rid)
+            self.load -= n
+            callback(results)
+        del inbuf[:pos]
+
+    def died(self):
+        if self.dead:
+            return
+        self.close()
+        failed, self.inflight = self.inflight, {}
+        self.load = 0
+        exc = WorkerDied("worker process %s exited" % self.proc.pid)
+        for n, callback in failed.itervalues():
+            callback([(False, exc)] * n)
+        self.pool._replace(self)
+
+    def close(self):
+        self.dead = True
+        runtime.current_app.hub.unregister(self.sock)
+        self.sock.close()
+        if self.arena:
+            self.arena.close()
+        if self.proc.is_alive():
+            self.proc.terminate()
+        self.proc.join(0)
+
+class _Call(Waiter):
+    def done(self, results):
+        runtime.current_app.waits.fire(self, results[0])
+
+class _Chunks(Waiter):
+    """Finished chunks of a map, in the order they finish."""
+    def __init__(self):
+        self.ready = deque()
+
+    def callback(self, start):
+        def done(results):
+            self.ready.append((start, results))
+            runtime.current_app.waits.fire(self, None)
+        return done
+
 class ProcessPool(object):
     """A bounded pool of subprocesses.
 
     An instance is callable, just like a Process, and will return the result
-    of executing the function in a subprocess. If all subprocesses are busy,
-    the caller will wait in a queue.
+    of executing the function in a subprocess. Calls are spread over the
+    subprocesses by how much work each has outstanding, and any number may
+    be in flight to one subprocess at a time; they queue in the socket
+    rather than in the parent.
+
+    A subprocess that dies is replaced; calls it had in flight raise
+    WorkerDied.
+
+    An exception raised by the handler comes back as that call's result,
+    with its `original_traceback`, as it does from a Process.  With
+    `raise_errors` it's raised in the caller instead.
+
+    Arguments and results of `shm_threshold` bytes or more can go through
+    shared memory instead of being pickled; see diesel.util.shm for what
+    the handler gets and for how long it stays valid.
 
     """
-    def __init__(self, concurrency, handler):
+    def __init__(self, concurrency, handler, timeout=None, shm_threshold=None,
+            shm_size=32 * 1024 * 1024, raise_errors=False):
         """Creates a new ProcessPool with subprocesses that run the handler.
 
         Args:
             concurrency (int): The number of subprocesses to spawn.
             handler (callable): A callable that the subprocesses will execute.
+            timeout (float): Default seconds to wait for a call before
+                raising ProcessTimeout; the subprocess still finishes it.
+            shm_threshold (int): Size in bytes from which strings, buffers
+                and NumPy arrays are passed through shared memory.
+            shm_size (int): Bytes of shared memory per subprocess and
+                direction.
+            raise_errors (bool): Raise a handler's exception in the
+                caller rather than returning it.
 
         """
         self.concurrency = concurrency
         self.handler = handler
-        self.available_procs = Queue()
+        self.timeout = timeout
+        self.shm_threshold = shm_threshold
+        self.shm_size = shm_size
+        self.raise_errors = raise_errors
         self.all_procs = []
+        self.closed = False
 
     def __call__(self, *args, **params):
-        """Gets a process from the pool, executes it, and returns the results.
+        """Runs the handler in a subprocess and returns the result.
 
-        This call will block until there is a process available to handle it.
+        Other loops run in the meantime.
 
         """
+        return self.apply(args, params)
+
+    def apply(self, args=(), params=None, timeout=None):
+        """Like calling the pool, with a `timeout` for this call alone."""
+        call = _Call()
+        self._worker().submit([(args, params or {})], call.done)
+        timeout = timeout or self.timeout
+        if timeout:
+            mark, val = first(waits=[call], sleep=timeout)
+            if mark is not call:
+                raise ProcessTimeout()
+            ok, result = val
+        else:
+            ok, result = wait(call)
+        return self._result(ok, result)
+
+    def imap_unordered(self, iterable, chunksize=1, timeout=None):
+        """Yields handler(item) for each item in `iterable`, as they finish.
+
+        Items go to the subprocesses `chunksize` at a time, and only a couple
+        of chunks per subprocess are outstanding at once, so `iterable` may
+        be long or endless.  `timeout` bounds the wait for each chunk.
+
+        """
+        for start, results in self._stream(iterable, chunksize, timeout):
+            for ok, result in results:
+                yield self._result(ok, result)
+
+    def map(self, iterable, chunksize=1, timeout=None):
+        """Returns [handler(item) for item in iterable], computed in the
+        subprocesses.
+
+        """
+        out = []
+        for start, results in self._stream(iterable, chunksize, timeout):
+            if len(out) < start + len(results):
+                out.extend([None] * (start + len(results) - len(out)))
+            for i, (ok, result) in enumerate(results):
+                out[start + i] = self._result(ok, result)
+        return out
+
+    def _result(self, ok, result):
+        # WorkerDied is the pool's failure, not the handler's.
+        if not ok and (self.raise_errors or isinstance(result, WorkerDied)):
+            raise result
+        return result
+
+    def _stream(self, iterable, chunksize, timeout):
+        timeout = timeout or self.timeout
+        items = iter(iterable)
+        chunks = _Chunks()
+        window = 2 * self.concurrency
+        outstanding = 0
+        start = 0
+        exhausted = False
+        while True:
+            while not exhausted and outstanding < window:
+                calls = [((item,), {}) for item in islice(items, chunksize)]
+                if not calls:
+                    exhausted = True
+                    break
+                self._worker().submit(calls, chunks.callback(start))
+                start += len(calls)
+                outstanding += 1
+            if not outstanding:
+                return
+            if not chunks.ready:
+                if timeout:
+                    mark, val = first(waits=[chunks], sleep=timeout)
+                    if mark is not chunks:
+                        raise ProcessTimeout()
+                else:
+                    wait(chunks)
+            while chunks.ready:
+                outstanding -= 1
+                yield chunks.ready.popleft()
+
+    def _worker(self):
         if not self.all_procs:
             raise NoSubProcesses("Did you forget to start the pool?")
-        try:
-            p = self.available_procs.get()
-            result = p(*args, **params)
-            return result
-        finally:
-            self.available_procs.put(p)
+        return min(self.all_procs, key=attrgetter('load'))
+
+    def _replace(self, worker):
+        if worker in self.all_procs:
+            self.all_procs.remove(worker)
+        if not self.closed:
+            log.warning("process pool worker {0} died; starting another",
+                    worker.proc.pid)
+            self.all_procs.append(_Worker(self))
 
     def pool(self):
         """A callable that starts the processes in the pool.
@@ -190,10 +508,15 @@ class ProcessPool(object):
         ProcessPool to your application.
 
         """
+        self.closed = False
         for i in xrange(self.concurrency):
-            proc = spawn(self.handler)
-            self.available_procs.put(proc)
-            self.all_procs.append(proc)
+            self.all_procs.append(_Worker(self))
+
+    def close(self):
+        """Terminates the subprocesses; calls in flight raise WorkerDied."""
+        self.closed = True
+        for worker in list(self.all_procs):
+            worker.died()
 
 if __name__ == '__main__':
     import diesel
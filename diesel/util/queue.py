@@ -1,26 +1,110 @@
-from uuid import uuid4
 import random
-from collections import deque
+from collections import deque, defaultdict
 from contextlib import contextmanager
+from heapq import heappush, heappop, heapify, heapreplace
+from itertools import count
+from time import time
 
 from diesel import fire, sleep, first
+from diesel import core, runtime
+from diesel.hub import Timer
 from diesel.events import Waiter, StopWaitDispatch
 
 class QueueEmpty(Exception): pass
+class QueueFull(Exception): pass
 class QueueTimeout(Exception): pass
 
+class _NotFull(Waiter):
+    '''What producers blocked on a full Queue wait for.
+
+    Waking a producer reserves a slot for it (`granted`), so room freed
+    by one get() lets in exactly one producer.
+    '''
+    fifo = True
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.granted = 0
+
+    def process_fire(self, value):
+        if self.queue.full:
+            raise StopWaitDispatch()
+        self.granted += 1
+        return value
+
+    def ready_early(self):
+        return not self.queue.full
+
 class Queue(Waiter):
-    def __init__(self):
+    '''A FIFO queue for passing items between loops.
+
+    With `maxsize`, put() blocks while the queue holds that many items;
+    producers are let in, oldest first, as consumers make room.
+
+    get() on a non-empty queue normally yields to the hub after every
+    item so other loops get a turn.  `yield_every` relaxes that to every
+    N items taken back-to-back by the same loop, and `time_slice` to
+    whenever a loop has held on for that many seconds (whichever comes
+    first).  drain() takes everything available without yielding at all.
+    '''
+    fifo = True
+
+    def __init__(self, maxsize=0, yield_every=1, time_slice=None):
         self.inp = deque()
+        self.maxsize = maxsize
+        self.not_full = _NotFull(self)
+        self.yield_every = yield_every
+        self.time_slice = time_slice
+        self._streak_loop = None
+        self._streak = 0
+        self._streak_start = None
 
-    def put(self, i=None):
-        self.inp.append(i)
+    def put(self, i=None, waiting=True, timeout=None):
+        if self.full:
+            self._wait_for_room(waiting, timeout)
+        self._push(i)
         fire(self)
 
-    def get(self, waiting=True, timeout=None):
+    def put_many(self, items, waiting=True, timeout=None):
+        '''Put all of `items`, waking consumers once per batch rather
+        than once per item.  On a bounded queue this blocks until every
+        item fits; on a timeout some of them may already be queued.
+        '''
+        items = deque(items)
+        while items:
+            if self.maxsize:
+                if self.full:
+                    self._wait_for_room(waiting, timeout)
+                    room = 1
+                else:
+                    room = self.maxsize - len(self.inp) - self.not_full.granted
+            else:
+                room = len(items)
+            for n in xrange(min(room, len(items))):
+                self._push(items.popleft())
+            fire(self)
+
+    def _wait_for_room(self, waiting, timeout):
+        if not waiting:
+            raise QueueFull()
+        kw = dict(waits=[self.not_full])
+        if timeout:
+            kw['sleep'] = timeout
+        mark, val = first(**kw)
+        if mark != self.not_full:
+            raise QueueTimeout()
+        # Use the slot process_fire reserved for us.
+        self.not_full.granted -= 1
+
+    def _made_room(self):
+        if self.maxsize and self.not_full._waiters:
+            fire(self.not_full)
+
+    def get(self, waiting=True, timeout=None, yield_every=None):
         if self.inp:
-            val = self.inp.popleft()
-            sleep()
+            val = self._pop()
+            self._made_room()
+            self._maybe_yield(yield_every or self.yield_every)
             return val
         mark = None
 
@@ -30,12 +114,80 @@ class Queue(Waiter):
                 kw['sleep'] = timeout
             mark, val = first(**kw)
             if mark == self:
+                # We waited, so other loops have had their turn.
+                self._streak_loop = None
                 return val
             else:
                 raise QueueTimeout()
 
         raise QueueEmpty()
 
+    def get_many(self, max_items=None, waiting=True, timeout=None):
+        '''Get up to `max_items` items (all available ones by default)
+        as a list, waiting for at least one if the queue is empty.
+        '''
+        if self.inp:
+            out = []
+        elif waiting:
+            kw = dict(waits=[self])
+            if timeout:
+                kw['sleep'] = timeout
+            mark, val = first(**kw)
+            if mark != self:
+                raise QueueTimeout()
+            out = [val]
+        else:
+            raise QueueEmpty()
+        inp = self.inp
+        n = len(inp) if max_items is None else min(len(inp), max_items - len(out))
+        for i in xrange(n):
+            out.append(self._pop())
+        self._made_room()
+        return out
+
+    def _maybe_yield(self, every):
+        loop = core.current_loop
+        if loop is not self._streak_loop:
+            self._streak_loop = loop
+            self._streak = 0
+            if self.time_slice:
+                self._streak_start = time()
+        self._streak += 1
+        if self._streak >= every or (self.time_slice
+                and time() - self._streak_start >= self.time_slice):
+            self._streak_loop = None
+            sleep()
+
+    def drain(self, waiting=True, timeout=None):
+        '''Iterate over every item available without going back to the
+        hub, waiting for the first one if the queue is empty (unless
+        `waiting` is False).  Stops once the queue is empty.
+        '''
+        if not self.inp:
+            if not waiting:
+                return
+            kw = dict(waits=[self])
+            if timeout:
+                kw['sleep'] = timeout
+            mark, val = first(**kw)
+            if mark != self:
+                raise QueueTimeout()
+            yield val
+        inp = self.inp
+        while inp:
+            val = self._pop()
+            self._made_room()
+            yield val
+
+    def _push(self, i):
+        self.inp.append(i)
+
+    def _pop(self):
+        return self.inp.popleft()
+
+    def qsize(self):
+        return len(self.inp)
+
     def __iter__(self):
         return self
 
@@ -46,59 +198,417 @@ class Queue(Waiter):
     def is_empty(self):
         return not bool(self.inp)
 
+    @property
+    def full(self):
+        return bool(self.maxsize) and (
+            len(self.inp) + self.not_full.granted >= self.maxsize)
+
     def process_fire(self, value):
         if self.inp:
-            return self.inp.popleft()
+            val = self._pop()
+            self._made_room()
+            return val
         else:
             raise StopWaitDispatch()
 
     def ready_early(self):
         return not self.is_empty
 
+class PriorityQueue(Queue):
+    '''A Queue that hands out its smallest item first.
+
+    Items are compared directly, or by `key(item)` if given; equal items
+    come out in the order they were put.  Everything else (maxsize,
+    get_many, drain, ...) works as for Queue.
+    '''
+    def __init__(self, maxsize=0, key=None, **kw):
+        Queue.__init__(self, maxsize, **kw)
+        self.inp = []
+        self.key = key
+        self._seq = count()
+
+    def _push(self, i):
+        k = i if self.key is None else self.key(i)
+        heappush(self.inp, (k, next(self._seq), i))
+
+    def _pop(self):
+        return heappop(self.inp)[2]
+
+class DelayQueue(Queue):
+    '''A Queue whose items only become visible once they are due.
+
+    put(item, delay=5) or put(item, when=t) keeps the item in a heap
+    until then; put_many() does the same for a batch due together.  One
+    hub timer, armed for the earliest due time, moves due items into the
+    queue and wakes consumers, so a delayed item costs a heap entry rather
+    than a sleeping loop.  Items never come out before they're due, and
+    due items come out in due order; qsize() counts only those.
+    '''
+    def __init__(self, yield_every=1, time_slice=None):
+        Queue.__init__(self, yield_every=yield_every, time_slice=time_slice)
+        self.delayed = []
+        self._seq = count()
+        self._timer = None
+        self._timer_at = None
+
+    def put(self, i=None, waiting=True, timeout=None, delay=0, when=None):
+        if when is None:
+            when = time() + delay
+        if when <= time():
+            Queue.put(self, i, waiting, timeout)
+            return
+        heappush(self.delayed, (when, next(self._seq), i))
+        self._arm_for(when)
+
+    def put_many(self, items, waiting=True, timeout=None, delay=0, when=None):
+        if when is None:
+            when = time() + delay
+        if when <= time():
+            Queue.put_many(self, items, waiting, timeout)
+            return
+        for i in items:
+            heappush(self.delayed, (when, next(self._seq), i))
+        if self.delayed:
+            self._arm_for(when)
+
+    def _arm_for(self, when):
+        if self._timer_at is None or when < self._timer_at:
+            self._arm(when)
+
+    def _arm(self, when):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = when
+        # Hub timers count as due ALLOWANCE before their time; set this
+        # one ALLOWANCE late so it fires once `when` has actually passed.
+        self._timer = runtime.current_app.hub.call_later(
+                max(0, when - time()) + Timer.ALLOWANCE, self._release)
+
+    def _release(self):
+        self._timer = self._timer_at = None
+        delayed = self.delayed
+        now = time()
+        moved = False
+        while delayed and delayed[0][0] <= now:
+            self.inp.append(heappop(delayed)[2])
+            moved = True
+        if delayed:
+            self._arm(delayed[0][0])
+        if moved:
+            runtime.current_app.waits.fire(self, None)
+
+class SubscriberLagged(Exception):
+    '''Raised to a Fanout subscriber that fell too far behind under the
+    'disconnect' policy; it has been unsubscribed.
+    '''
+
+class Subscription(Waiter):
+    '''One subscriber's cursor into a Fanout's ring buffer.
+
+    Wait on it with diesel.wait()/first(), or call get().  `lag` is how
+    many messages it has yet to read; `dropped` counts messages it missed
+    under the 'drop_oldest' policy.
+    '''
+    def __init__(self, fanout):
+        self.fanout = fanout
+        self.cursor = fanout.head
+        self.dropped = 0
+        self.lagged = False
+
+    @property
+    def lag(self):
+        return self.fanout.head - self.cursor
+
+    @property
+    def is_empty(self):
+        return self.cursor >= self.fanout.head and not self.lagged
+
+    def get(self, waiting=True, timeout=None):
+        if not self.is_empty:
+            val = self._take()
+        elif waiting:
+            kw = dict(waits=[self])
+            if timeout:
+                kw['sleep'] = timeout
+            mark, val = first(**kw)
+            if mark != self:
+                raise QueueTimeout()
+        else:
+            raise QueueEmpty()
+        if isinstance(val, SubscriberLagged):
+            raise val
+        return val
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.get()
+
+    def _take(self):
+        f = self.fanout
+        behind = f.head - self.cursor - f.size
+        if behind > 0:
+            if f.policy == 'disconnect':
+                self.lagged = True
+            else:
+                self.dropped += behind
+                self.cursor += behind
+        if self.lagged:
+            f.subs.discard(self)
+            return SubscriberLagged('subscriber fell %d messages behind'
+                    % self.lag)
+        m = f.ring[self.cursor % f.size]
+        if f.room._waiters and self.cursor == f.tail:
+            # We were (one of) the slowest; a blocked publisher may go.
+            self.cursor += 1
+            runtime.current_app.waits.fire(f.room, None)
+        else:
+            self.cursor += 1
+        return m
+
+    def ready_early(self):
+        if not self.is_empty:
+            return True
+        self.fanout.parked.add(self)
+        return False
+
+    def process_fire(self, value):
+        if self.is_empty:
+            raise StopWaitDispatch()
+        return self._take()
+
+class _FanoutRoom(Waiter):
+    '''What publishers blocked by a slow subscriber wait for.
+    '''
+    fifo = True
+
+    def __init__(self, fanout):
+        self.fanout = fanout
+        self.granted = 0
+
+    def process_fire(self, value):
+        if not self.fanout.has_room:
+            raise StopWaitDispatch()
+        self.granted += 1
+        return value
+
+    def ready_early(self):
+        return self.fanout.has_room
+
 class Fanout(object):
-    def __init__(self):
+    '''Publish each message to every current subscriber.
+
+    Messages go into one shared ring buffer of `size` slots and each
+    subscriber keeps a cursor into it, so pub() costs the same for 10
+    subscribers as for 50,000.  Subscribers that are waiting are woken in
+    one batch per hub iteration, however many messages arrive in it.
+
+    `policy` says what happens to a subscriber that falls `size` messages
+    behind:
+
+        'grow'        -- the ring doubles, so nothing is ever lost; memory
+                         is bounded only by the slowest subscriber (the
+                         default, as before the ring buffer)
+        'drop_oldest' -- it skips ahead, losing the oldest messages (see
+                         Subscription.dropped)
+        'disconnect'  -- it is unsubscribed; its next get() raises
+                         SubscriberLagged
+        'block'       -- pub() blocks until the slowest subscriber catches up
+    '''
+    POLICIES = ('grow', 'drop_oldest', 'disconnect', 'block')
+
+    def __init__(self, size=4096, policy='grow'):
+        if policy not in self.POLICIES:
+            raise ValueError("unknown Fanout policy %r" % (policy,))
+        self.size = size
+        self.policy = policy
+        self.ring = [None] * size
+        self.head = 0
+        self.tail = 0
         self.subs = set()
+        self.parked = set()
+        self.room = _FanoutRoom(self)
+        self._wake_scheduled = False
+
+    def pub(self, m, waiting=True, timeout=None):
+        if self.policy in ('block', 'grow') and self.subs:
+            if not self.has_room:
+                if self.policy == 'grow':
+                    self._grow()
+                else:
+                    self._wait_for_room(waiting, timeout)
+        self.ring[self.head % self.size] = m
+        self.head += 1
+        if self.parked and not self._wake_scheduled:
+            self._wake_scheduled = True
+            runtime.current_app.hub.schedule(self._wake_parked)
 
-    def pub(self, m):
-        for s in self.subs:
-            s.put(m)
+    def _grow(self):
+        old, old_size = self.ring, self.size
+        self.size = old_size * 2
+        self.ring = [None] * self.size
+        for i in xrange(self.tail, self.head):
+            self.ring[i % self.size] = old[i % old_size]
+
+    def _wait_for_room(self, waiting, timeout):
+        if not waiting:
+            raise QueueFull()
+        kw = dict(waits=[self.room])
+        if timeout:
+            kw['sleep'] = timeout
+        mark, val = first(**kw)
+        if mark != self.room:
+            raise QueueTimeout()
+        self.room.granted -= 1
+
+    @property
+    def has_room(self):
+        used = self.head + self.room.granted
+        if used - self.tail < self.size:
+            return True
+        if self.subs:
+            self.tail = min(s.cursor for s in self.subs)
+        else:
+            self.tail = self.head
+        return used - self.tail < self.size
+
+    def _wake_parked(self):
+        self._wake_scheduled = False
+        parked = self.parked
+        self.parked = set()
+        fire = runtime.current_app.waits.fire
+        for sub in parked:
+            fire(sub, None)
+
+    @property
+    def max_lag(self):
+        return max([s.lag for s in self.subs] or [0])
 
     @contextmanager
     def sub(self):
-        q = Queue()
+        q = Subscription(self)
         self.subs.add(q)
         try:
             yield q
         finally:
-            self.subs.remove(q)
+            self.subs.discard(q)
+            self.parked.discard(q)
+            if self.room._waiters:
+                runtime.current_app.waits.fire(self.room, None)
 
-class Dispatcher(object):
+def pending(q):
+    '''How backed up a worker's queue is: items waiting in it, plus one
+    if its loop is busy rather than parked on the queue.
+    '''
+    return len(q.inp) + (0 if q._waiters else 1)
+
+class RandomPolicy(object):
+    '''Any worker, uniformly at random.
+    '''
+    def choose(self, workers):
+        return random.choice(workers)
+
+class RoundRobinPolicy(object):
+    '''Each worker in turn.
+    '''
     def __init__(self):
+        self.next = 0
+
+    def choose(self, workers):
+        i = self.next % len(workers)
+        self.next = i + 1
+        return workers[i]
+
+class LeastPendingPolicy(object):
+    '''The worker with the fewest pending items (O(workers) per pick).
+    '''
+    def choose(self, workers):
+        return min(workers, key=pending)
+
+class PowerOfTwoPolicy(object):
+    '''The less loaded of two random workers; nearly as good as
+    least-pending, at constant cost.
+    '''
+    def choose(self, workers):
+        if len(workers) < 2:
+            return workers[0]
+        a, b = random.sample(workers, 2)
+        return a if pending(a) <= pending(b) else b
+
+POLICIES = {
+    'random' : RandomPolicy,
+    'round_robin' : RoundRobinPolicy,
+    'least_pending' : LeastPendingPolicy,
+    'power_of_two' : PowerOfTwoPolicy,
+}
+
+def get_policy(policy):
+    '''Normalize a Dispatcher `policy`: None (random), an object with a
+    choose(workers) method, or the name of one of the stock policies.
+    '''
+    if policy is None:
+        return RandomPolicy()
+    if not isinstance(policy, basestring):
+        return policy
+    try:
+        return POLICIES[policy]()
+    except KeyError:
+        raise ValueError("unknown dispatch policy: %r" % (policy,))
+
+_subscriber_ids = count()
+
+class Dispatcher(object):
+    '''Hand each message to one of the loops inside accept().
+
+    `policy` picks the worker; see POLICIES.  When a worker leaves,
+    whatever was still queued for it is spread over the remaining
+    workers, least loaded first, one put_many() each.
+    '''
+    def __init__(self, policy=None):
+        self.policy = get_policy(policy)
         self.subs = {}
         self.keys = []
+        self.workers = []
         self.backlog = []
 
     def dispatch(self, m):
-        if self.subs:
-            k = random.choice(self.keys)
-            self.subs[k].put(m)
+        if self.workers:
+            self.policy.choose(self.workers).put(m)
         else:
             self.backlog.append(m)
 
+    def _redistribute(self, items):
+        if not self.workers:
+            self.backlog.extend(items)
+            return
+        heap = [(pending(q), i) for i, q in enumerate(self.workers)]
+        heapify(heap)
+        shares = defaultdict(list)
+        for item in items:
+            load, i = heap[0]
+            shares[i].append(item)
+            heapreplace(heap, (load + 1, i))
+        for i, share in shares.iteritems():
+            self.workers[i].put_many(share)
+
+    def _changed(self):
+        self.keys = list(self.subs)
+        self.workers = [self.subs[k] for k in self.keys]
+
     @contextmanager
     def accept(self):
         q = Queue()
         if self.backlog:
-            for b in self.backlog:
-                q.put(b)
+            q.put_many(self.backlog)
             self.backlog = []
-        id = uuid4()
+        id = next(_subscriber_ids)
         self.subs[id] = q
-        self.keys = list(self.subs)
+        self._changed()
         try:
             yield q
         finally:
             del self.subs[id]
-            self.keys = list(self.subs)
-            while not q.is_empty:
-                self.dispatch(q.get())
+            self._changed()
+            if not q.is_empty:
+                self._redistribute(list(q.drain(waiting=False)))
@@ -0,0 +1,174 @@
+'''Rate limiters for loops: a token bucket and a sliding window.
+
+    api = TokenBucket(rate=50, burst=10)    # 50/s, bursts of up to 10
+    api.acquire()                           # blocks until allowed
+    if api.try_acquire(): ...               # or don't block
+
+Loops blocked in acquire() are served in arrival order.  Each limiter
+keeps at most one hub timer, armed for when the loop at the front of the
+line can go, however many loops are waiting.
+
+ConnectionPool, diesel.protocols.http.pool.request and Service all take
+a `rate_limit`.
+'''
+from collections import deque
+from time import time
+
+from diesel import first, runtime
+from diesel.events import Waiter
+from diesel.hub import Timer
+
+class RateLimitTimeout(Exception): pass
+
+class _Ticket(Waiter):
+    '''One loop's place in a limiter's line.
+    '''
+    def __init__(self, n):
+        self.n = n
+        self.cancelled = False
+
+class RateLimiter(object):
+    '''The FIFO line and timer shared by the limiters.
+
+    Subclasses implement _wait_time(n, now), how many seconds until `n`
+    can be had, and _take(n, at), which spends them.  Hub timers may run
+    up to Timer.ALLOWANCE early, so the timer grants anything due within
+    that and charges it to the future, keeping the long-run rate exact.
+    '''
+    def __init__(self):
+        self.waiting = deque()
+        self._timer = None
+
+    def try_acquire(self, n=1):
+        '''Take `n` if that can be done right now, without queueing; never
+        jumps ahead of loops already waiting.
+        '''
+        self._check(n)
+        self._skip_cancelled()
+        if self.waiting:
+            return False
+        return self._reserve(n, time(), 0.0) == 0
+
+    def acquire(self, n=1, timeout=None):
+        '''Block until `n` can be taken.  Raises RateLimitTimeout after
+        `timeout` seconds, having taken nothing.
+        '''
+        if self.try_acquire(n):
+            return
+        ticket = _Ticket(n)
+        self.waiting.append(ticket)
+        self._arm()
+        kw = dict(waits=[ticket])
+        if timeout:
+            kw['sleep'] = timeout
+        mark, val = first(**kw)
+        if mark is not ticket:
+            ticket.cancelled = True
+            if self.waiting and self.waiting[0] is ticket:
+                # The timer was armed for us; re-arm for whoever is next.
+                self._skip_cancelled()
+                self._rearm()
+            raise RateLimitTimeout()
+
+    def delay(self, n=1):
+        '''Seconds until `n` could be taken, ignoring any waiting loops.
+        '''
+        return self._wait_time(n, time())
+
+    def _check(self, n):
+        pass
+
+    def _reserve(self, n, now, slack):
+        wait = self._wait_time(n, now)
+        if wait <= slack:
+            self._take(n, now + wait)
+            return 0
+        return wait
+
+    def _skip_cancelled(self):
+        waiting = self.waiting
+        while waiting and waiting[0].cancelled:
+            waiting.popleft()
+
+    def _arm(self):
+        if self._timer is None and self.waiting:
+            wait = self._wait_time(self.waiting[0].n, time())
+            self._timer = runtime.current_app.hub.call_later(wait, self._grant)
+
+    def _rearm(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._arm()
+
+    def _grant(self):
+        self._timer = None
+        fire = runtime.current_app.waits.fire
+        waiting = self.waiting
+        while waiting:
+            ticket = waiting[0]
+            if ticket.cancelled:
+                waiting.popleft()
+                continue
+            if self._reserve(ticket.n, time(), Timer.ALLOWANCE):
+                break
+            waiting.popleft()
+            fire(ticket, None)
+        self._arm()
+
+class TokenBucket(RateLimiter):
+    '''`rate` tokens per second, saving up at most `burst` (default:
+    one second's worth).
+    '''
+    def __init__(self, rate, burst=None):
+        RateLimiter.__init__(self)
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.tokens = self.burst
+        self.last = time()
+
+    def _check(self, n):
+        if n > self.burst:
+            raise ValueError("can't take %s tokens from a bucket of %s"
+                    % (n, self.burst))
+
+    def _refill(self, now):
+        if now > self.last:
+            self.tokens = min(self.burst,
+                    self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+    def _wait_time(self, n, now):
+        self._refill(now)
+        return max(0.0, (n - self.tokens) / self.rate)
+
+    def _take(self, n, at):
+        self.tokens -= n
+
+class SlidingWindow(RateLimiter):
+    '''At most `limit` acquisitions in any `window` seconds.
+    '''
+    def __init__(self, limit, window=1.0):
+        RateLimiter.__init__(self)
+        self.limit = limit
+        self.window = float(window)
+        self.events = deque()
+
+    def _check(self, n):
+        if n > self.limit:
+            raise ValueError("can't take %s from a window of %s"
+                    % (n, self.limit))
+
+    def _wait_time(self, n, now):
+        events = self.events
+        while events and events[0] <= now - self.window:
+            events.popleft()
+        over = len(events) + n - self.limit
+        if over <= 0:
+            return 0.0
+        return max(0.0, events[over - 1] + self.window - now)
+
+    def _take(self, n, at):
+        # Stamped with when the slot actually frees up, so every window
+        # stays within the limit.
+        self.events.extend([at] * n)
@@ -0,0 +1,149 @@
+'''Shared memory for passing large values to and from pool subprocesses.
+
+Each ProcessPool worker created with a `shm_threshold` gets an Arena: an
+anonymous shared mmap, mapped before the worker forks, holding two rings.
+The parent writes big arguments into one and the worker writes big
+results into the other.  Only a small Ref (offset, length, type) is
+pickled.  Each value is copied once on the way in and once on the way
+out, not pickled, sent, received and unpickled.
+
+Ownership:
+
+  * Strings, bytearrays and buffers at or over the threshold reach the
+    handler as read-only `buffer` views, and NumPy arrays as arrays over
+    the arena.  They are only valid until the handler returns: copy
+    anything that must outlive the call.
+  * Results at or over the threshold are copied out of the arena before
+    the caller sees them, as a str or an ndarray.
+  * Each ring is released in order, by a position the reader stores in
+    the arena header, so no extra messages are needed.  When a ring is
+    full the value is simply pickled as usual.
+
+Only top-level arguments, keyword values and results are considered.
+'''
+import ctypes
+import mmap
+import struct
+import sys
+from collections import namedtuple
+
+_counter = struct.Struct('!Q')
+
+Ref = namedtuple('Ref', 'offset length dtype shape')
+
+class _Ring(object):
+    '''One direction of an Arena.  The writer side allocates with
+    alloc(); the reader calls release() once done with everything up to
+    a position the writer handed it.
+    '''
+    def __init__(self, arena, base, size, tail_at):
+        self.arena = arena
+        self.base = base
+        self.size = size
+        self.tail_at = tail_at
+        self.head = 0
+
+    def alloc(self, n):
+        if n > self.size:
+            return None
+        tail, = _counter.unpack_from(self.arena.mm, self.tail_at)
+        pos = self.head % self.size
+        skip = self.size - pos if pos + n > self.size else 0
+        if self.head + skip + n - tail > self.size:
+            return None
+        offset = self.base + (self.head + skip) % self.size
+        self.head += skip + n
+        return offset
+
+    def release(self, end):
+        _counter.pack_into(self.arena.mm, self.tail_at, end)
+
+class Arena(object):
+    '''Two rings of `size` bytes each in one shared mmap: `down` carries
+    arguments to the worker and `up` results back.
+    '''
+    HEADER = 2 * _counter.size
+
+    def __init__(self, size, threshold):
+        self.threshold = threshold
+        self.mm = mmap.mmap(-1, self.HEADER + 2 * size)
+        self.address = ctypes.addressof(ctypes.c_char.from_buffer(self.mm))
+        self.down = _Ring(self, self.HEADER, size, 0)
+        self.up = _Ring(self, self.HEADER + size, size, _counter.size)
+
+    def close(self):
+        self.mm.close()
+
+    def _big(self, value):
+        '''(source for memmove, length, dtype, shape) if `value` should go
+        through the arena, else None.
+        '''
+        t = type(value)
+        if t is str or t is bytearray or t is buffer:
+            if len(value) < self.threshold:
+                return None
+            if t is bytearray:
+                return (ctypes.c_char * len(value)).from_buffer(value), len(value), None, None
+            return str(value), len(value), None, None
+        np = sys.modules.get('numpy')
+        if np is not None and isinstance(value, np.ndarray) and value.nbytes >= self.threshold:
+            value = np.ascontiguousarray(value)
+            return value.ctypes.data, value.nbytes, value.dtype.str, value.shape
+        return None
+
+    def put(self, ring, value):
+        '''A Ref to a copy of `value` in `ring`, or `value` itself if it
+        is small or doesn't fit.
+        '''
+        big = self._big(value)
+        if big is None:
+            return value
+        source, length, dtype, shape = big
+        offset = ring.alloc(length)
+        if offset is None:
+            return value
+        ctypes.memmove(self.address + offset, source, length)
+        return Ref(offset, length, dtype, shape)
+
+    def view(self, ref):
+        '''A zero-copy view of what `ref` points at.'''
+        if ref.dtype is None:
+            return buffer(self.mm, ref.offset, ref.length)
+        import numpy
+        return numpy.frombuffer(self.mm, numpy.dtype(ref.dtype),
+                ref.length // numpy.dtype(ref.dtype).itemsize,
+                ref.offset).reshape(ref.shape)
+
+    def take(self, ref):
+        '''A private copy of what `ref` points at.'''
+        if ref.dtype is None:
+            return self.mm[ref.offset:ref.offset + ref.length]
+        return self.view(ref).copy()
+
+    def encode_calls(self, calls):
+        put, ring = self.put, self.down
+        return [(tuple(put(ring, a) for a in args),
+                 dict((k, put(ring, v)) for k, v in params.iteritems()))
+                for args, params in calls]
+
+    def decode_calls(self, calls):
+        return [(tuple(self._arg(a) for a in args),
+                 dict((k, self._arg(v)) for k, v in params.iteritems()))
+                for args, params in calls]
+
+    def _arg(self, value):
+        if type(value) is Ref:
+            return self.view(value)
+        if type(value) in (str, bytearray) and len(value) >= self.threshold:
+            # Pickled because the ring was full; same type as if it weren't.
+            return buffer(value)
+        return value
+
+    def encode_results(self, results):
+        put, ring = self.put, self.up
+        return [(ok, put(ring, value) if ok else value)
+                for ok, value in results]
+
+    def decode_results(self, results):
+        return [(ok, self.take(value) if type(value) is Ref else value)
+                for ok, value in results]
@@ -1,6 +1,157 @@
+'''Pipes, FIFOs and TTYs as hub-driven streams.
+
+    with open_fd(os.dup(sys.stdin.fileno())) as stdin:
+        line = until_eol()        # or stdin.readline()
+
+open_fd() makes the fd non-blocking and reads it through the same Buffer
+as a socket, so receive() and until() work on it inside the `with`, and
+no thread is needed.
+'''
+import fcntl
+import os
+import socket
+import stat
 import thread
+
+from diesel import core, fork, fork_from_thread
+from diesel.buffer import BufAny
 from diesel.util.queue import Queue
-from diesel import fork_from_thread
+
+class _FD(object):
+    '''A non-blocking fd, looking enough like a socket for a Connection.
+
+    O_NONBLOCK belongs to the open file, which other fds and processes
+    may share (a terminal's stdin and stdout usually do), so the old
+    flags are put back on close.
+    '''
+    def __init__(self, fd):
+        self.fd = fd
+        self.flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, self.flags | os.O_NONBLOCK)
+        flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+        fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+    def fileno(self):
+        return self.fd
+
+    def recv(self, n):
+        try:
+            return os.read(self.fd, n)
+        except OSError, e:
+            raise socket.error(e.errno, e.strerror)
+
+    def send(self, data):
+        try:
+            return os.write(self.fd, data)
+        except OSError, e:
+            raise socket.error(e.errno, e.strerror)
+
+    def close(self):
+        if self.fd is not None:
+            try:
+                fcntl.fcntl(self.fd, fcntl.F_SETFL, self.flags)
+            finally:
+                os.close(self.fd)
+                self.fd = None
+
+class Stream(object):
+    '''A Connection over a pipe, FIFO or TTY fd, which it owns.
+
+    Reads return what's left once the other end closes: read() and
+    readline() come back short, then ''.  Inside `with stream:` the
+    module-level receive(), until() and send() use it too, and it's
+    closed when the block ends.
+    '''
+    def __init__(self, fd, name=None):
+        self.conn = core.Connection(_FD(fd), name or 'fd %s' % fd)
+
+    def __enter__(self):
+        core.current_loop.connection_stack.append(self.conn)
+        return self
+
+    def __exit__(self, *args):
+        core.current_loop.connection_stack.pop()
+        self.close()
+
+    def _read(self, sentinel):
+        conn = self.conn
+        if not conn.closed:
+            loop = core.current_loop
+            loop.connection_stack.append(conn)
+            try:
+                return loop.input_op(sentinel)
+            except core.ConnectionClosed, e:
+                conn.buffer.clear_term()
+                if e.buffer:
+                    conn.buffer.feed(e.buffer)
+            finally:
+                loop.connection_stack.pop()
+        conn.buffer.set_term(sentinel)
+        return conn.buffer.check() or conn.buffer.pop()
+
+    def read(self, n=None):
+        '''Read `n` bytes, or everything until the other end closes.
+        '''
+        if n is not None:
+            return self._read(n)
+        chunks = []
+        while True:
+            data = self._read(BufAny)
+            if not data:
+                return ''.join(chunks)
+            chunks.append(data)
+
+    def read_any(self):
+        '''Whatever has arrived, waiting for something if need be.'''
+        return self._read(BufAny)
+
+    def readline(self):
+        return self._read('\n')
+
+    def until(self, sentinel):
+        return self._read(sentinel)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def write(self, data):
+        '''Queue `data`; the hub writes it as the fd drains.
+        '''
+        if self.conn.closed:
+            raise core.ConnectionClosed("%s is closed" % self.conn.addr)
+        self.conn.queue_outgoing(data)
+        self.conn.set_writable(True)
+
+    def close(self):
+        '''Close once queued writes are done.'''
+        conn = self.conn
+        if conn.closed:
+            return
+        if conn.pipeline.empty:
+            # Right away: the read end of a pipe never polls writable, so
+            # a deferred close would never happen.
+            conn.shutdown()
+        else:
+            conn.close()
+
+    @property
+    def closed(self):
+        return self.conn.closed
+
+def open_fd(fd, name=None):
+    '''Wrap a pipe, FIFO, TTY or socket fd in a Stream, which takes it
+    over; pass os.dup(fd) to keep using the original.
+
+    Regular files are always "ready" as far as the hub is concerned, so
+    they're refused with a ValueError.
+    '''
+    if stat.S_ISREG(os.fstat(fd).st_mode):
+        raise ValueError("fd %s is a regular file; the hub can't wait on it" % fd)
+    return Stream(fd, name)
 
 def put_stream_token(q, line):
     q.put(line)
@@ -12,7 +163,21 @@ def consume_stream(stream, q):
         if line == '':
             break
 
+def _feed_lines(stream, q):
+    for line in stream:
+        q.put(line)
+    q.put('')
+    stream.close()
+
 def create_line_input_stream(fileobj):
+    '''A Queue fed each line of `fileobj`, then '' at the end.
+
+    Pipes, FIFOs and TTYs are read by a loop; regular files, which the hub
+    can't wait on, by a thread.
+    '''
     q = Queue()
-    thread.start_new_thread(consume_stream, (fileobj, q))
+    if stat.S_ISREG(os.fstat(fileobj.fileno()).st_mode):
+        thread.start_new_thread(consume_stream, (fileobj, q))
+    else:
+        fork(_feed_lines, open_fd(os.dup(fileobj.fileno())), q)
     return q
@@ -0,0 +1,235 @@
+'''Child processes whose pipes and exit are handled by the hub.
+
+    p = Popen(['sort'], stdin=PIPE, stdout=PIPE)
+    p.stdin.write(data)
+    p.stdin.close()
+    for line in p.stdout:
+        ...
+    p.wait(timeout=5)
+
+The pipes are diesel.util.streams Streams, read through the same Buffer
+as sockets, so nothing here ties up an OS thread.  Exits are noticed
+through a pidfd where the kernel has them (Linux 5.3+), else through
+SIGCHLD; either way only this module's own children are reaped.
+'''
+from __future__ import absolute_import
+
+import ctypes
+import errno
+import os
+import signal
+import subprocess as _subprocess
+import time
+
+from diesel import first, fork, runtime
+from diesel.events import Waiter
+from diesel.util.event import Countdown, EventTimeout
+from diesel.util.streams import Stream
+
+PIPE = _subprocess.PIPE
+STDOUT = _subprocess.STDOUT
+CalledProcessError = _subprocess.CalledProcessError
+
+class SubprocessTimeout(Exception): pass
+
+class _Exit(Waiter):
+    pass
+
+class Popen(object):
+    '''Starts `args` like subprocess.Popen, which gets any other keyword
+    arguments.  Pipes asked for with PIPE become Streams (see
+    diesel.util.streams).
+    '''
+    def __init__(self, args, stdin=None, stdout=None, stderr=None, **kw):
+        self._proc = _subprocess.Popen(args, stdin=stdin, stdout=stdout,
+                stderr=stderr, **kw)
+        self.pid = self._proc.pid
+        self.returncode = None
+        self.gone = False
+        self.exited = _Exit()
+        self.stdin = self.stdout = self.stderr = None
+        self._output = None
+        for name in ('stdin', 'stdout', 'stderr'):
+            f = getattr(self._proc, name)
+            if f is not None:
+                # Take the fd over from the file object, which would close
+                # it when collected.
+                fd = os.dup(f.fileno())
+                f.close()
+                setattr(self, name, Stream(fd, 'pid %s %s' % (self.pid, name)))
+        _watch(self)
+
+    def _reaped(self, status):
+        '''Exited with `status`, or None if something else reaped it and
+        the status is lost.
+        '''
+        self.gone = True
+        if status is not None:
+            self._proc._handle_exitstatus(status)
+            self.returncode = self._proc.returncode
+        runtime.current_app.waits.fire(self.exited, self.returncode)
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        '''Returns the exit code once the child exits.  Raises
+        SubprocessTimeout after `timeout` seconds, or OSError(ECHILD) if
+        the child was reaped by someone else and its status is unknown.
+        '''
+        if not self.gone:
+            kw = dict(waits=[self.exited])
+            if timeout is not None:
+                kw['sleep'] = timeout
+            mark, val = first(**kw)
+            if mark is not self.exited:
+                raise SubprocessTimeout()
+        if self.returncode is None:
+            raise OSError(errno.ECHILD,
+                    "pid %s was reaped elsewhere; exit status unknown" % self.pid)
+        return self.returncode
+
+    def communicate(self, input=None, timeout=None):
+        '''Write `input`, close stdin, and read stdout and stderr until
+        the child exits.  Returns (stdout data, stderr data).
+
+        Raises SubprocessTimeout if that takes more than `timeout`
+        seconds, however long the pipes stay open; the reads carry on,
+        and calling communicate() again picks up where this one left off.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        if self._output is None:
+            if self.stdin:
+                if input:
+                    self.stdin.write(input)
+                self.stdin.close()
+            self._output = {}
+            pipes = [n for n in ('stdout', 'stderr') if getattr(self, n)]
+            self._output_done = Countdown(len(pipes))
+            if not pipes:
+                self._output_done.set()
+            for name in pipes:
+                fork(self._read_pipe, name)
+        try:
+            self._output_done.wait(timeout=self._remaining(deadline))
+        except EventTimeout:
+            raise SubprocessTimeout()
+        self.wait(self._remaining(deadline))
+        return self._output.get('stdout'), self._output.get('stderr')
+
+    def _read_pipe(self, name):
+        try:
+            self._output[name] = getattr(self, name).read()
+        finally:
+            self._output_done.tick()
+
+    def _remaining(self, deadline):
+        if deadline is None:
+            return None
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise SubprocessTimeout()
+        return remaining
+
+    def send_signal(self, sig):
+        # Once reaped, the pid may belong to someone else.
+        if not self.gone:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+def check_output(args, **kw):
+    '''Like subprocess.check_output.'''
+    p = Popen(args, stdout=PIPE, **kw)
+    out, err = p.communicate()
+    if p.returncode:
+        raise CalledProcessError(p.returncode, args, out)
+    return out
+
+# --- reaping ---
+
+_NR_pidfd_open = 434 # the same on every architecture
+_libc = None
+_have_pidfd = None
+
+def _pidfd_open(pid):
+    global _libc, _have_pidfd
+    if _have_pidfd is False:
+        return None
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    fd = _libc.syscall(_NR_pidfd_open, pid, 0)
+    if fd < 0:
+        if ctypes.get_errno() in (errno.ENOSYS, errno.EPERM):
+            _have_pidfd = False
+        return None
+    _have_pidfd = True
+    return fd
+
+class _PidFD(object):
+    def __init__(self, fd, proc):
+        self.fd = fd
+        self.proc = proc
+
+    def fileno(self):
+        return self.fd
+
+    def exited(self):
+        pid, status = _waitpid(self.proc.pid)
+        if not pid:
+            return
+        hub = runtime.current_app.hub
+        hub.unregister(self)
+        os.close(self.fd)
+        self.proc._reaped(status)
+
+# pid -> Popen, for children watched through SIGCHLD.
+_sigchld_watched = {}
+_sigchld_armed = False
+
+def _watch(proc):
+    fd = _pidfd_open(proc.pid)
+    if fd is not None:
+        w = _PidFD(fd, proc)
+        runtime.current_app.hub.register(w, w.exited, None, w.exited)
+        return
+    _sigchld_watched[proc.pid] = proc
+    _arm_sigchld()
+    # It may have exited before the handler was in place.
+    _sweep()
+
+def _arm_sigchld():
+    global _sigchld_armed
+    if not _sigchld_armed and _sigchld_watched:
+        _sigchld_armed = True
+        runtime.current_app.hub.add_signal_handler(signal.SIGCHLD, _on_sigchld)
+
+def _on_sigchld():
+    global _sigchld_armed
+    # The hub's handlers are one-shot: re-arm before sweeping, so an exit
+    # during the sweep isn't missed.
+    _sigchld_armed = False
+    _arm_sigchld()
+    _sweep()
+
+def _waitpid(pid):
+    '''waitpid(pid, WNOHANG), except that a child something else has
+    already reaped gives (pid, None).
+    '''
+    try:
+        return os.waitpid(pid, os.WNOHANG)
+    except OSError, e:
+        if e.errno != errno.ECHILD:
+            raise
+        return pid, None
+
+def _sweep():
+    for pid, proc in _sigchld_watched.items():
+        done, status = _waitpid(pid)
+        if done:
+            del _sigchld_watched[pid]
+            proc._reaped(status)
@@ -1,3 +1,16 @@
+"""Queue throughput and fairness across consumers.
+
+    $ python examples/queue_fairness_and_speed.py [mode]
+
+`mode` picks how workers consume:
+
+    wait    -- diesel.wait(q), one item per hub round trip (default)
+    get     -- q.get(), which yields to the hub after every item
+    get:N   -- q.get(yield_every=N), yielding every N items
+    drain   -- for item in q.drain(), no yielding while items remain
+
+"""
+import sys
 import time
 import uuid
 
@@ -12,10 +25,22 @@ shutdown = uuid.uuid4().hex
 q = Queue()
 dones = Queue()
 
-def worker():
+def items(mode):
+    if mode == 'wait':
+        while True:
+            yield diesel.wait(q)
+    elif mode == 'drain':
+        while True:
+            for val in q.drain():
+                yield val
+    else:
+        every = int(mode.split(':')[1]) if ':' in mode else 1
+        while True:
+            yield q.get(yield_every=every)
+
+def worker(mode):
     num_processed = 0
-    while True:
-        val = diesel.wait(q)
+    for val in items(mode):
         if val == shutdown:
             break
         num_processed += 1
@@ -24,6 +49,7 @@ def worker():
     dones.put('done')
 
 def main():
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'wait'
     start = time.time()
 
     for i in xrange(NUM_ITEMS):
@@ -32,7 +58,7 @@ def main():
         q.put(shutdown)
 
     for i in xrange(NUM_WORKERS):
-        diesel.fork_child(worker)
+        diesel.fork_child(worker, mode)
     for i in xrange(NUM_WORKERS):
         dones.get()
 
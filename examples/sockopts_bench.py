@@ -0,0 +1,69 @@
+"""A request latency benchmark for diesel's socket profiles.
+
+Try something like:
+
+    $ python examples/sockopts_bench.py
+    $ python examples/sockopts_bench.py latency 5000
+
+Each profile gets its own service, which answers each request with a
+header and a body written in two separate hub iterations, the pattern that
+Nagle's algorithm plus delayed ACKs punish.  The script prints latency
+percentiles for the given profile and for no profile at all (or for every
+stock profile, by default).
+
+"""
+import sys
+import time
+
+import diesel
+from diesel import Client, Service, call, send, until_eol, receive, sleep
+from diesel import ConnectionClosed
+from diesel.sockopts import PROFILES
+
+PORT = 4712
+REQUESTS = 2000
+
+def server(addr):
+    try:
+        while True:
+            size = int(until_eol())
+            send('%d\r\n' % size)
+            sleep()
+            send('x' * size)
+    except ConnectionClosed:
+        pass
+
+class BenchClient(Client):
+    @call
+    def ask(self, size):
+        send('%d\r\n' % size)
+        size = int(until_eol())
+        return receive(size)
+
+def run(port, profile, n):
+    c = BenchClient('localhost', port, sockopts=profile)
+    timings = []
+    for i in xrange(n):
+        start = time.time()
+        c.ask(64)
+        timings.append(time.time() - start)
+    c.close()
+    timings.sort()
+    def pct(p):
+        return timings[min(len(timings) - 1, int(len(timings) * p))] * 1000
+    print "%-12s n=%d  avg=%.3fms  p50=%.3fms  p99=%.3fms  max=%.3fms" % (
+        profile or 'none', n, sum(timings) / len(timings) * 1000,
+        pct(0.50), pct(0.99), timings[-1] * 1000)
+
+def main(names, n):
+    for i, name in enumerate(names):
+        run(PORT + i, name, n)
+    diesel.quickstop()
+
+if __name__ == '__main__':
+    diesel.set_log_level(diesel.loglevels.ERROR)
+    names = [None] + (sys.argv[1:2] or sorted(PROFILES))
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else REQUESTS
+    services = [Service(server, PORT + i, sockopts=name)
+                for i, name in enumerate(names)]
+    diesel.quickstart(services, lambda: main(names, n))
@@ -1,12 +1,17 @@
+import os
 import sys
 
-from diesel import quickstart
-from diesel.util.streams import create_line_input_stream
+from diesel import quickstart, quickstop, until, ConnectionClosed
+from diesel.util.streams import open_fd
 
 def consume():
-    q = create_line_input_stream(sys.stdin)
-    while True:
-        v = q.get()
-        print 'DIESEL GOT', v
+    with open_fd(os.dup(sys.stdin.fileno()), 'stdin'):
+        while True:
+            try:
+                v = until('\n')
+            except ConnectionClosed:
+                break
+            print 'DIESEL GOT', v
+    quickstop()
 
 quickstart(consume)
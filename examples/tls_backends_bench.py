@@ -0,0 +1,104 @@
+"""Compare the pyOpenSSL and stdlib TLS backends.
+
+Try something like:
+
+    $ python examples/tls_backends_bench.py
+    $ python examples/tls_backends_bench.py 256 500
+
+Arguments are the number of megabytes to transfer (default 1024, a 1GB
+transfer) and the number of handshakes to time.  For each backend the
+script starts a Service with a context from that backend, streams the
+bulk transfer from server to client over one connection, then opens and
+closes connections as fast as a few loops can, printing MB/s and
+handshakes/s.
+
+"""
+import os
+import sys
+import time
+
+import diesel
+from diesel import (Client, Service, call, send, receive, until_eol,
+                    ConnectionClosed)
+from diesel.security import server_context, client_context
+from diesel.util.event import Countdown
+
+PORT = 4714
+HERE = os.path.dirname(os.path.abspath(__file__))
+CHUNK = 64 * 1024
+CONCURRENCY = 10
+
+def handler(addr):
+    block = 'x' * CHUNK
+    try:
+        while True:
+            cmd = until_eol().split()
+            if cmd[0] == 'bulk':
+                for i in xrange(int(cmd[1])):
+                    send(block)
+            else:
+                send('ok\r\n')
+    except ConnectionClosed:
+        pass
+
+class BenchClient(Client):
+    @call
+    def bulk(self, chunks):
+        send('bulk %d\r\n' % chunks)
+        left = chunks * CHUNK
+        while left:
+            left -= len(receive(min(left, CHUNK)))
+
+    @call
+    def ping(self):
+        send('ping\r\n')
+        return until_eol()
+
+def throughput(backend, port, mb):
+    chunks = mb * 1024 * 1024 // CHUNK
+    with BenchClient('localhost', port,
+            ssl_ctx=client_context(backend=backend)) as c:
+        start = time.time()
+        c.bulk(chunks)
+        elapsed = time.time() - start
+    print "%-10s %dMB in %.2fs (%.1f MB/s)" % (
+        backend, mb, elapsed, mb / elapsed)
+
+def handshakes(backend, port, n):
+    ctx = client_context(backend=backend)
+    done = Countdown(CONCURRENCY)
+    per_loop = n // CONCURRENCY
+    def worker():
+        for i in xrange(per_loop):
+            with BenchClient('localhost', port, ssl_ctx=ctx) as c:
+                c.ping()
+        done.tick()
+    start = time.time()
+    for i in xrange(CONCURRENCY):
+        diesel.fork(worker)
+    done.wait()
+    elapsed = time.time() - start
+    total = per_loop * CONCURRENCY
+    print "%-10s %d handshakes in %.2fs (%.0f/s)" % (
+        backend, total, elapsed, total / elapsed)
+
+BACKENDS = ['pyopenssl', 'stdlib']
+
+def main():
+    mb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    for i, backend in enumerate(BACKENDS):
+        throughput(backend, PORT + i, mb)
+    for i, backend in enumerate(BACKENDS):
+        handshakes(backend, PORT + i, n)
+    diesel.quickstop()
+
+if __name__ == '__main__':
+    diesel.set_log_level(diesel.loglevels.ERROR)
+    services = []
+    for i, backend in enumerate(BACKENDS):
+        ctx = server_context(os.path.join(HERE, 'snakeoil-cert.pem'),
+                             os.path.join(HERE, 'snakeoil-key.pem'),
+                             backend=backend)
+        services.append(Service(handler, PORT + i, ssl_ctx=ctx))
+    diesel.quickstart(*(services + [main]))
@@ -0,0 +1,75 @@
+"""A TLS handshake-rate benchmark, with and without session resumption.
+
+Try something like:
+
+    $ python examples/tls_handshake_bench.py
+    $ python examples/tls_handshake_bench.py 2000 20
+
+Arguments are the number of connections and how many loops make them
+concurrently.  Each connection does one tiny request and closes.  The
+script runs three rounds: fresh client contexts (what HttpsClient used to
+do), a shared context without a session cache, and a shared context with
+a SessionCache, printing connections per second for each.
+
+"""
+import os
+import sys
+import time
+
+import diesel
+from diesel import Client, Service, call, send, until_eol, ConnectionClosed
+from diesel.security import (server_context, client_context, SessionCache,
+                             SESSION_TIMEOUT)
+from diesel.util.event import Countdown
+from OpenSSL import SSL
+
+PORT = 4713
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def handler(addr):
+    try:
+        while True:
+            send(until_eol())
+    except ConnectionClosed:
+        pass
+
+class PingClient(Client):
+    @call
+    def ping(self):
+        send('ping\r\n')
+        return until_eol()
+
+def run(label, n, concurrency, make_kw):
+    done = Countdown(concurrency)
+    per_loop = n // concurrency
+    def worker():
+        for i in xrange(per_loop):
+            with PingClient('localhost', PORT, **make_kw()) as c:
+                c.ping()
+        done.tick()
+    start = time.time()
+    for i in xrange(concurrency):
+        diesel.fork(worker)
+    done.wait()
+    elapsed = time.time() - start
+    print "%-22s %d handshakes in %.2fs (%.0f/s)" % (
+        label, per_loop * concurrency, elapsed, per_loop * concurrency / elapsed)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    shared = client_context()
+    sessions = SessionCache()
+    run('fresh context', n, concurrency,
+        lambda: dict(ssl_ctx=SSL.Context(SSL.SSLv23_METHOD)))
+    run('shared context', n, concurrency,
+        lambda: dict(ssl_ctx=shared))
+    run('shared + resumption', n, concurrency,
+        lambda: dict(ssl_ctx=shared, ssl_session_cache=sessions))
+    diesel.quickstop()
+
+if __name__ == '__main__':
+    diesel.set_log_level(diesel.loglevels.ERROR)
+    ctx = server_context(os.path.join(HERE, 'snakeoil-cert.pem'),
+                         os.path.join(HERE, 'snakeoil-key.pem'))
+    diesel.quickstart(Service(handler, PORT, ssl_ctx=ctx), main)
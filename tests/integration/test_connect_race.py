@@ -0,0 +1,70 @@
+import socket
+import time
+
+from diesel import Client, ClientConnectionError
+from diesel import client as client_module
+
+
+class MultiHomedClient(Client):
+    '''Resolves every name to `ips`.'''
+    ips = []
+
+    def _resolve_all(self, addr):
+        return list(self.ips)
+
+class TestConnectRace(object):
+    def setup(self):
+        # Only on 127.0.0.1, so other loopback addresses refuse the port.
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        client_module._failed.clear()
+
+    def teardown(self):
+        self.listener.close()
+        client_module._failed.clear()
+
+    def connect(self, ips, timeout=5):
+        MultiHomedClient.ips = ips
+        return MultiHomedClient('multi.test', self.port, timeout=timeout)
+
+    def test_refused_address_is_skipped(self):
+        start = time.time()
+        c = self.connect(['127.0.0.2', '127.0.0.1'])
+        try:
+            assert c.conn.addr == '127.0.0.1'
+            assert time.time() - start < 1.0
+        finally:
+            c.close()
+
+    def test_blackholed_address_is_raced(self):
+        # TEST-NET-1 never answers (or fails fast where there's no route).
+        start = time.time()
+        c = self.connect(['192.0.2.1', '127.0.0.1'])
+        try:
+            assert time.time() - start < 1.0
+        finally:
+            c.close()
+
+    def test_failed_addresses_go_last(self):
+        try:
+            self.connect(['127.0.0.2', '127.0.0.3'])
+        except ClientConnectionError:
+            pass
+        assert ('127.0.0.2', self.port) in client_module._failed
+        assert client_module._order(['127.0.0.2', '127.0.0.1'], self.port) == \
+                ['127.0.0.1', '127.0.0.2']
+
+    def test_all_addresses_fail(self):
+        try:
+            self.connect(['127.0.0.2', '127.0.0.3'])
+        except ClientConnectionError:
+            pass
+        else:
+            assert 0, "expected a ClientConnectionError"
+        assert len(client_module._failed) == 2
+
+    def test_families_alternate(self):
+        order = client_module._order(['::1', '::2', '10.0.0.1', '10.0.0.2'], 1)
+        assert [':' in ip for ip in order] == [True, False, True, False]
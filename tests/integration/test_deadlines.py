@@ -0,0 +1,79 @@
+import time
+
+import diesel
+from diesel import (Client, Service, call, send, until_eol, sleep, runtime,
+                    ConnectionTimeout, ClientConnectionClosed)
+from diesel.util.event import Event
+
+
+class LineClient(Client):
+    @call
+    def ask(self, line):
+        send(line + '\r\n')
+        return until_eol()
+
+    @call
+    def tell(self, line):
+        send(line + '\r\n')
+
+class DeadlineHarness(object):
+    service_kw = {}
+
+    def setup(self):
+        self.errors = []
+        self.done = Event()
+        self.service = Service(self.handler, 0, **self.service_kw)
+        runtime.current_app.add_service(self.service)
+
+    def teardown(self):
+        runtime.current_app.hub.unregister(self.service.sock)
+        self.service.sock.close()
+
+    def handler(self, addr):
+        try:
+            while True:
+                line = until_eol()
+                if line.startswith('echo'):
+                    send(line)
+        except ConnectionTimeout, e:
+            self.errors.append(e)
+        finally:
+            self.done.set()
+
+class TestServiceIdleTimeout(DeadlineHarness):
+    service_kw = dict(idle_timeout=0.2)
+
+    def test_idle_connection_is_reclaimed(self):
+        c = LineClient('localhost', self.service.port)
+        start = time.time()
+        self.done.wait(2)
+        assert 0.15 < time.time() - start < 0.6, time.time() - start
+        assert len(self.errors) == 1
+
+    def test_activity_keeps_the_connection_open(self):
+        c = LineClient('localhost', self.service.port)
+        for i in xrange(6):
+            sleep(0.1)
+            c.tell('noop')
+        assert not self.done.is_set
+        assert c.ask('echo') == 'echo\r\n'
+
+class TestClientReadTimeout(DeadlineHarness):
+    def test_silent_server_raises_in_client(self):
+        c = LineClient('localhost', self.service.port, read_timeout=0.2)
+        start = time.time()
+        try:
+            c.ask('no reply')
+        except ClientConnectionClosed, e:
+            assert 'read timeout' in str(e), str(e)
+        else:
+            assert 0, "expected a read timeout"
+        assert 0.15 < time.time() - start < 0.6, time.time() - start
+        assert c.is_closed
+
+    def test_answered_reads_are_not_timed_out(self):
+        c = LineClient('localhost', self.service.port, read_timeout=0.2)
+        for i in xrange(3):
+            assert c.ask('echo') == 'echo\r\n'
+            sleep(0.15)
+        assert not c.is_closed
@@ -0,0 +1,100 @@
+import diesel
+
+from diesel.util.queue import Dispatcher, Queue, pending
+from diesel.util.event import Event
+
+
+class WorkerHarness(object):
+    policy = None
+
+    def setup(self):
+        self.d = Dispatcher(self.policy)
+        self.stop = Event()
+        self.got = {}
+
+    def teardown(self):
+        self.stop.set()
+        diesel.sleep()
+
+    def start(self, name, slow=False):
+        self.got[name] = got = []
+        def worker():
+            with self.d.accept() as q:
+                while True:
+                    ev, v = diesel.first(waits=[q, self.stop])
+                    if ev is self.stop:
+                        break
+                    got.append(v)
+                    if slow:
+                        diesel.sleep(0.05)
+        diesel.fork(worker)
+        diesel.sleep()
+
+class TestRoundRobin(WorkerHarness):
+    policy = 'round_robin'
+
+    def test_workers_take_turns(self):
+        for name in 'abc':
+            self.start(name)
+        for i in xrange(9):
+            self.d.dispatch(i)
+        diesel.sleep(0.1)
+        assert sorted(len(v) for v in self.got.values()) == [3, 3, 3], self.got
+
+class TestLeastPending(WorkerHarness):
+    policy = 'least_pending'
+
+    def test_slow_worker_gets_less(self):
+        self.start('slow', slow=True)
+        self.start('fast')
+        for i in xrange(20):
+            self.d.dispatch(i)
+            diesel.sleep()
+        diesel.sleep(0.1)
+        assert len(self.got['fast']) > 3 * len(self.got['slow']), self.got
+
+class TestPowerOfTwo(WorkerHarness):
+    policy = 'power_of_two'
+
+    def test_everything_is_delivered(self):
+        for name in 'abcd':
+            self.start(name)
+        for i in xrange(40):
+            self.d.dispatch(i)
+        diesel.sleep(0.1)
+        assert sorted(sum(self.got.values(), [])) == range(40)
+
+class TestRedistribution(object):
+    def test_leftovers_are_spread_over_remaining_workers(self):
+        d = Dispatcher('round_robin')
+        with d.accept() as a:
+            with d.accept() as b:
+                with d.accept() as c:
+                    for i in xrange(9):
+                        d.dispatch(i)
+                assert a.qsize() + b.qsize() == 9
+                assert abs(a.qsize() - b.qsize()) <= 1
+
+    def test_backlog_is_kept_until_a_worker_arrives(self):
+        d = Dispatcher()
+        with d.accept() as a:
+            d.dispatch(1)
+            d.dispatch(2)
+        assert d.backlog == [1, 2]
+        with d.accept() as b:
+            assert b.qsize() == 2
+            assert not d.backlog
+
+class TestPolicies(object):
+    def test_unknown_policy(self):
+        try:
+            Dispatcher('bogus')
+        except ValueError:
+            pass
+        else:
+            assert 0, "expected a ValueError"
+
+    def test_pending_counts_a_busy_worker(self):
+        q = Queue()
+        q.put(1)
+        assert pending(q) == 2
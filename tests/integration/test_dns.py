@@ -0,0 +1,157 @@
+import socket
+import threading
+import time
+
+import diesel
+
+from dns import rcode
+from dns.message import from_wire, make_response
+from dns.rdatatype import A, AAAA
+from dns.rrset import from_text
+
+from diesel.protocols.DNS import MultiplexedDNSClient, NotFound, Timeout
+
+
+class FakeNameserver(object):
+    '''Answers from `records`, {(name, rdtype): (addresses, delay)}, on a
+    thread; anything else is NXDOMAIN.
+    '''
+    def __init__(self, records, host='127.0.0.1', port=0):
+        self.records = records
+        self.queries = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.port = self.sock.getsockname()[1]
+        t = threading.Thread(target=self.serve)
+        t.daemon = True
+        t.start()
+
+    def serve(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except socket.error:
+                return
+            query = from_wire(data)
+            q = query.question[0]
+            name = str(q.name)[:-1]
+            self.queries.append((name, q.rdtype))
+            response = make_response(query)
+            answer = self.records.get((name, q.rdtype))
+            if answer is None:
+                response.set_rcode(rcode.NXDOMAIN)
+                delay = 0
+            else:
+                addresses, delay = answer
+                response.answer.append(from_text(q.name, 60, 'IN', q.rdtype, *addresses))
+            threading.Timer(delay, self.sock.sendto, (response.to_wire(), addr)).start()
+
+    def close(self):
+        self.sock.close()
+
+class TestMultiplexedDNSClient(object):
+    def setup(self):
+        self.server = FakeNameserver({
+            ('a.test', A): (['10.0.0.1'], 0),
+            ('a.test', AAAA): (['fd00::1'], 0),
+            ('www.one', A): (['10.0.1.1'], 0.2),
+            ('www.two', A): (['10.0.2.1'], 0),
+        })
+        for i in xrange(50):
+            self.server.records[('n%d.test' % i, A)] = (['10.1.0.%d' % i], 0.2)
+        self.client = MultiplexedDNSClient(['127.0.0.1'], self.server.port, search=[])
+
+    def teardown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_query(self):
+        assert self.client.query('a.test') == (['10.0.0.1'], 60)
+        assert self.client.resolve('a.test', rdtype=AAAA) == ['fd00::1']
+
+    def test_not_found(self):
+        try:
+            self.client.query('nope.test')
+        except NotFound:
+            pass
+        else:
+            assert 0, "expected NotFound"
+
+    def test_queries_are_outstanding_together(self):
+        names = ['n%d.test' % i for i in xrange(50)]
+        start = time.time()
+        results = self.client.query_many(names)
+        assert time.time() - start < 1.0
+        assert len(self.client.socks) == 1
+        for i, name in enumerate(names):
+            assert results[name] == (['10.1.0.%d' % i], 60)
+        assert not self.client.pending
+
+    def test_loops_share_the_socket(self):
+        results = []
+        def lookup(i):
+            results.append(self.client.resolve('n%d.test' % i))
+        for i in xrange(10):
+            diesel.fork(lookup, i)
+        diesel.sleep(0.5)
+        assert len(results) == 10
+        assert len(self.client.socks) == 1
+
+    def test_sockets_of_an_old_hub_are_closed(self):
+        self.client.query('a.test')
+        old = self.client.socks.values()
+        real = self.client.hub
+        class OldHub(object):
+            unregistered = []
+            def unregister(self, sock):
+                self.unregistered.append(sock)
+                real.unregister(sock)
+        self.client.hub = OldHub()
+        assert self.client.query('a.test') == (['10.0.0.1'], 60)
+        assert OldHub.unregistered == old
+        assert self.client.hub is real
+        for sock in old:
+            try:
+                sock.fileno()
+            except socket.error:
+                pass
+            else:
+                assert 0, "the old socket is still open"
+
+    def test_search_order_kept_while_racing(self):
+        client = MultiplexedDNSClient(['127.0.0.1'], self.server.port,
+                search=['one', 'two'])
+        try:
+            start = time.time()
+            assert client.resolve('www') == ['10.0.1.1']
+            assert time.time() - start < 1.0
+            # All three were asked at once.
+            assert set(n for n, t in self.server.queries) == set(['www', 'www.one', 'www.two'])
+        finally:
+            client.close()
+
+    def test_servers_are_raced(self):
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.bind(('127.0.0.2', self.server.port))
+        client = MultiplexedDNSClient(['127.0.0.2', '127.0.0.1'],
+                self.server.port, search=[])
+        try:
+            start = time.time()
+            assert client.resolve('a.test', 4) == ['10.0.0.1']
+            assert time.time() - start < 1.0
+        finally:
+            client.close()
+            silent.close()
+
+    def test_timeout(self):
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.bind(('127.0.0.1', 0))
+        client = MultiplexedDNSClient(['127.0.0.1'], silent.getsockname()[1], search=[])
+        try:
+            results = client.query_many(['a.test', 'b.test'], timeout=0.2)
+            assert isinstance(results['a.test'], Timeout)
+            assert isinstance(results['b.test'], Timeout)
+            assert not client.pending
+        finally:
+            client.close()
+            silent.close()
@@ -2,7 +2,7 @@ import uuid
 
 import diesel
 
-from diesel.util.queue import Fanout
+from diesel.util.queue import Fanout, SubscriberLagged, QueueTimeout
 from diesel.util.event import Countdown
 
 class FanoutHarness(object):
@@ -33,3 +33,98 @@ class TestFanout(FanoutHarness):
     def test_sub_is_removed_after_it_is_done(self):
         assert not self.fan.subs
 
+
+class TestSlowSubscribers(object):
+    def test_grow_loses_nothing(self):
+        fan = Fanout(size=4)
+        with fan.sub() as slow:
+            with fan.sub() as fast:
+                for i in xrange(10):
+                    fan.pub(i)
+                    assert fast.get() == i
+                assert [slow.get() for i in xrange(10)] == range(10)
+                assert slow.dropped == 0
+                assert fan.size == 16
+
+    def test_drop_oldest_skips_ahead_and_counts_drops(self):
+        fan = Fanout(size=4, policy='drop_oldest')
+        with fan.sub() as q:
+            for i in xrange(10):
+                fan.pub(i)
+            assert q.lag == 10
+            assert fan.max_lag == 10
+            assert [q.get() for i in xrange(4)] == [6, 7, 8, 9]
+            assert q.dropped == 6
+            assert q.lag == 0
+
+    def test_disconnect_unsubscribes_the_laggard(self):
+        fan = Fanout(size=4, policy='disconnect')
+        with fan.sub() as slow:
+            with fan.sub() as fast:
+                for i in xrange(6):
+                    fan.pub(i)
+                    assert fast.get() == i
+                try:
+                    slow.get()
+                except SubscriberLagged:
+                    pass
+                else:
+                    assert 0, "expected SubscriberLagged"
+                assert fan.subs == set([fast])
+
+    def test_block_holds_the_publisher_until_readers_catch_up(self):
+        fan = Fanout(size=2, policy='block')
+        published = []
+        def publisher():
+            for i in xrange(5):
+                fan.pub(i)
+                published.append(i)
+        with fan.sub() as q:
+            diesel.fork(publisher)
+            diesel.sleep()
+            assert published == [0, 1]
+            got = [q.get(timeout=1) for i in xrange(5)]
+            assert got == range(5)
+        assert published == range(5)
+
+    def test_block_publisher_times_out(self):
+        fan = Fanout(size=1, policy='block')
+        with fan.sub() as q:
+            fan.pub(1)
+            try:
+                fan.pub(2, timeout=0.05)
+            except QueueTimeout:
+                pass
+            else:
+                assert 0, "expected a timeout"
+
+    def test_unknown_policy(self):
+        try:
+            Fanout(policy='bogus')
+        except ValueError:
+            pass
+        else:
+            assert 0, "expected a ValueError"
+
+class TestBatchedWakeups(object):
+    def test_burst_is_delivered_to_waiting_subscribers(self):
+        fan = Fanout()
+        got = []
+        done = Countdown(3)
+        def subscriber():
+            with fan.sub() as q:
+                mine = []
+                while len(mine) < 100:
+                    ev, v = diesel.first(waits=[q], sleep=1)
+                    assert ev is q, "timed out"
+                    mine.append(v)
+                got.append(mine)
+                done.tick()
+        for i in xrange(3):
+            diesel.fork(subscriber)
+        diesel.sleep()
+        assert len(fan.parked) == 3
+        for i in xrange(100):
+            fan.pub(i)
+        done.wait(1)
+        assert got == [range(100)] * 3
@@ -0,0 +1,100 @@
+import os
+import socket
+import tempfile
+
+import diesel
+
+from diesel import Service, runtime
+from diesel.util import fileio
+
+
+class FileHarness(object):
+    def setup(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.data = ''.join(chr(i % 251) for i in xrange(300000))
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def teardown(self):
+        os.unlink(self.path)
+
+class TestReadWrite(FileHarness):
+    def test_read_file(self):
+        assert fileio.read_file(self.path) == self.data
+        assert fileio.read_file(self.path, 10, 5) == self.data[10:15]
+
+    def test_write_file_from_chunks(self):
+        n = fileio.write_file(self.path, ('ab' for i in xrange(1000)))
+        assert n == 2000
+        assert open(self.path).read() == 'ab' * 1000
+
+    def test_append(self):
+        fileio.write_file(self.path, 'tail', append=True, sync=True)
+        assert open(self.path).read() == self.data + 'tail'
+
+    def test_missing_file(self):
+        try:
+            fileio.read_file(self.path + '.missing')
+        except OSError:
+            pass
+        else:
+            assert 0, "expected an OSError"
+
+class TestIterFile(FileHarness):
+    def test_chunks(self):
+        chunks = list(fileio.iter_file(self.path, chunk_size=65536))
+        assert [len(c) for c in chunks] == [65536] * 4 + [300000 - 4 * 65536]
+        assert ''.join(chunks) == self.data
+
+    def test_range_of_an_open_file(self):
+        with open(self.path) as f:
+            got = ''.join(fileio.iter_file(f, 1000, offset=5, length=2500))
+        assert got == self.data[5:2505]
+
+    def test_stopping_early(self):
+        for chunk in fileio.iter_file(self.path, 1000):
+            break
+        assert chunk == self.data[:1000]
+
+    def test_closing_early_does_not_wait_for_the_read_ahead(self):
+        before = len(os.listdir('/proc/self/fd'))
+        chunks = fileio.iter_file(self.path, 1000)
+        next(chunks)
+        saved = fileio.wait
+        def no_waiting(*args):
+            assert 0, "close() waited on the read-ahead"
+        fileio.wait = no_waiting
+        try:
+            chunks.close()
+        finally:
+            fileio.wait = saved
+        diesel.sleep(0.05)
+        assert len(os.listdir('/proc/self/fd')) == before
+
+class TestStreamToConnection(FileHarness):
+    def setup(self):
+        FileHarness.setup(self)
+        def handler(addr):
+            fileio.stream_to_connection(self.path, chunk_size=8192)
+        self.service = Service(handler, 0)
+        runtime.current_app.add_service(self.service)
+
+    def teardown(self):
+        runtime.current_app.hub.unregister(self.service.sock)
+        self.service.sock.close()
+        FileHarness.teardown(self)
+
+    def test_whole_file_arrives(self):
+        got = []
+        def client():
+            s = socket.socket()
+            s.connect(('localhost', self.service.port))
+            while True:
+                d = s.recv(65536)
+                if not d:
+                    break
+                got.append(d)
+            s.close()
+        diesel.thread(client)
+        assert ''.join(got) == self.data
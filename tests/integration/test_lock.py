@@ -0,0 +1,88 @@
+import diesel
+
+from diesel.util import lock as lockmod
+from diesel.util.lock import RWLock, synchronized
+from diesel.util.event import Countdown
+
+
+class TestSynchronized(object):
+    def test_keys_are_dropped_when_unused(self):
+        before = len(lockmod._sync_locks)
+        for i in xrange(100):
+            with synchronized(('user', i)):
+                pass
+        assert len(lockmod._sync_locks) == before
+
+    def test_same_key_is_exclusive(self):
+        order = []
+        done = Countdown(3)
+        def critical(i):
+            with synchronized('shared'):
+                order.append(('in', i))
+                diesel.sleep()
+                order.append(('out', i))
+            done.tick()
+        for i in xrange(3):
+            diesel.fork(critical, i)
+        done.wait(1)
+        assert order == [('in', 0), ('out', 0), ('in', 1), ('out', 1),
+                         ('in', 2), ('out', 2)], order
+        assert 'shared' not in lockmod._sync_locks
+
+    def test_lock_is_kept_while_someone_waits(self):
+        s = synchronized('busy')
+        s.acquire()
+        diesel.fork(lambda: synchronized('busy').acquire())
+        diesel.sleep()
+        assert lockmod._sync_locks['busy'].refs == 2
+        s.release()
+        diesel.sleep()
+        assert lockmod._sync_locks['busy'].refs == 1
+        assert s.is_locked
+        s.release()
+        assert 'busy' not in lockmod._sync_locks
+
+class TestRWLock(object):
+    def setup(self):
+        self.rw = RWLock()
+        self.log = []
+
+    def reader(self, name):
+        with self.rw.read():
+            self.log.append(('r+', name))
+            diesel.sleep(0.05)
+            self.log.append(('r-', name))
+
+    def writer(self, name):
+        with self.rw.write():
+            self.log.append(('w+', name))
+            diesel.sleep(0.05)
+            self.log.append(('w-', name))
+
+    def test_readers_share(self):
+        for i in xrange(3):
+            diesel.fork(self.reader, i)
+        diesel.sleep()
+        assert self.rw.readers == 3
+        assert [e for e, n in self.log] == ['r+'] * 3
+
+    def test_writer_waits_for_readers_and_blocks_new_ones(self):
+        diesel.fork(self.reader, 1)
+        diesel.sleep()
+        diesel.fork(self.writer, 'w')
+        diesel.sleep()
+        diesel.fork(self.reader, 2)
+        diesel.fork(self.reader, 3)
+        diesel.sleep()
+        assert self.rw.writers_waiting == 1
+        assert self.log == [('r+', 1)]
+        diesel.sleep(0.3)
+        assert self.log[:4] == [('r+', 1), ('r-', 1), ('w+', 'w'), ('w-', 'w')]
+        assert sorted(self.log[4:6]) == [('r+', 2), ('r+', 3)]
+        assert not self.rw.readers and not self.rw.writer
+
+    def test_writers_are_exclusive(self):
+        diesel.fork(self.writer, 1)
+        diesel.fork(self.writer, 2)
+        diesel.sleep(0.3)
+        assert self.log == [('w+', 1), ('w-', 1), ('w+', 2), ('w-', 2)]
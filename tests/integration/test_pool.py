@@ -0,0 +1,172 @@
+import time
+
+import diesel
+
+from diesel.util.pool import ConnectionPool, ConnectionPoolFull
+from diesel.util.ratelimit import TokenBucket
+
+
+class FakeConn(object):
+    def __init__(self, n):
+        self.n = n
+        self.is_closed = False
+
+    def close(self):
+        self.is_closed = True
+
+class PoolHarness(object):
+    def setup(self):
+        self.opened = []
+        self.closed = []
+
+    def make(self):
+        c = FakeConn(len(self.opened))
+        self.opened.append(c)
+        return c
+
+    def close(self, c):
+        self.closed.append(c)
+        c.close()
+
+    def pool(self, **kw):
+        self.p = ConnectionPool(self.make, self.close, **kw)
+        return self.p
+
+    def teardown(self):
+        self.p.close()
+
+class TestCheckoutOrder(PoolHarness):
+    def test_lifo_reuses_the_most_recent(self):
+        p = self.pool()
+        a, b = p.get(), p.get()
+        p.release(a)
+        p.release(b)
+        assert p.get() is b
+
+    def test_fifo_spreads_use(self):
+        p = self.pool(lifo=False)
+        a, b = p.get(), p.get()
+        p.release(a)
+        p.release(b)
+        assert p.get() is a
+
+class TestHealth(PoolHarness):
+    def test_warm_opens_min_idle(self):
+        p = self.pool(min_idle=3)
+        p.warm()
+        assert p.idle == 3
+        p.get()
+        assert p.stats.hits == 1 and p.stats.misses == 0
+
+    def test_idle_connections_are_evicted_down_to_min_idle(self):
+        p = self.pool(min_idle=1, idle_timeout=0.1)
+        conns = [p.get() for i in xrange(3)]
+        for c in conns:
+            p.release(c)
+        assert p.idle == 3
+        diesel.sleep(0.3)
+        assert p.idle == 1
+        assert p.stats.evicted_idle == 2
+
+    def test_max_lifetime(self):
+        p = self.pool(max_lifetime=0.1)
+        c = p.get()
+        p.release(c)
+        diesel.sleep(0.2)
+        assert c.is_closed
+        assert p.get() is not c
+        assert p.stats.evicted_lifetime == 1
+
+    def test_invalid_connections_are_skipped(self):
+        p = self.pool(validate=lambda c: c.n != 0)
+        a, b = p.get(), p.get()
+        p.release(b)
+        p.release(a)
+        assert p.get() is b
+        assert a.is_closed and p.stats.evicted_invalid == 1
+
+    def test_closed_connection_leaves_healthy_ones_alone(self):
+        p = self.pool()
+        a, b, c = p.get(), p.get(), p.get()
+        p.release(a)
+        p.release(c)
+        b.is_closed = True
+        p.release(b)
+        assert [e[1] for e in p.connections] == [a, c]
+        assert p.stats.evicted_closed == 1
+        assert p.stats.evicted_stale == 0
+
+    def test_closed_connection_checks_older_idle_ones(self):
+        dead = set()
+        p = self.pool(validate=lambda c: c not in dead)
+        a, b, c, d = p.get(), p.get(), p.get(), p.get()
+        for conn in (a, b, d):
+            p.release(conn)
+        # The backend restarted under b and c; a is fine.
+        dead.update([b, c])
+        c.is_closed = True
+        p.release(c)
+        diesel.sleep()
+        assert [e[1] for e in p.connections] == [a, d]
+        assert b.is_closed and not a.is_closed
+        assert p.stats.evicted_stale == 1
+
+    def test_validate_yielding_while_idle_set_changes(self):
+        def validate(c):
+            diesel.sleep(0.1)
+            return c.n != 1
+        p = self.pool(validate=validate)
+        a, b = p.get(), p.get()
+        p.release(a)
+        p.release(b)
+        got = []
+        # The first checkout is validating b (which fails) while eviction
+        # rewrites the idle set and a second checkout takes a.
+        diesel.fork(lambda: got.append(p.get()))
+        diesel.sleep(0.01)
+        p._evict(time.time())
+        got.append(p.get())
+        diesel.sleep(0.2)
+        assert len(got) == 2
+        assert got[0] is not got[1]
+        assert a in got and b not in got
+        assert p.idle == 0
+
+    def test_maintenance_restarts_after_dying(self):
+        p = self.pool(idle_timeout=10)
+        def broken(now):
+            raise ValueError("boom")
+        p._evict = broken
+        p.release(p.get())
+        diesel.sleep(0.01)
+        assert p._maintainer is None
+        del p._evict
+        p.release(p.get())
+        assert p._maintainer is not None
+
+    def test_rate_limit_token_taken_only_with_a_slot(self):
+        # Two tokens, and no more for a long while.
+        p = self.pool(pool_max=1, poll_max_timeout=0.05,
+                rate_limit=TokenBucket(0.001, 2))
+        a = p.get()
+        try:
+            p.get()
+        except ConnectionPoolFull:
+            pass
+        else:
+            assert 0, "expected ConnectionPoolFull"
+        p.release(a)
+        # The timed-out get() left the second token.
+        assert p.get() is a
+
+class TestStats(PoolHarness):
+    def test_checkout_time_and_hit_rate(self):
+        p = self.pool()
+        with p.connection:
+            diesel.sleep(0.1)
+        with p.connection:
+            pass
+        d = p.stats.as_dict()
+        assert d['hits'] == 1 and d['misses'] == 1
+        assert 0.05 < d['max_checkout_time'] < 0.5
+        assert d['releases'] == 2
@@ -0,0 +1,144 @@
+import os
+import time
+
+import diesel
+
+from diesel.util import shm
+from diesel.util.event import Countdown
+from diesel.util.process import ProcessPool, ProcessTimeout, WorkerDied
+
+
+def work(x):
+    if x == 'die':
+        os._exit(1)
+    if x == 'boom':
+        raise ValueError(x)
+    if isinstance(x, float):
+        time.sleep(x)
+    return x, os.getpid()
+
+class TestProcessPool(object):
+    def setup(self):
+        self.pool = ProcessPool(2, work)
+        self.pool.pool()
+
+    def teardown(self):
+        self.pool.close()
+
+    def test_many_calls_in_flight(self):
+        results = []
+        done = Countdown(50)
+        def caller(i):
+            results.append(self.pool(i)[0])
+            done.tick()
+        for i in xrange(50):
+            diesel.fork(caller, i)
+        done.wait(5)
+        assert sorted(results) == range(50)
+        assert not any(w.inflight for w in self.pool.all_procs)
+
+    def test_exceptions_are_returned(self):
+        e = self.pool('boom')
+        assert isinstance(e, ValueError)
+        assert 'ValueError' in e.original_traceback
+        out = self.pool.map([1, 'boom', 2])
+        assert out[0][0] == 1 and out[2][0] == 2
+        assert isinstance(out[1], ValueError)
+
+    def test_exceptions_are_raised_in_the_caller_when_asked(self):
+        pool = ProcessPool(1, work, raise_errors=True)
+        pool.pool()
+        try:
+            for call in (lambda: pool('boom'), lambda: pool.map(['boom'])):
+                try:
+                    call()
+                except ValueError, e:
+                    assert 'ValueError' in e.original_traceback
+                else:
+                    assert 0, "expected a ValueError"
+        finally:
+            pool.close()
+
+    def test_map_keeps_order_and_uses_every_worker(self):
+        out = self.pool.map(range(200), chunksize=16)
+        assert [x for x, pid in out] == range(200)
+        assert len(set(pid for x, pid in out)) == 2
+
+    def test_imap_unordered_streams(self):
+        got = sorted(x for x, pid in self.pool.imap_unordered(xrange(100), chunksize=7))
+        assert got == range(100)
+
+    def test_timeout(self):
+        try:
+            self.pool.apply((0.5,), timeout=0.1)
+        except ProcessTimeout:
+            pass
+        else:
+            assert 0, "expected a ProcessTimeout"
+
+    def test_dead_worker_is_replaced(self):
+        pids = set(w.proc.pid for w in self.pool.all_procs)
+        try:
+            self.pool('die')
+        except WorkerDied:
+            pass
+        else:
+            assert 0, "expected WorkerDied"
+        assert len(self.pool.all_procs) == 2
+        assert set(w.proc.pid for w in self.pool.all_procs) != pids
+        assert self.pool(1)[0] == 1
+
+def describe(x):
+    return type(x).__name__, str(x[:3]), 'x' * len(x)
+
+def upper(x):
+    return str(x).upper()
+
+def double(a):
+    return a * 2
+
+class TestSharedMemory(object):
+    def setup(self):
+        self.pool = ProcessPool(1, describe, shm_threshold=1024, shm_size=64 * 1024)
+        self.pool.pool()
+
+    def teardown(self):
+        self.pool.close()
+
+    def test_big_arguments_arrive_as_views(self):
+        kind, head, out = self.pool('abc' + 'd' * 2000)
+        assert kind == 'buffer' and head == 'abc'
+        assert type(out) is str and len(out) == 2003
+        assert self.pool('small')[0] == 'str'
+
+    def test_rings_are_released(self):
+        pool = ProcessPool(1, upper, shm_threshold=1024, shm_size=64 * 1024)
+        pool.pool()
+        try:
+            arena = pool.all_procs[0].arena
+            for i in xrange(100):
+                assert pool('y' * 10000) == 'Y' * 10000
+            assert arena.down.head > arena.down.size
+            # The worker writes results; the parent publishes how far it's read.
+            released, = shm._counter.unpack_from(arena.mm, arena.up.tail_at)
+            assert released > arena.up.size
+        finally:
+            pool.close()
+
+    def test_oversized_values_are_pickled(self):
+        kind, head, out = self.pool(bytearray('z' * 100000))
+        assert kind == 'buffer' and len(out) == 100000
+
+    def test_numpy_arrays(self):
+        try:
+            import numpy
+        except ImportError:
+            from nose.plugins.skip import SkipTest
+            raise SkipTest("numpy is not installed")
+        pool = ProcessPool(1, double, shm_threshold=1024)
+        pool.pool()
+        try:
+            a = numpy.arange(10000, dtype='float64').reshape(100, 100)
+            assert (pool(a) == a * 2).all()
+        finally:
+            pool.close()
@@ -1,11 +1,15 @@
 import random
+import time
+from operator import itemgetter
 
 from collections import defaultdict
 
 import diesel
 
-from diesel.util.queue import Queue, QueueTimeout
+from diesel.util.queue import (Queue, QueueTimeout, QueueFull, QueueEmpty,
+                               PriorityQueue, DelayQueue)
 from diesel.util.event import Countdown, Event
+from diesel.util.lock import Lock
 
 
 N = 500
@@ -96,3 +100,284 @@ class TestQueueTimeouts(object):
 
     def test_a_consumer_got_a_value(self):
         assert self.result.is_set
+
+class TestFifoWakeups(object):
+    def test_queue_consumers_are_served_in_arrival_order(self):
+        q = Queue()
+        got = []
+        def consumer(i):
+            got.append((i, q.get()))
+        for i in xrange(10):
+            diesel.fork(consumer, i)
+        diesel.sleep()
+        for i in xrange(10):
+            q.put(i)
+        diesel.sleep(0.05)
+        assert got == [(i, i) for i in xrange(10)], got
+
+    def test_lock_is_handed_over_in_arrival_order(self):
+        lock = Lock()
+        order = []
+        # Each contender lets the next one in only once it's about to
+        # block on the lock, so they queue up in order.
+        turns = [Event() for i in xrange(11)]
+        done = Countdown(10)
+        def contender(i):
+            turns[i].wait()
+            turns[i + 1].set()
+            with lock:
+                order.append(i)
+                diesel.sleep()
+            done.tick()
+        lock.acquire()
+        for i in xrange(10):
+            diesel.fork(contender, i)
+        turns[0].set()
+        turns[10].wait()
+        lock.release()
+        done.wait(1)
+        assert order == range(10), order
+
+class TestBoundedQueue(object):
+    def test_put_blocks_until_there_is_room(self):
+        q = Queue(maxsize=2)
+        q.put(1)
+        q.put(2)
+        assert q.full
+        done = Event()
+        def producer():
+            q.put(3)
+            done.set()
+        diesel.fork(producer)
+        diesel.sleep()
+        assert not done.is_set
+        assert q.get() == 1
+        done.wait(1)
+        assert q.qsize() == 2
+        assert q.get_many() == [2, 3]
+
+    def test_put_times_out(self):
+        q = Queue(maxsize=1)
+        q.put(1)
+        try:
+            q.put(2, timeout=0.05)
+        except QueueTimeout:
+            pass
+        else:
+            assert 0, "expected a timeout"
+        assert q.qsize() == 1
+
+    def test_non_waiting_put_on_full_queue(self):
+        q = Queue(maxsize=1)
+        q.put(1)
+        try:
+            q.put(2, waiting=False)
+        except QueueFull:
+            pass
+        else:
+            assert 0, "expected QueueFull"
+
+    def test_blocked_producers_go_in_arrival_order(self):
+        q = Queue(maxsize=1)
+        q.put('first')
+        for i in xrange(5):
+            diesel.fork(q.put, i)
+        diesel.sleep()
+        got = [q.get() for i in xrange(6)]
+        assert got == ['first', 0, 1, 2, 3, 4], got
+
+    def test_put_many_fills_a_bounded_queue_in_chunks(self):
+        q = Queue(maxsize=3)
+        got = []
+        def consumer():
+            while len(got) < 10:
+                got.extend(q.get_many())
+        diesel.fork(consumer)
+        q.put_many(range(10))
+        diesel.sleep(0.05)
+        assert got == range(10), got
+
+class TestBatches(object):
+    def test_get_many_respects_max_items(self):
+        q = Queue()
+        q.put_many(range(5))
+        assert q.get_many(3) == [0, 1, 2]
+        assert q.get_many(3) == [3, 4]
+
+    def test_get_many_waits_for_the_first_item(self):
+        q = Queue()
+        def producer():
+            diesel.sleep(0.01)
+            q.put_many(['a', 'b', 'c'])
+        diesel.fork(producer)
+        assert q.get_many() == ['a', 'b', 'c']
+
+    def test_get_many_on_an_empty_queue(self):
+        q = Queue()
+        try:
+            q.get_many(waiting=False)
+        except QueueEmpty:
+            pass
+        else:
+            assert 0, "expected QueueEmpty"
+        try:
+            q.get_many(timeout=0.01)
+        except QueueTimeout:
+            pass
+        else:
+            assert 0, "expected a timeout"
+
+    def test_put_many_wakes_several_consumers(self):
+        q = Queue()
+        got = []
+        def consumer():
+            got.append(q.get())
+        for i in xrange(3):
+            diesel.fork(consumer)
+        diesel.sleep()
+        q.put_many([1, 2, 3])
+        diesel.sleep(0.01)
+        assert sorted(got) == [1, 2, 3]
+
+class TestYieldPolicy(object):
+    def setup(self):
+        self.ticks = []
+        self.running = True
+        def ticker():
+            while self.running:
+                self.ticks.append(1)
+                diesel.sleep()
+        diesel.fork(ticker)
+        diesel.sleep()
+        del self.ticks[:]
+
+    def teardown(self):
+        self.running = False
+
+    def test_get_yields_after_every_item_by_default(self):
+        q = Queue()
+        q.put_many(range(10))
+        for i in xrange(10):
+            q.get()
+        assert len(self.ticks) >= 9, self.ticks
+
+    def test_yield_every_batches_the_yields(self):
+        q = Queue(yield_every=5)
+        q.put_many(range(10))
+        for i in xrange(4):
+            q.get()
+        assert not self.ticks
+        q.get()
+        assert len(self.ticks) == 1
+
+    def test_yield_every_per_call(self):
+        q = Queue()
+        q.put_many(range(10))
+        for i in xrange(9):
+            q.get(yield_every=10)
+        assert not self.ticks
+
+    def test_time_slice(self):
+        q = Queue(yield_every=1000, time_slice=0.01)
+        q.put_many(range(10))
+        q.get()
+        time.sleep(0.02)
+        q.get()
+        assert len(self.ticks) == 1
+
+    def test_drain_takes_everything_without_yielding(self):
+        q = Queue()
+        q.put_many(range(10))
+        assert list(q.drain()) == range(10)
+        assert not self.ticks
+        assert list(q.drain(waiting=False)) == []
+
+    def test_drain_waits_for_the_first_item(self):
+        q = Queue()
+        def producer():
+            q.put_many([1, 2])
+        diesel.fork(producer)
+        assert list(q.drain(timeout=1)) == [1, 2]
+
+class TestPriorityQueue(object):
+    def test_smallest_item_comes_first(self):
+        q = PriorityQueue()
+        q.put_many([5, 1, 4, 2, 3])
+        assert [q.get() for i in xrange(5)] == [1, 2, 3, 4, 5]
+
+    def test_equal_keys_keep_insertion_order(self):
+        q = PriorityQueue(key=itemgetter(0))
+        q.put_many([(1, 'b'), (0, 'z'), (1, 'a')])
+        assert q.get_many() == [(0, 'z'), (1, 'b'), (1, 'a')]
+
+    def test_waiting_consumer_gets_the_item(self):
+        q = PriorityQueue()
+        def producer():
+            q.put(7)
+        diesel.fork(producer)
+        assert q.get(timeout=1) == 7
+
+class TestDelayQueue(object):
+    def test_items_appear_when_due(self):
+        q = DelayQueue()
+        start = time.time()
+        q.put('later', delay=0.1)
+        q.put('sooner', delay=0.05)
+        q.put('now')
+        assert q.qsize() == 1
+        assert q.get() == 'now'
+        assert q.get(timeout=1) == 'sooner'
+        assert 0.04 < time.time() - start < 0.1
+        assert q.get(timeout=1) == 'later'
+        assert time.time() - start > 0.07
+
+    def test_one_timer_for_many_items(self):
+        q = DelayQueue()
+        for i in xrange(100):
+            q.put(i, delay=0.05 + i * 0.0001)
+        assert len(q.delayed) == 100
+        timer = q._timer
+        q.put('first', delay=0.04)
+        assert q._timer is not timer and not timer.pending
+        got = []
+        while len(got) < 101:
+            got.extend(q.get_many(timeout=1))
+        assert got == ['first'] + range(100)
+
+    def test_get_times_out_before_item_is_due(self):
+        q = DelayQueue()
+        q.put('x', delay=0.2)
+        try:
+            q.get(timeout=0.05)
+        except QueueTimeout:
+            pass
+        else:
+            assert 0, "expected a timeout"
+
+    def test_items_never_come_out_early(self):
+        q = DelayQueue()
+        due = {}
+        for i in xrange(20):
+            delay = 0.005 * (i + 1)
+            due[i] = time.time() + delay
+            q.put(i, delay=delay)
+        got = 0
+        while got < 20:
+            for i in q.get_many(timeout=1):
+                assert time.time() >= due[i], (i, due[i] - time.time())
+                got += 1
+
+    def test_put_keeps_queue_put_positional_arguments(self):
+        q = DelayQueue()
+        q.put('x', True, 1)
+        assert q.qsize() == 1 and not q.delayed
+
+    def test_put_many_with_a_delay(self):
+        q = DelayQueue()
+        start = time.time()
+        q.put_many(['a', 'b'], delay=0.05)
+        assert q.qsize() == 0
+        assert q.get_many(timeout=1) == ['a', 'b']
+        assert time.time() - start >= 0.05
+        q.put_many(['c'])
+        assert q.get(waiting=False) == 'c'
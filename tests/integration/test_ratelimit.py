@@ -0,0 +1,119 @@
+import socket
+import time
+
+import diesel
+from diesel import Service, runtime
+from diesel.util.event import Countdown
+from diesel.util.pool import ConnectionPool
+from diesel.util.ratelimit import (TokenBucket, SlidingWindow,
+                                   RateLimitTimeout)
+
+
+class TestTokenBucket(object):
+    def test_burst_then_steady_rate(self):
+        tb = TokenBucket(rate=50, burst=5)
+        for i in xrange(5):
+            assert tb.try_acquire()
+        assert not tb.try_acquire()
+        start = time.time()
+        for i in xrange(10):
+            tb.acquire()
+        elapsed = time.time() - start
+        assert 0.15 < elapsed < 0.35, elapsed
+
+    def test_waiters_are_served_in_order_with_one_timer(self):
+        tb = TokenBucket(rate=20, burst=1)
+        tb.acquire()
+        order = []
+        done = Countdown(5)
+        def taker(i):
+            tb.acquire()
+            order.append(i)
+            done.tick()
+        for i in xrange(5):
+            diesel.fork(taker, i)
+        diesel.sleep()
+        assert len(tb.waiting) == 5
+        timer = tb._timer
+        assert timer is not None and timer.pending
+        done.wait(1)
+        assert order == range(5)
+
+    def test_timeout_takes_nothing(self):
+        tb = TokenBucket(rate=1, burst=1)
+        tb.acquire()
+        try:
+            tb.acquire(timeout=0.05)
+        except RateLimitTimeout:
+            pass
+        else:
+            assert 0, "expected a timeout"
+        assert not tb.waiting or tb.waiting[0].cancelled
+
+    def test_oversized_requests_are_rejected(self):
+        tb = TokenBucket(rate=10, burst=2)
+        try:
+            tb.acquire(3)
+        except ValueError:
+            pass
+        else:
+            assert 0, "expected a ValueError"
+
+class TestSlidingWindow(object):
+    def test_limit_per_window(self):
+        sw = SlidingWindow(limit=3, window=0.2)
+        start = time.time()
+        for i in xrange(6):
+            sw.acquire()
+        elapsed = time.time() - start
+        assert 0.15 < elapsed < 0.35, elapsed
+        assert not sw.try_acquire()
+
+    def test_batch_acquire(self):
+        sw = SlidingWindow(limit=4, window=10)
+        assert sw.try_acquire(3)
+        assert not sw.try_acquire(2)
+        assert sw.try_acquire(1)
+
+class TestPoolLimit(object):
+    def test_checkouts_are_limited(self):
+        made = []
+        class Conn(object):
+            is_closed = False
+        def make():
+            made.append(1)
+            return Conn()
+        p = ConnectionPool(make, lambda c: None, rate_limit=TokenBucket(1, 1),
+                           poll_max_timeout=0.05)
+        p.release(p.get())
+        try:
+            p.get()
+        except RateLimitTimeout:
+            pass
+        else:
+            assert 0, "expected a timeout"
+
+class TestServiceLimit(object):
+    def setup(self):
+        self.handled = []
+        def handler(addr):
+            self.handled.append(addr)
+        self.service = Service(handler, 0, rate_limit=TokenBucket(20, 1))
+        runtime.current_app.add_service(self.service)
+
+    def teardown(self):
+        runtime.current_app.hub.unregister(self.service.sock)
+        self.service.sock.close()
+
+    def test_accepts_are_paced(self):
+        socks = []
+        for i in xrange(4):
+            s = socket.socket()
+            s.connect(('localhost', self.service.port))
+            socks.append(s)
+        diesel.sleep(0.05)
+        assert 1 <= len(self.handled) <= 2, self.handled
+        diesel.sleep(0.25)
+        assert len(self.handled) == 4, self.handled
+        for s in socks:
+            s.close()
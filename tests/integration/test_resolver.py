@@ -0,0 +1,149 @@
+import socket
+import time
+
+import diesel
+
+from dns.rdatatype import A, AAAA
+
+from diesel import resolver
+from diesel.protocols.DNS import NotFound, Timeout
+
+
+class FakeDNS(object):
+    '''Stands in for the network; answers from `records`.'''
+    def __init__(self, records):
+        self.records = records
+        self.queries = []
+        self.delay = 0
+        # rdtype -> seconds, overriding `delay`.
+        self.delays = {}
+
+    def __call__(self, name, rdtype):
+        self.queries.append((name, rdtype))
+        delay = self.delays.get(rdtype, self.delay)
+        if delay:
+            diesel.sleep(delay)
+        answer = self.records.get((name, rdtype), NotFound(name))
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+class ResolverHarness(object):
+    def setup(self):
+        self.saved = (resolver._query, resolver.CACHE_SIZE)
+        resolver.cache.clear()
+        self.dns = resolver._query = FakeDNS({
+            ('a.test', A): (['10.0.0.1'], 60),
+            ('a.test', AAAA): (['fd00::1'], 60),
+            ('short.test', A): (['10.0.0.2'], 0.1),
+            ('gone.test', A): NotFound('gone.test', 30),
+            ('gone.test', AAAA): NotFound('gone.test', 30),
+            ('slow.test', A): Timeout('slow.test'),
+        })
+
+    def teardown(self):
+        resolver._query, resolver.CACHE_SIZE = self.saved
+        resolver.cache.clear()
+
+class TestCache(ResolverHarness):
+    def test_answers_are_cached(self):
+        for i in xrange(5):
+            assert resolver.resolve_dns_name('a.test') == '10.0.0.1'
+        assert self.dns.queries == [('a.test', A)]
+
+    def test_ttl_is_honoured(self):
+        resolver.resolve_dns_name('short.test')
+        entry = resolver.cache[('short.test', A)]
+        assert entry.ttl == 0.1
+
+    def test_negative_answers_are_cached(self):
+        for i in xrange(3):
+            try:
+                resolver.resolve_dns_name('gone.test')
+            except resolver.DNSResolutionError:
+                pass
+            else:
+                assert 0, "expected a DNSResolutionError"
+        assert self.dns.queries == [('gone.test', A)]
+        assert resolver.cache[('gone.test', A)].ttl == 30
+
+    def test_timeouts_are_not_cached(self):
+        for i in xrange(2):
+            try:
+                resolver.resolve_dns_name('slow.test')
+            except resolver.DNSResolutionError:
+                pass
+        assert len(self.dns.queries) == 2
+
+    def test_stale_answer_served_while_refreshing(self):
+        resolver.resolve_dns_name('short.test')
+        diesel.sleep(0.15)
+        self.dns.records[('short.test', A)] = (['10.0.0.3'], 60)
+        self.dns.delay = 0.1
+        assert resolver.resolve_dns_name('short.test') == '10.0.0.2'
+        assert resolver.resolve_dns_name('short.test') == '10.0.0.2'
+        diesel.sleep(0.2)
+        assert resolver.resolve_dns_name('short.test') == '10.0.0.3'
+        assert len(self.dns.queries) == 2
+
+    def test_hot_names_are_prefetched(self):
+        self.dns.records[('short.test', A)] = (['10.0.0.2'], 1)
+        resolver.resolve_dns_name('short.test')
+        first = resolver.cache[('short.test', A)]
+        diesel.sleep(0.95)
+        resolver.resolve_dns_name('short.test')
+        resolver.resolve_dns_name('short.test')
+        diesel.sleep()
+        assert len(self.dns.queries) == 2
+        assert resolver.cache[('short.test', A)].expires > first.expires
+
+    def test_lru_bound(self):
+        resolver.CACHE_SIZE = 2
+        for i in xrange(3):
+            self.dns.records[('n%d.test' % i, A)] = (['10.1.0.%d' % i], 60)
+            resolver.resolve_dns_name('n%d.test' % i)
+        assert list(resolver.cache) == [('n1.test', A), ('n2.test', A)]
+
+class TestFamilies(ResolverHarness):
+    def test_unspec_gives_ipv6_first(self):
+        assert resolver.resolve_all('a.test') == ['fd00::1', '10.0.0.1']
+
+    def test_one_family_missing(self):
+        assert resolver.resolve_all('short.test') == ['10.0.0.2']
+
+    def test_ipv6_only(self):
+        assert resolver.resolve_dns_name('a.test', socket.AF_INET6) == 'fd00::1'
+
+    def test_both_families_are_asked_at_once(self):
+        self.dns.delay = 0.2
+        start = time.time()
+        assert resolver.resolve_all('a.test') == ['fd00::1', '10.0.0.1']
+        assert time.time() - start < 0.35
+
+    def test_slow_family_is_not_waited_for(self):
+        self.dns.delays = {AAAA: 0.5}
+        start = time.time()
+        assert resolver.resolve_all('a.test') == ['10.0.0.1']
+        assert time.time() - start < 0.3
+        # It still lands in the cache.
+        diesel.sleep(0.5)
+        assert resolver.resolve_all('a.test') == ['fd00::1', '10.0.0.1']
+
+    def test_literals(self):
+        assert resolver.resolve_all('::1') == ['::1']
+        assert resolver.resolve_dns_name('127.0.0.1') == '127.0.0.1'
+        assert not self.dns.queries
+
+class TestResolveMany(ResolverHarness):
+    def test_names_are_resolved_concurrently(self):
+        self.dns.delay = 0.2
+        start = time.time()
+        results = resolver.resolve_many(['a.test', 'short.test', 'gone.test'],
+                socket.AF_INET)
+        assert time.time() - start < 0.35
+        assert results['a.test'] == ['10.0.0.1']
+        assert results['short.test'] == ['10.0.0.2']
+        assert isinstance(results['gone.test'], resolver.DNSResolutionError)
+
+    def test_empty(self):
+        assert resolver.resolve_many([]) == {}
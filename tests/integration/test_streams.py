@@ -0,0 +1,67 @@
+import errno
+import os
+import tempfile
+
+import diesel
+
+from diesel.util.streams import open_fd, create_line_input_stream
+
+
+class TestOpenFd(object):
+    def setup(self):
+        r, self.w = os.pipe()
+        self.stream = open_fd(r)
+
+    def teardown(self):
+        self.stream.close()
+        if self.w is not None:
+            os.close(self.w)
+
+    def test_until_eol_inside_with(self):
+        os.write(self.w, 'hello\r\nworld\r\n')
+        with self.stream:
+            assert diesel.until_eol() == 'hello\r\n'
+            assert diesel.receive(5) == 'world'
+
+    def test_with_block_closes_the_fd(self):
+        with self.stream:
+            pass
+        assert self.stream.closed
+        # With the read end gone, writes fail.
+        try:
+            os.write(self.w, 'x')
+        except OSError, e:
+            assert e.errno == errno.EPIPE
+        else:
+            assert 0, "the read end is still open"
+
+    def test_reads_wait_for_the_writer(self):
+        def writer():
+            diesel.sleep(0.05)
+            os.write(self.w, 'late line\n')
+        diesel.fork(writer)
+        assert self.stream.readline() == 'late line\n'
+
+    def test_eof_returns_leftovers(self):
+        os.write(self.w, 'a\nb')
+        os.close(self.w)
+        self.w = None
+        assert list(self.stream) == ['a\n', 'b']
+        assert self.stream.read() == ''
+
+    def test_regular_files_are_refused(self):
+        with tempfile.TemporaryFile() as f:
+            try:
+                open_fd(f.fileno())
+            except ValueError:
+                pass
+            else:
+                assert 0, "expected a ValueError"
+
+class TestLineInputStream(object):
+    def test_pipe_is_read_without_threads(self):
+        r, w = os.pipe()
+        q = create_line_input_stream(os.fdopen(r))
+        os.write(w, 'one\ntwo\n')
+        os.close(w)
+        assert [q.get(), q.get(), q.get()] == ['one\n', 'two\n', '']
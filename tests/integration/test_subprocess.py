@@ -0,0 +1,124 @@
+import errno
+import os
+import time
+
+import diesel
+
+from diesel.util import subprocess as dsubprocess
+from diesel.util.event import Countdown
+from diesel.util.subprocess import (Popen, PIPE, STDOUT, SubprocessTimeout,
+        check_output)
+
+
+class TestStreams(object):
+    def test_lines_and_leftovers(self):
+        p = Popen(['printf', 'one\ntwo\nthree'], stdout=PIPE)
+        assert p.stdout.readline() == 'one\n'
+        assert list(p.stdout) == ['two\n', 'three']
+        assert p.stdout.readline() == ''
+        assert p.wait() == 0
+
+    def test_round_trip_through_stdin(self):
+        p = Popen(['cat'], stdin=PIPE, stdout=PIPE)
+        p.stdin.write('x' * 500000)
+        p.stdin.close()
+        assert p.stdout.read() == 'x' * 500000
+        assert p.wait() == 0
+
+    def test_read_n(self):
+        p = Popen(['printf', 'abcdef'], stdout=PIPE)
+        assert p.stdout.read(4) == 'abcd'
+        assert p.stdout.read(4) == 'ef'
+
+    def test_communicate(self):
+        p = Popen(['sh', '-c', 'cat; echo oops >&2; exit 3'],
+                stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        out, err = p.communicate('hello')
+        assert (out, err, p.returncode) == ('hello', 'oops\n', 3)
+
+    def test_stderr_to_stdout(self):
+        out = check_output(['sh', '-c', 'echo a; echo b >&2'], stderr=STDOUT)
+        assert sorted(out.split()) == ['a', 'b']
+
+    def test_check_output_raises(self):
+        try:
+            check_output(['false'])
+        except dsubprocess.CalledProcessError, e:
+            assert e.returncode == 1
+        else:
+            assert 0, "expected CalledProcessError"
+
+class TestExit(object):
+    def test_wait_timeout(self):
+        p = Popen(['sleep', '5'])
+        try:
+            p.wait(timeout=0.1)
+        except SubprocessTimeout:
+            pass
+        else:
+            assert 0, "expected a SubprocessTimeout"
+        p.kill()
+        assert p.wait(1) == -9
+
+    def test_communicate_timeout_covers_the_reads(self):
+        # The shell exits at once, but its background child keeps stdout
+        # open.
+        p = Popen(['sh', '-c', 'sleep 5 & echo started'], stdout=PIPE)
+        start = time.time()
+        try:
+            p.communicate(timeout=0.2)
+        except SubprocessTimeout:
+            pass
+        else:
+            assert 0, "expected a SubprocessTimeout"
+        assert time.time() - start < 1
+
+    def test_many_concurrent_children(self):
+        done = Countdown(100)
+        codes = []
+        def run(i):
+            codes.append(Popen(['sh', '-c', 'exit %d' % (i % 5)]).wait())
+            done.tick()
+        for i in xrange(100):
+            diesel.fork(run, i)
+        done.wait(10)
+        assert sorted(codes) == sorted(i % 5 for i in xrange(100))
+
+class TestSigchld(object):
+    def setup(self):
+        self.had = dsubprocess._have_pidfd
+        dsubprocess._have_pidfd = False
+
+    def teardown(self):
+        dsubprocess._have_pidfd = self.had
+
+    def test_reaped_without_pidfd(self):
+        procs = [Popen(['sh', '-c', 'exit 7']) for i in xrange(5)]
+        assert [p.wait(2) for p in procs] == [7] * 5
+        assert not dsubprocess._sigchld_watched
+
+    def test_status_lost_to_another_reaper(self):
+        # Held on a pipe only the test can close, so the sweeps can't
+        # reap it first.
+        r, w = os.pipe()
+        p = Popen(['sh', '-c', 'read x; exit 7'], stdin=r, close_fds=True)
+        os.close(r)
+        statuses = []
+        reaped = p._reaped
+        def record(status):
+            statuses.append(status)
+            reaped(status)
+        p._reaped = record
+        assert not p.gone
+        os.close(w)
+        # Blocks the loop, so nothing else can get to it in between.
+        pid, status = os.waitpid(p.pid, 0)
+        assert os.WEXITSTATUS(status) == 7
+        try:
+            p.wait(2)
+        except OSError, e:
+            assert e.errno == errno.ECHILD
+        else:
+            assert 0, "expected OSError(ECHILD)"
+        assert statuses == [None]
+        assert p.returncode is None
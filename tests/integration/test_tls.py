@@ -0,0 +1,129 @@
+import os
+
+import diesel
+from diesel import Client, Service, call, send, until_eol, runtime
+from diesel.security import (server_context, client_context, SessionCache,
+                             get_backend, PYOPENSSL, STDLIB)
+
+CERTS = os.path.join(os.path.dirname(__file__), '..', '..', 'examples')
+
+class EchoClient(Client):
+    @call
+    def echo(self, message):
+        send(message + '\r\n')
+        return until_eol().rstrip()
+
+def session_reused(client):
+    '''Whether the client's TLS handshake resumed a session.'''
+    sock = client.conn.sock
+    reused = getattr(sock, 'session_reused', None)
+    if reused is not None:
+        # pyOpenSSL 20+ has a method; the stdlib (3.6+) a property.
+        return bool(reused() if callable(reused) else reused)
+    from OpenSSL.SSL import _lib
+    return bool(_lib.SSL_session_reused(sock._ssl))
+
+def handler(addr):
+    while True:
+        send(until_eol())
+
+class TestSessionResumption(object):
+    def setup(self):
+        ctx = server_context(os.path.join(CERTS, 'snakeoil-cert.pem'),
+                             os.path.join(CERTS, 'snakeoil-key.pem'))
+        self.service = Service(handler, 0, ssl_ctx=ctx)
+        runtime.current_app.add_service(self.service)
+        self.sessions = SessionCache()
+        self.ctx = client_context()
+
+    def teardown(self):
+        runtime.current_app.hub.unregister(self.service.sock)
+        self.service.sock.close()
+
+    def connect(self):
+        return EchoClient('localhost', self.service.port, ssl_ctx=self.ctx,
+                          ssl_session_cache=self.sessions)
+
+    def test_sessions_are_cached_by_host_and_port(self):
+        with self.connect() as c:
+            assert c.echo('hi') == 'hi'
+        assert self.sessions.get(('localhost', self.service.port)) is not None
+
+    def test_reconnects_with_a_cached_session_work(self):
+        for i in xrange(3):
+            with self.connect() as c:
+                assert c.echo('hi %d' % i) == 'hi %d' % i
+                # The first connection has nothing to resume; the rest
+                # must actually resume, not just connect.
+                assert session_reused(c) == (i > 0), i
+        assert len(self.sessions) == 1
+
+class BackendHarness(object):
+    server_backend = 'stdlib'
+
+    def setup(self):
+        ctx = server_context(os.path.join(CERTS, 'snakeoil-cert.pem'),
+                             os.path.join(CERTS, 'snakeoil-key.pem'),
+                             backend=self.server_backend)
+        self.service = Service(handler, 0, ssl_ctx=ctx)
+        runtime.current_app.add_service(self.service)
+
+    def teardown(self):
+        runtime.current_app.hub.unregister(self.service.sock)
+        self.service.sock.close()
+
+    def connect(self, backend):
+        return EchoClient('localhost', self.service.port,
+                          ssl_ctx=client_context(backend=backend))
+
+class TestStdlibServer(BackendHarness):
+    def test_stdlib_client(self):
+        with self.connect('stdlib') as c:
+            assert c.conn.tls is STDLIB
+            assert c.echo('hi') == 'hi'
+
+    def test_pyopenssl_client(self):
+        with self.connect('pyopenssl') as c:
+            assert c.conn.tls is PYOPENSSL
+            assert c.echo('hi') == 'hi'
+
+    def test_large_messages_survive_partial_writes(self):
+        line = 'x' * (1024 * 1024)
+        with self.connect('stdlib') as c:
+            assert c.echo(line) == line
+
+class TestPyOpenSSLServer(BackendHarness):
+    server_backend = 'pyopenssl'
+
+    def test_stdlib_client(self):
+        with self.connect('stdlib') as c:
+            assert c.echo('hi') == 'hi'
+
+class TestGetBackend(object):
+    def test_backend_follows_context_type(self):
+        assert get_backend(client_context()) is PYOPENSSL
+        assert get_backend(client_context(backend='stdlib')) is STDLIB
+
+    def test_unknown_contexts_are_rejected(self):
+        try:
+            get_backend(object())
+        except TypeError:
+            pass
+        else:
+            assert 0, "expected a TypeError"
+
+class TestSessionCache(object):
+    def test_least_recently_used_is_evicted(self):
+        cache = SessionCache(size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+
+    def test_none_sessions_are_not_stored(self):
+        cache = SessionCache()
+        cache.put('a', None)
+        assert len(cache) == 0
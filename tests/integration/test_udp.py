@@ -0,0 +1,67 @@
+import diesel
+from diesel import (UDPService, UDPClient, call, send, receive, datagram,
+                    first, runtime)
+import diesel.core
+
+
+class EchoClient(UDPClient):
+    @call
+    def say(self, msg):
+        send(msg)
+        ev, val = first(datagram=True, sleep=1)
+        assert ev == 'datagram', "timed out waiting for a reply"
+        return val
+
+    @call
+    def burst(self, msgs):
+        for m in msgs:
+            send(m)
+        replies = []
+        while len(replies) < len(msgs):
+            ev, val = first(datagram=True, sleep=1)
+            assert ev == 'datagram', "timed out waiting for replies"
+            replies.append(val)
+        return replies
+
+def echo_server():
+    me = diesel.core.current_loop.id
+    while True:
+        data = receive(datagram)
+        send('%s:%s' % (me, data))
+
+class UDPHarness(object):
+    workers = None
+
+    def setup(self):
+        self.service = UDPService(echo_server, 0, workers=self.workers)
+        runtime.current_app.add_service(self.service)
+        self.port = self.service.sock.getsockname()[1]
+
+    def teardown(self):
+        runtime.current_app.hub.unregister(self.service.sock)
+        self.service.sock.close()
+
+class TestSingleLoop(UDPHarness):
+    def test_echo(self):
+        c = EchoClient('127.0.0.1', self.port)
+        assert c.say('hello').split(':', 1)[1] == 'hello'
+
+    def test_burst_is_fully_delivered(self):
+        c = EchoClient('127.0.0.1', self.port)
+        msgs = [str(i) for i in xrange(200)]
+        replies = c.burst(msgs)
+        assert sorted(r.split(':', 1)[1] for r in replies) == sorted(msgs)
+
+class TestWorkerDispatch(UDPHarness):
+    workers = 4
+
+    def test_each_peer_sticks_to_one_worker(self):
+        clients = [EchoClient('127.0.0.1', self.port) for i in xrange(8)]
+        for c in clients:
+            workers = set(c.say(str(i)).split(':')[0] for i in xrange(5))
+            assert len(workers) == 1, workers
+
+    def test_replies_go_to_the_right_peer(self):
+        clients = [EchoClient('127.0.0.1', self.port) for i in xrange(8)]
+        for n, c in enumerate(clients):
+            assert c.say('peer %d' % n).split(':', 1)[1] == 'peer %d' % n
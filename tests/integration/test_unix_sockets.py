@@ -0,0 +1,84 @@
+import errno
+import os
+import socket
+import tempfile
+import uuid
+
+import diesel
+from diesel import Client, Service, call, send, until_eol, runtime
+from diesel.unix import UnixPeer
+
+
+class EchoClient(Client):
+    @call
+    def echo(self, message):
+        send(message + '\r\n')
+        return until_eol().rstrip()
+
+class UnixHarness(object):
+    def setup(self):
+        self.peers = []
+        self.service = Service(self.handler, path=self.make_path())
+        runtime.current_app.add_service(self.service)
+
+    def teardown(self):
+        self.service.close()
+
+    def handler(self, addr):
+        self.peers.append(addr)
+        while True:
+            send(until_eol())
+
+class TestFilesystemSocket(UnixHarness):
+    def make_path(self):
+        return os.path.join(tempfile.gettempdir(), 'diesel-%s.sock' % uuid.uuid4().hex)
+
+    def test_round_trip(self):
+        with EchoClient(path=self.service.path) as c:
+            assert c.echo('hello') == 'hello'
+
+    def test_handler_gets_peer_credentials(self):
+        with EchoClient(path=self.service.path) as c:
+            c.echo('hello')
+        peer = self.peers[0]
+        assert isinstance(peer, UnixPeer)
+        assert peer.path == self.service.path
+        assert peer.pid == os.getpid()
+        assert peer.uid == os.getuid()
+
+    def test_live_socket_is_not_taken_over(self):
+        second = Service(self.handler, path=self.service.path)
+        second.application = runtime.current_app
+        try:
+            second.bind_and_listen()
+        except socket.error, e:
+            assert e.errno == errno.EADDRINUSE
+        else:
+            second.close()
+            assert 0, "expected EADDRINUSE"
+        with EchoClient(path=self.service.path) as c:
+            assert c.echo('still mine') == 'still mine'
+
+    def test_stale_socket_is_replaced(self):
+        path = self.service.path
+        self.service.close()
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        self.service = Service(self.handler, path=path)
+        runtime.current_app.add_service(self.service)
+        with EchoClient(path=path) as c:
+            assert c.echo('hello') == 'hello'
+
+    def test_close_removes_the_socket_file(self):
+        self.service.close()
+        assert not os.path.exists(self.service.path)
+
+class TestAbstractSocket(UnixHarness):
+    def make_path(self):
+        return '@diesel-%s' % uuid.uuid4().hex
+
+    def test_round_trip(self):
+        with EchoClient(path=self.service.path) as c:
+            assert c.echo('abstract') == 'abstract'
+        assert not os.path.exists(self.service.path)
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+# Generous, so a slow machine doesn't fail it; it's there to catch an
+# eager import of something heavy creeping back in.
+IMPORT_BUDGET = 0.5
+
+# Only imported once something needs them.
+DEFERRED = ['OpenSSL', 'flask', 'werkzeug', 'dns']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run(code):
+    out = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', code],
+            cwd=ROOT)
+    return out.split()
+
+def time_import(module):
+    '''Best of three fresh-interpreter imports of `module`, in seconds.'''
+    return min(float(run('import time; t = time.time(); import %s; '
+            'print time.time() - t' % module)[0]) for i in xrange(3))
+
+def loaded_after(module):
+    return run('import sys, %s; print " ".join(sys.modules)' % module)
+
+def test_import_diesel_time():
+    took = time_import('diesel')
+    assert took < IMPORT_BUDGET, 'import diesel took %.1fms' % (took * 1000)
+
+def test_import_diesel_defers_heavy_dependencies():
+    loaded = loaded_after('diesel')
+    for module in DEFERRED:
+        assert module not in loaded, module
+
+def test_http_client_does_not_need_flask():
+    loaded = loaded_after('diesel.protocols.http')
+    assert 'flask' not in loaded
+    assert 'OpenSSL' not in loaded
+    assert 'ctypes' not in loaded
+
+def test_http_response_imports_flask_when_called():
+    out = run('from diesel.protocols import http; '
+            'print http.Response("hi").__class__.__module__')
+    assert out == ['flask.wrappers'], out
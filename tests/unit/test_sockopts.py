@@ -0,0 +1,53 @@
+import socket
+
+from diesel.sockopts import SocketProfile, LATENCY, BULK, get_profile
+
+
+def test_get_profile_by_name():
+    assert get_profile('latency') is LATENCY
+    assert get_profile(None) is None
+    assert get_profile(BULK) is BULK
+
+def test_get_profile_unknown_name():
+    try:
+        get_profile('warp-speed')
+    except ValueError:
+        pass
+    else:
+        assert 0, "expected ValueError"
+
+def test_derive_overrides_and_keeps_the_rest():
+    p = LATENCY.derive(keepidle=5)
+    assert p.keepidle == 5
+    assert p.nodelay == LATENCY.nodelay
+    assert LATENCY.keepidle != 5
+
+def test_unknown_options_are_rejected():
+    try:
+        SocketProfile(nagle=False)
+    except TypeError:
+        pass
+    else:
+        assert 0, "expected TypeError"
+
+def test_apply_outbound_sets_nodelay_and_buffers():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        SocketProfile(nodelay=True, sndbuf=65536).apply_outbound(s)
+        assert s.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert s.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= 65536
+    finally:
+        s.close()
+
+def test_stock_profiles_leave_client_fastopen_off():
+    from diesel.sockopts import PROFILES, TCP_FASTOPEN_CONNECT
+    for profile in PROFILES.itervalues():
+        assert not profile.fastopen_connect, profile
+    if TCP_FASTOPEN_CONNECT is None:
+        return
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        LATENCY.apply_outbound(s)
+        assert not s.getsockopt(socket.IPPROTO_TCP, TCP_FASTOPEN_CONNECT)
+    finally:
+        s.close()
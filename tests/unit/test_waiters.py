@@ -1,5 +1,5 @@
 from diesel.events import (
-    Waiter, WaitPool, EarlyValue, StringWaiter,
+    Waiter, WaitPool, WaitQueue, EarlyValue, StaticValue, StopWaitDispatch,
 )
 
 
@@ -14,17 +14,6 @@ class Who(object):
     """Someone who is waiting ..."""
     pass
 
-class TestStringWaiters(object):
-    def test_string_waiters_for_the_same_string_have_the_same_wait_id(self):
-        s1 = StringWaiter("asdf")
-        s2 = StringWaiter("asdf")
-        assert s1.wait_id == s2.wait_id
-
-    def test_string_waiters_for_different_strings_have_different_wait_ids(self):
-        s1 = StringWaiter("asdf")
-        s2 = StringWaiter("jkl;")
-        assert s1.wait_id != s2.wait_id
-
 class TestWaitPoolWithEarlyReturn(object):
     def setup(self):
         self.pool = WaitPool()
@@ -36,8 +25,8 @@ class TestWaitPoolWithEarlyReturn(object):
         assert isinstance(self.result, EarlyValue)
         assert self.result.val == "foo"
 
-    def test_waiter_wait_id_not_added_to_wait_pool(self):
-        assert self.waiter.wait_id not in self.pool.waits
+    def test_waiter_has_no_parked_loops(self):
+        assert not self.waiter._waiters
 
     def test_who_not_added_to_wait_pool(self):
         assert self.who not in self.pool.loop_refs
@@ -54,9 +43,119 @@ class TestWaitPoolWithStringWaiter(object):
         w = self.pool.waits[self.wait_for].pop()
         assert w is self.who
 
-    def test_StringWaiter_added_to_wait_pool(self):
+    def test_string_is_referenced_as_is(self):
         v = self.pool.loop_refs[self.who].pop()
-        assert isinstance(v, StringWaiter)
+        assert v is self.wait_for
 
-    def test_result_is_wait_id(self):
+    def test_result_is_the_string(self):
         assert self.result == self.wait_for
+
+    def test_clear_drops_the_string(self):
+        self.pool.clear(self.who)
+        assert self.wait_for not in self.pool.waits
+        assert self.who not in self.pool.loop_refs
+
+class FiredWaiter(Waiter):
+    pass
+
+class Loopish(object):
+    fire_due = False
+    def __init__(self):
+        self.fired = []
+    def fire_in(self, what, value):
+        self.fired.append((what, value))
+
+class TestWaitPoolWithWaiter(object):
+    def setup(self):
+        self.pool = WaitPool()
+        self.who = Loopish()
+        self.waiter = FiredWaiter()
+        self.result = self.pool.wait(self.who, self.waiter)
+
+    def test_result_is_the_waiter(self):
+        assert self.result is self.waiter
+
+    def test_loop_is_parked_on_the_waiter(self):
+        assert self.who in self.waiter._waiters
+        assert not self.pool.waits
+
+    def test_fire_reaches_the_loop(self):
+        self.pool.fire(self.waiter, 42)
+        assert self.who.fired == [(self.waiter, 42)]
+
+    def test_clear_unparks_the_loop(self):
+        self.pool.clear(self.who)
+        assert not self.waiter._waiters
+        self.pool.fire(self.waiter, 42)
+        assert self.who.fired == []
+
+    def test_clearing_an_idle_loop_is_harmless(self):
+        self.pool.clear(Loopish())
+
+class TestWaitQueue(object):
+    def setup(self):
+        self.q = WaitQueue()
+        for who in 'abcd':
+            self.q.add(who)
+
+    def test_loops_leave_in_arrival_order(self):
+        assert [self.q.popleft() for i in xrange(4)] == list('abcd')
+        assert self.q.popleft() is None
+
+    def test_discarded_loops_are_skipped(self):
+        self.q.discard('a')
+        self.q.discard('c')
+        assert list(self.q) == ['b', 'd']
+        assert self.q.peek() == 'b'
+        assert len(self.q) == 2
+
+    def test_readded_loops_go_to_the_back(self):
+        self.q.discard('a')
+        self.q.add('a')
+        assert self.q.drain() == list('bcda')
+        assert not self.q
+
+    def test_stale_entries_are_compacted(self):
+        q = WaitQueue()
+        for i in xrange(100):
+            q.add(i)
+        for i in xrange(99):
+            q.discard(i)
+        assert len(q.order) < 40
+        assert q.popleft() == 99
+
+class CountingWaiter(Waiter):
+    fifo = True
+    def __init__(self, items):
+        self.items = items
+    def process_fire(self, value):
+        if not self.items:
+            raise StopWaitDispatch()
+        return self.items.pop(0)
+
+class BroadcastWaiter(Waiter):
+    fifo = True
+    def process_fire(self, value):
+        return StaticValue(value)
+
+class TestFifoDispatch(object):
+    def setup(self):
+        self.pool = WaitPool()
+        self.loops = [Loopish() for i in xrange(3)]
+
+    def test_values_go_to_the_oldest_waiters(self):
+        waiter = CountingWaiter(['x', 'y'])
+        for l in self.loops:
+            self.pool.wait(l, waiter)
+        self.pool.fire(waiter, None)
+        assert [l.fired for l in self.loops] == [
+            [(waiter, 'x')], [(waiter, 'y')], []]
+        assert list(waiter._waiters) == [self.loops[2]]
+
+    def test_static_values_wake_everyone(self):
+        waiter = BroadcastWaiter()
+        for l in self.loops:
+            self.pool.wait(l, waiter)
+        self.pool.fire(waiter, 'go')
+        assert [l.fired for l in self.loops] == [[(waiter, 'go')]] * 3
+        assert not waiter._waiters